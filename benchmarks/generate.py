@@ -0,0 +1,132 @@
+"""
+Synthetic IRVE CSV files, shaped after the consolidated file of data.gouv.fr, for
+benchmarking the pipeline at the scale of the national file and beyond.
+
+Every station gets PDCs sharing its station attributes. A share of the stations
+(error_rate) carries one of the issues the pipeline checks, and a share of them
+(duplicate_rate) is published a second time by another organisation. Operators
+are drawn with a long tail, as in the real file. Output files ending in .gz, .bz2
+or .xz are compressed. Run it with:
+`python -m benchmarks.generate --scale 10 bench_10x.csv.gz`
+"""
+import argparse
+import bz2
+import csv
+import gzip
+import itertools
+import lzma
+import random
+
+HEADER = ['nom_amenageur', 'siren_amenageur', 'contact_amenageur', 'nom_operateur', 'contact_operateur', 'telephone_operateur',
+          'nom_enseigne', 'id_station_itinerance', 'id_station_local', 'nom_station', 'implantation_station', 'adresse_station',
+          'code_insee_commune', 'coordonneesXY', 'nbre_pdc', 'id_pdc_itinerance', 'id_pdc_local', 'puissance_nominale',
+          'prise_type_ef', 'prise_type_2', 'prise_type_combo_ccs', 'prise_type_chademo', 'prise_type_autre', 'gratuit',
+          'paiement_acte', 'paiement_cb', 'paiement_autre', 'tarification', 'condition_acces', 'reservation', 'horaires',
+          'accessibilite_pmr', 'restriction_gabarit', 'station_deux_roues', 'raccordement', 'num_pdl', 'date_mise_en_service',
+          'observations', 'date_maj', 'cable_t2_attache', 'last_modified', 'datagouv_dataset_id', 'datagouv_resource_id',
+          'datagouv_organization_or_owner', 'consolidated_longitude', 'consolidated_latitude', 'consolidated_code_postal',
+          'consolidated_commune', 'consolidated_is_lon_lat_correct', 'consolidated_is_code_insee_verified']
+
+# Approximate size of the national file (scale 1)
+NATIONAL_STATIONS = 60000
+PDC_PER_STATION = 3
+
+ISSUES = ['no_id', 'not_concerned', 'id_without_separators', 'invalid_id', 'invalid_coord', 'invalid_phone',
+          'invalid_deux_roues', 'nbre_pdc', 'no_socket', 'power_in_watts', 'horaires', 'gratuit']
+POWERS = ['3.7', '7.4', '11', '22', '22', '22', '50', '100', '150', '350']
+# (EF, T2, CCS, CHAdeMO) sockets of a PDC
+SOCKETS = [(False, True, False, False), (True, True, False, False), (False, False, True, False),
+           (False, False, True, True), (False, True, True, True)]
+
+def _open_output(file_name):
+    for extension, module in ((".gz", gzip), (".bz2", bz2), (".xz", lzma)):
+        if file_name.endswith(extension):
+            return module.open(file_name, 'wt', newline='')
+    return open(file_name, 'w', newline='')
+
+def _operators(count, rng):
+    names = ["Opérateur %d" % i for i in range(count)]
+    codes = ["".join(rng.choice("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789") for _ in range(3)) for _ in range(count)]
+    # Long tail: weight 1/rank
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(count)))
+    return list(zip(names, codes)), cum_weights
+
+def generate(out, stations, pdc_per_station=PDC_PER_STATION, error_rate=0.05, duplicate_rate=0.01, operator_count=500, seed=0):
+    """ Writes the header and the rows of the given number of stations to the out text file. Returns the row count """
+    rng = random.Random(seed)
+    operators, cum_weights = _operators(operator_count, rng)
+    organisations = ["org-%d" % i for i in range(max(operator_count // 5, 2))]
+    writer = csv.writer(out)
+    writer.writerow(HEADER)
+    row_count = 0
+    for s in range(stations):
+        (operator, code), = rng.choices(operators, cum_weights=cum_weights)
+        station_id = "FR*%s*P%07d*%d" % (code, s, rng.randrange(10))
+        issue = rng.choice(ISSUES) if rng.random() < error_rate else None
+        pdc_count = max(1, round(rng.expovariate(1 / pdc_per_station)))
+        station = dict.fromkeys(HEADER, '')
+        station.update(
+            nom_amenageur=operator, siren_amenageur="%09d" % rng.randrange(10 ** 9), contact_amenageur="contact@example.com",
+            nom_operateur=operator, contact_operateur="support@example.com", telephone_operateur="0%09d" % rng.randrange(10 ** 9),
+            nom_enseigne=operator, id_station_itinerance=station_id, id_station_local="%s-%d" % (code, s),
+            nom_station="Station %d" % s, implantation_station="Voirie", adresse_station="%d rue de la Gare" % s,
+            code_insee_commune="%05d" % rng.randrange(1000, 96000), nbre_pdc=str(pdc_count),
+            gratuit="false", paiement_acte="true", paiement_cb="true", reservation="false", horaires="24/7",
+            accessibilite_pmr="Accessibilité inconnue", station_deux_roues="false", date_maj="2024-01-01",
+            datagouv_organization_or_owner=rng.choice(organisations),
+            consolidated_longitude="%.6f" % rng.uniform(-5, 9.5), consolidated_latitude="%.6f" % rng.uniform(41.5, 51))
+        if issue == 'no_id':
+            station['id_station_itinerance'] = ''
+        elif issue == 'not_concerned':
+            station['id_station_itinerance'] = "Non concerné"
+        elif issue == 'id_without_separators':
+            station['id_station_itinerance'] = station_id.replace("*", "")
+        elif issue == 'invalid_id':
+            station['id_station_itinerance'] = "%s%d" % (code, s)
+        elif issue == 'invalid_coord':
+            station['consolidated_longitude'] = ''
+        elif issue == 'invalid_phone':
+            station['telephone_operateur'] = "tel. %d" % rng.randrange(100)
+        elif issue == 'invalid_deux_roues':
+            station['station_deux_roues'] = "oui"
+        elif issue == 'nbre_pdc':
+            station['nbre_pdc'] = str(pdc_count + 1)
+
+        publications = [station['datagouv_organization_or_owner']]
+        if rng.random() < duplicate_rate:
+            publications.append(rng.choice(organisations))
+        for organisation in publications:
+            for p in range(pdc_count):
+                row = dict(station, datagouv_organization_or_owner=organisation)
+                ef, t2, ccs, chademo = (False,) * 4 if issue == 'no_socket' else rng.choice(SOCKETS)
+                power = rng.choice(POWERS[-4:] if ccs or chademo else POWERS[:-4])
+                if issue == 'power_in_watts' and p == 0:
+                    power = str(int(float(power) * 1000))
+                row.update(
+                    id_pdc_itinerance="%sE%d" % (row['id_station_itinerance'], p + 1), id_pdc_local="%d-%d" % (s, p + 1),
+                    puissance_nominale=power, prise_type_ef=str(ef).lower(), prise_type_2=str(t2).lower(),
+                    prise_type_combo_ccs=str(ccs).lower(), prise_type_chademo=str(chademo).lower(), prise_type_autre="false")
+                if issue == 'horaires' and p == 1:
+                    row['horaires'] = "Mo-Fr 08:00-20:00"
+                elif issue == 'gratuit' and p == 1:
+                    row['gratuit'] = "true"
+                writer.writerow([row[column] for column in HEADER])
+                row_count += 1
+    return row_count
+
+parser = argparse.ArgumentParser(description='Generates a synthetic IRVE CSV file')
+parser.add_argument('output', help='Output file name, compressed if it ends in .gz, .bz2 or .xz')
+parser.add_argument('--scale', type=float, default=1, help='Size relative to the national file (%d stations). Default is 1' % NATIONAL_STATIONS)
+parser.add_argument('--stations', type=int, help='Station count, overrides --scale')
+parser.add_argument('--pdc-per-station', type=float, default=PDC_PER_STATION, help='Mean PDC count per station. Default is %(default)s')
+parser.add_argument('--error-rate', type=float, default=0.05, help='Share of the stations having an issue. Default is %(default)s')
+parser.add_argument('--duplicate-rate', type=float, default=0.01, help='Share of the stations published twice. Default is %(default)s')
+parser.add_argument('--operators', type=int, default=500, help='Distinct operator count. Default is %(default)s')
+parser.add_argument('--seed', type=int, default=0, help='Random seed. Default is %(default)s')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    stations = args.stations if args.stations is not None else round(args.scale * NATIONAL_STATIONS)
+    with _open_output(args.output) as out:
+        row_count = generate(out, stations, args.pdc_per_station, args.error_rate, args.duplicate_rate, args.operators, args.seed)
+    print("%d stations, %d rows written to %s" % (stations, row_count, args.output))
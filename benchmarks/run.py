@@ -0,0 +1,176 @@
+"""
+Times every stage of the pipeline on synthetic inputs of increasing size, and
+compares the timings to stored baselines.
+
+Inputs are generated by benchmarks.generate at the requested scales (1 is about the
+size of the national file) and kept in the work directory for later runs. Stages are
+timed separately, each on the whole input:
+- parse: csv.DictReader over the input,
+- validation: the row checks of grouping.add_row (ids, coordinates),
+- grouping: grouping.group_rows, validation included,
+- power: grouping.finalize_stations (station checks and max power per socket type),
+- duplicates: duplicates.report_duplicates (nearby stations under different ids),
+- write_csv: writers.write_outputs (stations and networks CSV),
+- report, html: Report.generate_report (and store_history) and Report.render_html,
+- sqlite: sqlite_export.create_sqlite.
+A stage is a regression when it is THRESHOLD times slower than its baseline (and
+at least MIN_DELTA seconds slower). Run it from the root of the repository with:
+`python -m benchmarks.run --scales 1 10`
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import modules.import_logger as log
+from modules import duplicates, report, sqlite_export, writers
+from modules.compressed import open_input
+from modules.grouping import load_wrong_ortho, group_rows, finalize_stations, validate_coord, is_correct_id
+from modules.input_stats import InputStats
+from modules.normalize import clear_caches, transformRef
+from . import generate
+
+STAGES = ['parse', 'validation', 'grouping', 'power', 'duplicates', 'write_csv', 'report', 'html', 'sqlite']
+BASELINE_FILE = "benchmarks/baseline.json"
+WORK_DIR = "cache/benchmarks"
+THRESHOLD = 1.25
+MIN_DELTA = 0.05 # seconds
+CHUNK_SIZE = 10000
+
+def input_file(work_dir, scale, seed):
+    """ Synthetic input of the given scale, generated once """
+    file_name = os.path.join(work_dir, "irve_%gx_%d.csv" % (scale, seed))
+    if not os.path.isfile(file_name):
+        os.makedirs(work_dir, exist_ok=True)
+        with open(file_name + ".tmp", 'w', newline='') as out:
+            generate.generate(out, round(scale * generate.NATIONAL_STATIONS), seed=seed)
+        os.replace(file_name + ".tmp", file_name)
+    return file_name
+
+def validate_rows(rows):
+    """ The row checks of grouping.add_row, without the grouping """
+    valid = 0
+    for row in rows:
+        station_id = row['id_station_itinerance']
+        if station_id == "" or station_id == "Non concerné":
+            continue
+        if validate_coord(row["consolidated_longitude"]) and validate_coord(row["consolidated_latitude"]) \
+                and is_correct_id(transformRef(station_id, row['id_station_local'])):
+            valid += 1
+    return valid
+
+def chunks(file_name):
+    with open_input(file_name) as csvfile:
+        reader = csv.DictReader(csvfile, delimiter=',')
+        while chunk := list(itertools.islice(reader, CHUNK_SIZE)):
+            yield chunk
+
+def run_pipeline(file_name, work_dir):
+    """ Seconds spent in every stage of a run on file_name, outputs being written to work_dir """
+    timings = Counter()
+    @contextmanager
+    def timed(stage):
+        start = time.perf_counter()
+        yield
+        timings[stage] += time.perf_counter() - start
+
+    errors_file = os.path.join(work_dir, "opendata_errors.csv")
+    log.stats = log.LogStats()
+    load_wrong_ortho()
+
+    # Validation alone, then with the grouping: memoized normalizations start cold for both
+    chunk_iterator = chunks(file_name)
+    while True:
+        with timed('parse'):
+            chunk = next(chunk_iterator, None)
+        if chunk is None:
+            break
+        with timed('validation'):
+            validate_rows(chunk)
+    clear_caches()
+
+    station_list = {}
+    input_stats = InputStats()
+    with log.streaming(errors_file):
+        for chunk in chunks(file_name):
+            with timed('grouping'):
+                group_rows(input_stats.count_rows(chunk), station_list)
+        with timed('power'):
+            power_stats = finalize_stations(station_list)
+        with timed('duplicates'):
+            duplicates.report_duplicates(station_list)
+
+    with timed('write_csv'):
+        writers.write_outputs(station_list, work_dir)
+
+    report.HISTORY_FILE = os.path.join(work_dir, "history.csv")
+    with timed('report'):
+        r = report.Report(file_name, log.stats, input_stats, station_list, power_stats)
+        r.template_data = {**r.template_data, "file_name": os.path.join(work_dir, "index.html")}
+        r.generate_report()
+        r.store_history()
+    with timed('html'):
+        r.render_html()
+    with timed('sqlite'):
+        sqlite_export.create_sqlite(file_name, errors_file, os.path.join(work_dir, "irve.db"))
+    return {stage: timings[stage] for stage in STAGES}
+
+def compare(timings, baseline):
+    """ Prints the timings next to their baseline. Returns the stages that regressed """
+    regressions = []
+    print("%-12s %10s %10s %8s" % ("stage", "seconds", "baseline", "ratio"))
+    for stage in STAGES:
+        seconds, base = timings[stage], baseline.get(stage)
+        if base is None:
+            print("%-12s %10.3f %10s %8s" % (stage, seconds, "-", "-"))
+            continue
+        ratio = seconds / base if base > 0 else float('inf')
+        regressed = ratio > THRESHOLD and seconds - base > MIN_DELTA
+        if regressed:
+            regressions.append(stage)
+        print("%-12s %10.3f %10.3f %7.2fx%s" % (stage, seconds, base, ratio, "  REGRESSION" if regressed else ""))
+    print("%-12s %10.3f %10.3f" % ("total", sum(timings.values()), sum(baseline.get(stage, 0) for stage in STAGES)))
+    return regressions
+
+parser = argparse.ArgumentParser(description='Times every stage of the pipeline on synthetic inputs')
+parser.add_argument('--scales', type=float, nargs='+', default=[1], help='Input sizes, relative to the national file. Default is 1')
+parser.add_argument('--repeat', type=int, default=1, help='Runs per scale, the fastest time of every stage is kept. Default is 1')
+parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated inputs. Default is 0')
+parser.add_argument('--work-dir', default=WORK_DIR, help='Where inputs are generated and outputs written. Default is %(default)s')
+parser.add_argument('--save-baseline', action='store_true', help='Store the timings as the new baseline of their scales')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    baselines = {}
+    if os.path.isfile(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baselines = json.load(f)
+    machine = "%s, Python %s" % (platform.platform(), platform.python_version())
+    if baselines.get("machine", machine) != machine:
+        print("WARNING! Baselines were stored on another machine (%s)" % baselines["machine"])
+
+    regressions = []
+    for scale in args.scales:
+        file_name = input_file(args.work_dir, scale, args.seed)
+        runs = [run_pipeline(file_name, args.work_dir) for _ in range(args.repeat)]
+        timings = {stage: min(run[stage] for run in runs) for stage in STAGES}
+        key = "%gx" % scale
+        print("\n## %s (%s)\n" % (key, file_name))
+        regressions += [(key, stage) for stage in compare(timings, baselines.get("scales", {}).get(key, {}))]
+        if args.save_baseline:
+            baselines.setdefault("scales", {})[key] = {stage: round(seconds, 3) for stage, seconds in timings.items()}
+
+    if args.save_baseline:
+        baselines["machine"] = machine
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baselines, f, indent=2)
+            f.write("\n")
+    if regressions:
+        print("\nRegressions: " + ", ".join("%s %s" % regression for regression in regressions))
+        sys.exit(1)
@@ -5,58 +5,65 @@
 # https://wiki.openstreetmap.org/wiki/FR:Project_of_the_month/bornes_vehicules_electriques
 # it is not used anymore
 
-import json
-import csv
-import requests
+import argparse
+import io
+import os
 from time import strftime, localtime
 
+from modules import osm_stats
+
 overpass_base_url = "http://overpass-api.de/api/interpreter?data="
 overpass_params = """
 [out:json][timeout:825];area(3602202162)->.searchArea;(node["amenity"="charging_station"](area.searchArea);way["amenity"="charging_station"](area.searchArea););out;>;out skel qt;
 """
+public_stats_url = "https://raw.githubusercontent.com/Jungle-Bus/ref-EU-EVSE/gh-pages/osm_stats.csv"
 
-overpass_requests = requests.get(overpass_base_url + overpass_params)
-
-if not overpass_requests.ok:
-    print("kapout : requête échouée") #TODO
-    print(overpass_requests.status_code)
-if not overpass_requests.json()['elements']:
-    print("kapout : pas d'éléments") #TODO
-
-elements = overpass_requests.json()['elements']
-charging_stations = [elem for elem in elements if 'tags' in elem and 'amenity' in elem['tags'] and elem['tags']['amenity']=="charging_station"]
-
-results_of_the_day = {}
-results_of_the_day['total_number'] = len(charging_stations)
-results_of_the_day['total_number_motorcar'] = len([elem for elem in charging_stations if 'motorcar' in elem['tags'] and elem['tags']['motorcar']=='yes'])
-results_of_the_day['total_number_bicycle'] = len([elem for elem in charging_stations if 'bicycle' in elem['tags'] and elem['tags']['bicycle']=='yes'])
-results_of_the_day['total_with_open_data_ref'] = len([elem for elem in charging_stations if 'ref:EU:EVSE' in elem['tags']])
-results_of_the_day['total_with_fixme'] = len([elem for elem in charging_stations if 'fixme' in elem['tags'] or 'FIXME' in elem['tags']])
-results_of_the_day['percentage_free'] = len([elem for elem in charging_stations if 'fee' in elem['tags'] and elem['tags']['fee']=='no'])*100.0 / len(charging_stations)
+parser = argparse.ArgumentParser(description='Computes the statistics of the charging stations of OpenStreetMap, in total and by department or operator')
+parser.add_argument('-i', '--input', required=False, default=None,
+                    help='Local OSM extract (Overpass JSON or OSM XML, possibly compressed), read as a stream. Default is to query Overpass for France')
+parser.add_argument('--group-by', required=False, default='department', choices=osm_stats.GROUPS,
+                    help='Breakdown of the statistics: department (of addr:postcode) or operator. Default is department')
+parser.add_argument('--history', required=False, default='output/osm_stats.csv',
+                    help='History file the statistics are appended to. Default is output/osm_stats.csv, the breakdown going to output/osm_stats_by_<group>.csv')
 
-nb_places = len([elem for elem in charging_stations if 'capacity' not in elem['tags']])
-tt = [elem for elem in charging_stations if 'capacity' in elem['tags']]
-for elem in tt :
-    try:
-        nb_places += int(elem['tags']['capacity'])
-    except ValueError:
-        print('{} - {}/{}'.format(elem['tags']['capacity'], elem['type'],elem['id']))
-        nb_places += 1
+def overpass_elements():
+    """ Elements of the Overpass response, decoded while they are downloaded """
+    import requests
+    overpass_requests = requests.get(overpass_base_url + overpass_params, stream=True)
+    if not overpass_requests.ok:
+        print("kapout : requête échouée") #TODO
+        print(overpass_requests.status_code)
+    overpass_requests.raw.decode_content = True
+    with io.TextIOWrapper(overpass_requests.raw, encoding="utf-8") as stream:
+        yield from osm_stats._json_elements(stream)
 
-results_of_the_day['total_number_of_parking_spaces'] = nb_places
+def seed_history(file_name):
+    """ Starts the history from the public one, when there is no local history yet """
+    import requests
+    req = requests.get(public_stats_url)
+    if req.ok:
+        with open(file_name, "w") as csv_out_file:
+            csv_out_file.write(req.text)
 
-date_local = strftime("%Y-%m-%d %H:%M:%S", localtime())
-results_of_the_day['datetime'] = date_local
+if __name__ == "__main__":
+    args = parser.parse_args()
+    elements = osm_stats.read_elements(args.input) if args.input is not None else overpass_elements()
+    stats = osm_stats.OsmStats(args.group_by).add_all(elements)
 
-print("{} éléments".format(results_of_the_day['total_number']))
+    if not stats.totals['total_number']:
+        print("kapout : pas d'éléments") #TODO
+    for capacity, element in stats.invalid_capacities:
+        print('{} - {}'.format(capacity, element))
 
-print("{} éléments avec ref open data".format(results_of_the_day['total_with_open_data_ref']))
+    date_local = strftime("%Y-%m-%d %H:%M:%S", localtime())
+    results_of_the_day = {**stats.row(stats.totals), 'datetime': date_local}
 
-# récupérer la dernière version du fichier de stats
-public_stats_url = "https://raw.githubusercontent.com/Jungle-Bus/ref-EU-EVSE/gh-pages/osm_stats.csv"
-req = requests.get(public_stats_url)
+    print("{} éléments".format(results_of_the_day['total_number']))
+    print("{} éléments avec ref open data".format(results_of_the_day['total_with_open_data_ref']))
 
-with open ("output/osm_stats.csv", "w") as csv_out_file:
-    csv_out_file.write(req.text)
-    csvw = csv.DictWriter(csv_out_file, fieldnames = results_of_the_day.keys())
-    csvw.writerow(results_of_the_day)
+    if args.input is None and not os.path.isfile(args.history):
+        seed_history(args.history)
+    osm_stats.append_history(args.history, [results_of_the_day])
+    breakdown_file = os.path.join(os.path.dirname(args.history), "osm_stats_by_{}.csv".format(args.group_by))
+    osm_stats.append_history(breakdown_file, [{'datetime': date_local, args.group_by: group, **stats.row(counts)}
+                                              for group, counts in sorted(stats.by_group.items())])
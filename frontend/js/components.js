@@ -1,5 +1,5 @@
 import { component } from '../lib/reef.es.js';
-import { events, logsColumns, queries, queryTypes, saveName, signalNameSpaces, sourceColumns, state, transient } from './constants.js';
+import { events, logsColumns, queries, queryTypes, saveName, signalNameSpaces, sourceColumns, state, summaryTables, transient } from './constants.js';
 import { save2LocalStorage } from './utils.js';
 
 
@@ -138,6 +138,7 @@ export const editor = CodeMirror.fromTextArea(document.getElementById('input'),
     hintOptions: {
         tables: { //TODO automate this
             logs: logsColumns.concat(sourceColumns),
+            ...summaryTables,
         },
         defaultTable: 'logs'
     },
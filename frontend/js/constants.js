@@ -13,9 +13,14 @@ export const state = signal({
 
 export const transient = signal({
     loading: false,
-    resultCount: 0
+    resultCount: 0,
+    // queries are run by the local server (start_local_server.py) instead of the browser
+    api: false,
 }, signalNameSpaces.transient)
 
+// Maximum number of rows fetched from the query API
+export const apiLimit = 10000
+
 export const saveName = signal('', signalNameSpaces.saveName)
 
 export const storedKeys = ['resultUseBasicRenderer', 'savedQueries']
@@ -28,6 +33,13 @@ export const logsColumns = ["log_id", "level", "station_id", "source", "msg", "d
 
 export const sourceColumns = ["nom_amenageur","siren_amenageur","contact_amenageur","nom_operateur","contact_operateur","telephone_operateur","nom_enseigne","id_station_itinerance","id_station_local","nom_station","implantation_station","adresse_station","code_insee_commune","coordonneesXY","nbre_pdc","id_pdc_itinerance","id_pdc_local","puissance_nominale","prise_type_ef","prise_type_2","prise_type_combo_ccs","prise_type_chademo","prise_type_autre","gratuit","paiement_acte","paiement_cb","paiement_autre","tarification","condition_acces","reservation","horaires","accessibilite_pmr","restriction_gabarit","station_deux_roues","raccordement","num_pdl","date_mise_en_service","observations","date_maj","cable_t2_attache","last_modified","datagouv_dataset_id","datagouv_resource_id","datagouv_organization_or_owner","created_at","consolidated_longitude","consolidated_latitude","consolidated_code_postal","consolidated_commune","consolidated_is_lon_lat_correct","consolidated_is_code_insee_verified"]
 
+// Pre-aggregated tables, see SUMMARY_TABLES in modules/sqlite_export.py
+export const summaryTables = {
+    summary_organisation: ["datagouv_organization_or_owner", "problemes"],
+    summary_level_msg: ["level", "msg", "occurrences"],
+    summary_organisation_msg: ["datagouv_organization_or_owner", "problemes", "level", "occurrences", "msg"],
+}
+
 export const queryTypes = {
     preset: 'preset',
     save: 'save',
@@ -38,16 +50,11 @@ export const queries = [
     {
         title: 'Problèmes par organisation',
         type: queryTypes.preset,
-        sql:
-`SELECT l.datagouv_organization_or_owner, problemes, level, count(1) as occurrences, msg FROM logs l
-  LEFT JOIN (
-    SELECT datagouv_organization_or_owner, count(1) as problemes FROM logs GROUP BY datagouv_organization_or_owner
-    ) AS b ON b.datagouv_organization_or_owner = l.datagouv_organization_or_owner
-GROUP BY l.datagouv_organization_or_owner, level, msg ORDER BY problemes DESC, level;`,
+        sql: 'SELECT * FROM summary_organisation_msg',
     },{
         title: 'Liste des problèmes',
         type: queryTypes.preset,
-        sql: 'SELECT level, msg, COUNT(1) as occurrences FROM logs GROUP BY level, msg',
+        sql: 'SELECT * FROM summary_level_msg',
     },{
         title: 'Filtrer par organisation',
         type: queryTypes.preset,
@@ -1,5 +1,5 @@
 import { loadFromUrl } from "./components.js";
-import { events, state } from "./constants.js";
+import { events, state, transient } from "./constants.js";
 import { loadLocalStorage, tic, toc } from "./utils.js";
 
 export function init(showError) {
@@ -8,6 +8,13 @@ export function init(showError) {
     worker.onerror = showError;
 
     (async function(){
+        // The local server runs the queries itself: no need to load the database here
+        const api = await fetch("api/query?sql=SELECT%201").then(res => res.ok, () => false);
+        if (api) {
+            transient.api = true;
+            document.dispatchEvent(new Event(events.dbLoaded));
+            return;
+        }
         const data = await fetch("irve.db").then(res => res.arrayBuffer());
         worker.onmessage = function () {
             toc("Loading database from file");
@@ -1,5 +1,5 @@
 import { init } from './init.js'
-import { events, signalNameSpaces, state, transient } from './constants.js'
+import { apiLimit, events, signalNameSpaces, state, transient } from './constants.js'
 import { tic, toc } from './utils.js';
 import { createGrid, createTable, editor, grid, help } from './components.js';
 
@@ -48,30 +48,45 @@ function executeSqlAndShowResults(sql, options) {
         history.pushState({}, "", location.pathname+'?q='+encodeURI(sql));
 
     tic();
-    worker.onmessage = function (event) {
-        var results = event.data.results;
-        toc('Executing SQL');
-        if (!results) {
-            showError({message: event.data.error});
-            return;
-        }
-
-        tic();
-        for (var i = 0; i < results.length; i++) {
-            if (state.resultUseBasicRenderer) {
-                resultsDiv.appendChild(createTable(results[i].columns, results[i].values));
-            } else {
-                createGrid(results[i], resultsDiv);
+    if (transient.api) {
+        fetch('api/query?limit=' + apiLimit + '&sql=' + encodeURIComponent(sql))
+            .then(res => res.json())
+            .then(data => data.error ? showError({message: data.error}) : showResults([data], data.has_more))
+            .catch(showError);
+    } else {
+        worker.onmessage = function (event) {
+            if (!event.data.results) {
+                showError({message: event.data.error});
+                return;
             }
+            showResults(event.data.results);
         }
-        transient.resultCount = results[0]?.values.length ?? 0
-        loadingStop();
-        toc('Results to HTML');
+        worker.postMessage({ action: 'exec', sql: sql + ';' });
     }
-    worker.postMessage({ action: 'exec', sql: sql + ';' });
     loadingStart();
 }
 
+function showResults(results, truncated) {
+    toc('Executing SQL');
+    tic();
+    if (truncated) {
+        const notice = document.createElement('p');
+        notice.className = 'truncated';
+        notice.textContent = `Seules les ${apiLimit} premières lignes sont affichées : utilisez LIMIT et OFFSET dans la requête pour voir les suivantes.`;
+        resultsDiv.appendChild(notice);
+    }
+    for (var i = 0; i < results.length; i++) {
+        if (state.resultUseBasicRenderer) {
+            resultsDiv.appendChild(createTable(results[i].columns, results[i].values));
+        } else {
+            createGrid(results[i], resultsDiv);
+        }
+    }
+    transient.resultCount = results[0]?.values.length ?? 0
+    loadingStop();
+    toc('Results to HTML');
+}
+
 submitBtn.addEventListener('click', execEditorContents, true);
 document.addEventListener(events.execUserSql, e => execEditorContents(e.detail));
 document.addEventListener(events.dbLoaded, () => {
@@ -1,12 +1,34 @@
 #!/usr/bin/env python3
 
+import email.utils
+import functools
+import gzip
 import http.server
+import itertools
+import json
 import os
+import queue
+import re
+import shutil
+import sqlite3
+import time
+import urllib.parse
+from contextlib import contextmanager
 
 symlinks = { # source -> destination
     "../output/irve.db": "irve.db",
     "../output/index.html": "index.html",
 }
+# Precompressed variants of the symlinked files, served to clients accepting gzip
+precompressed = [sym_name + ".gz" for sym_name in symlinks.values()]
+
+# Query API (/api/query)
+DB_FILE = "irve.db"
+POOL_SIZE = 4
+QUERY_TIMEOUT = 10 # seconds
+CACHE_SIZE = 256
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
 
 def create_symlinks():
     try:
@@ -24,21 +46,225 @@ def create_symlinks():
         e.add_note(f"symlinking to here failed!")
         raise e
 
-create_symlinks()
-port = 8081
-http.server.SimpleHTTPRequestHandler.extensions_map[".wasm"] = "application/wasm"
+def create_precompressed():
+    for sym_name, gz_name in zip(symlinks.values(), precompressed):
+        if os.path.isfile(gz_name) and os.path.getmtime(gz_name) >= os.path.getmtime(sym_name):
+            continue
+        with open(sym_name, 'rb') as f, gzip.open(gz_name + ".tmp", 'wb', compresslevel=6) as out:
+            shutil.copyfileobj(f, out)
+        os.replace(gz_name + ".tmp", gz_name)
+
+class ConnectionPool:
+    """ Read-only connections to the database, reopened once the file has been replaced """
+    def __init__(self, db_file, size):
+        self.db_file = db_file
+        self.connections = queue.LifoQueue()
+        for _ in range(size):
+            self.connections.put((None, None))
+
+    @contextmanager
+    def connection(self, mtime):
+        conn, conn_mtime = self.connections.get()
+        try:
+            if conn_mtime != mtime:
+                if conn is not None:
+                    conn.close()
+                conn = sqlite3.connect(f"file:{urllib.parse.quote(os.path.realpath(self.db_file))}?mode=ro", uri=True, check_same_thread=False)
+                conn.execute("PRAGMA query_only = ON")
+                conn_mtime = mtime
+            yield conn
+        finally:
+            self.connections.put((conn, conn_mtime))
+
+pool = ConnectionPool(DB_FILE, POOL_SIZE)
+
+# Quoted strings and identifiers are kept as is, comments and whitespaces become a single space
+sql_token_rgx = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])|(?:--[^\n]*|/\*.*?(?:\*/|$)|\s)+""", re.S)
+
+def normalize_sql(sql):
+    """ Canonical text of a query, so that trivially different queries share their cached results """
+    sql = sql_token_rgx.sub(lambda match: match.group(1) if match.group(1) is not None else " ", sql)
+    return re.sub(r"[\s;]+$", "", sql).strip()
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def run_query(sql, offset, limit, mtime):
+    """ One page of the results of a query, as JSON. Keyed on the database mtime, so that results are never stale """
+    with pool.connection(mtime) as conn:
+        deadline = time.monotonic() + QUERY_TIMEOUT
+        conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql)
+            rows = list(itertools.islice(cursor, offset, offset + limit + 1))
+            columns = [column[0] for column in cursor.description or []]
+        except sqlite3.OperationalError as e:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"query interrupted after {QUERY_TIMEOUT} s") from e
+            raise
+        finally:
+            # The statement is finalized before the connection goes back to the pool
+            cursor.close()
+            conn.set_progress_handler(None, 0)
+    result = {"columns": columns, "values": rows[:limit], "offset": offset, "limit": limit, "has_more": len(rows) > limit}
+    return json.dumps(result, default=lambda value: value.hex() if isinstance(value, bytes) else str(value)).encode()
+
+class FileSlice:
+    """ Reads at most length bytes of a file from its current position """
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+class RequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    SimpleHTTPRequestHandler, plus what a page-wise reader of irve.db needs:
+    - ETag and If-None-Match / If-Range conditional requests,
+    - single byte range requests (Range: bytes=...),
+    - gzip precompressed variants (file.gz) of whole files.
+    """
+    range_rgx = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/api/query":
+            self._send_query(urllib.parse.parse_qs(url.query))
+        else:
+            super().do_GET()
 
-httpd = http.server.HTTPServer(
-    ("localhost", port), http.server.SimpleHTTPRequestHandler
-)
+    def _send_query(self, params):
+        try:
+            sql = normalize_sql(params["sql"][0])
+            offset = max(int(params.get("offset", ["0"])[0]), 0)
+            limit = min(max(int(params.get("limit", [str(DEFAULT_LIMIT)])[0]), 1), MAX_LIMIT)
+            body = run_query(sql, offset, limit, os.stat(DB_FILE).st_mtime_ns)
+            status = http.HTTPStatus.OK
+        # Several statements raise sqlite3.Warning on some Python versions, which is not an sqlite3.Error
+        except (KeyError, ValueError, sqlite3.Error, sqlite3.Warning, TimeoutError) as e:
+            body = json.dumps({"error": str(e) if not isinstance(e, KeyError) else "missing sql parameter"}).encode()
+            status = http.HTTPStatus.BAD_REQUEST
+        self.send_response(status)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
 
-sa = httpd.socket.getsockname()
-print(f"Listening on {sa[0]} port {port}... You may go to http://localhost:{port}/")
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().send_head()
 
-try:
-    httpd.serve_forever()
-except KeyboardInterrupt:
-    # cleanup our mess
-    [os.remove(sym_name) for sym_name in symlinks.values()]
-    # ... and say goodbye because we are very polite :)
-    print("\nGoodbye")
\ No newline at end of file
+        stat = os.stat(path)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        if_none_match = self.headers.get("If-None-Match")
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_none_match is not None:
+            not_modified = self._matches(if_none_match, etag) or self._matches(if_none_match, self._gzip_etag(etag))
+        else:
+            not_modified = if_modified_since is not None and self._not_modified_since(if_modified_since, stat.st_mtime)
+        if not_modified:
+            self.send_response(http.HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return None
+
+        ctype = self.guess_type(path)
+        range_header = self.headers.get("Range")
+        if range_header is not None and self.headers.get("If-Range", etag) == etag:
+            return self._send_range(path, ctype, stat.st_size, etag, range_header)
+
+        headers = {"Content-type": ctype, "Accept-Ranges": "bytes", "Last-Modified": email.utils.formatdate(stat.st_mtime, usegmt=True)}
+        gz_path = path + ".gz"
+        if "gzip" in self.headers.get("Accept-Encoding", "") and os.path.isfile(gz_path) and os.path.getmtime(gz_path) >= stat.st_mtime:
+            path = gz_path
+            etag = self._gzip_etag(etag)
+            headers.update({"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+        f = open(path, 'rb')
+        self.send_response(http.HTTPStatus.OK)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        return f
+
+    def _send_range(self, path, ctype, size, etag, range_header):
+        match = self.range_rgx.match(range_header.strip())
+        if match is None or match.groups() == ('', ''):
+            # Multiple or malformed ranges: send the whole file
+            del self.headers["Range"]
+            return self.send_head()
+        start, end = match.groups()
+        if start == '':
+            start, end = max(size - int(end), 0), size - 1
+        elif end == '':
+            start, end = int(start), size - 1
+        elif int(end) >= int(start):
+            start, end = int(start), min(int(end), size - 1)
+        else:
+            del self.headers["Range"]
+            return self.send_head()
+        if start >= size or start > end:
+            self.send_response(http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(http.HTTPStatus.PARTIAL_CONTENT)
+        self.send_header("Content-type", ctype)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        return FileSlice(f, end - start + 1)
+
+    @staticmethod
+    def _not_modified_since(if_modified_since, mtime):
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since.timestamp()
+
+    @staticmethod
+    def _gzip_etag(etag):
+        return etag[:-1] + '-gzip"'
+
+    @staticmethod
+    def _matches(if_none_match, etag):
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or "W/" + etag in tags
+
+if __name__ == "__main__":
+    create_symlinks()
+    create_precompressed()
+    port = 8081
+    RequestHandler.extensions_map[".wasm"] = "application/wasm"
+
+    httpd = http.server.ThreadingHTTPServer(
+        ("localhost", port), RequestHandler
+    )
+
+    sa = httpd.socket.getsockname()
+    print(f"Listening on {sa[0]} port {port}... You may go to http://localhost:{port}/")
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        # cleanup our mess
+        [os.remove(sym_name) for sym_name in list(symlinks.values()) + precompressed if os.path.lexists(sym_name)]
+        # ... and say goodbye because we are very polite :)
+        print("\nGoodbye")
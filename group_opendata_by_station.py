@@ -2,389 +2,172 @@
 # coding: utf-8
 
 import csv
-import re
 import argparse
 
-from enum import IntFlag, auto
 import modules.import_logger as log
 from modules.report import Report
-from modules import utils
-
-class Socket(IntFlag):
-    EF = auto()
-    T2 = auto()
-    CHADEMO = auto()
-    CCS = auto()
-
-MAX_POWER_KW = {
-    Socket.EF: 4,
-    Socket.T2: 43,
-    Socket.CHADEMO: 63
-}
+from modules.input_stats import InputStats
+from modules.profiling import Profiler, STAGES
+from modules import duplicates, name_matching, tiles, utils, writers
+from modules.compressed import open_input
+from modules.normalize import cleanPhoneNumber, transformRef
+from modules.power import Socket, get_most_powerful_socket
+from modules.grouping import compute_max_power_per_socket_type, load_wrong_ortho, group_rows, finalize_stations, wrong_ortho
 
 station_list = {}
-station_attributes = [ 'nom_amenageur', 'siren_amenageur', 'contact_amenageur', 'nom_operateur', 'contact_operateur', 'telephone_operateur', 'nom_enseigne', 'id_station_itinerance', 'id_station_local', 'nom_station', 'implantation_station', 'code_insee_commune', 'nbre_pdc', 'station_deux_roues', 'raccordement', 'num_pdl', 'date_mise_en_service', 'observations', 'adresse_station' ]
-pdc_attributes = [ 'id_pdc_itinerance', 'id_pdc_local', 'puissance_nominale', 'prise_type_ef', 'prise_type_2', 'prise_type_combo_ccs', 'prise_type_chademo', 'prise_type_autre', 'gratuit', 'paiement_acte', 'paiement_cb', 'paiement_autre', 'tarification', 'condition_acces', 'reservation', 'accessibilite_pmr', 'restriction_gabarit', 'observations', 'date_maj', 'cable_t2_attache', 'datagouv_organization_or_owner', 'horaires' ]
-socket_attributes = { 'prise_type_ef': Socket.EF, 'prise_type_2': Socket.T2, 'prise_type_chademo': Socket.CHADEMO, 'prise_type_combo_ccs': Socket.CCS }
-
 power_stats = []
-wrong_ortho = {}
 
 parser = argparse.ArgumentParser(description='This will group, validate and sanitize a previously "consolidated" export of IRVE data from data.gouv.fr')
 parser.add_argument('-i', '--input', required=False, default='opendata_irve.csv', nargs='?',
-                    help='CSV input filename. Default is opendata_irve.csv')
+                    help='CSV input filename, possibly compressed (gzip, bzip2, xz or zstandard). Default is opendata_irve.csv')
 parser.add_argument('--create-sqlite', required=False, default=False, action='store_true',
                     help='Generate an sqlite database at output/irve.db')
+parser.add_argument('--sqlite-page-size', required=False, default=4096, type=int, choices=[512 << i for i in range(8)],
+                    help='Page size of output/irve.db. Small pages (e.g. 1024) suit the page-wise reading of the database over HTTP Range requests. Default is 4096')
 parser.add_argument('--html-report', required=False, default=False, action='store_true',
                     help='Generate a report at output/index.html')
-
-def validate_coord(lat_or_lon_text):
-    try:
-        float(lat_or_lon_text)
-    except ValueError:
-        return False
-    return True
-
-def is_correct_id(station_id):
-    if station_id is None:
-        return False
-
-    station_id_parts = station_id.split('*')
-    station_id = "".join(station_id_parts)
-    station_id_parts = station_id.split(' ')
-    station_id = "".join(station_id_parts)
-
-    if not station_id.startswith('P', 5):
-        return False
-    return True
-
-def cleanPhoneNumber(phone):
-    if re.match(r"^\+33\d{9}$", phone):
-        return phone
-    elif re.match(r"^\+33 \d( \d{2}){4}$", phone):
-        return phone.replace(" ", "")
-    elif re.match(r"^33\d{9}$", phone):
-        return "+"+phone
-    elif re.match(r"^\d{10}$", phone):
-        return "+33" + phone[1:]
-    elif re.match(r"^\d{9}$", phone):
-        return "+33" + phone
-    elif re.match(r"^(\d{2}[. -]){4}\d{2}$", phone):
-        return "+33" + phone[1:].replace(".", "").replace(" ", "").replace("-", "")
-    elif re.match(r"^\d( \d{3}){3}$", phone):
-        return "+33" + phone[1:].replace(" ", "")
-    else:
-        return None
-
-def compute_max_power_per_socket_type(station, raw_station_id):
-    """
-    Computes the aggregated max power per socket type accross all PDCs (PDLs) associated with the given station.
-    Only consider the most powerful socket per PDC.
-    """
-    power_ef = power_t2 = power_chademo = power_ccs = 0
-    for pdc in station['pdc_list']:
-        socket_mask = sum([ flag for socket_attr, flag in socket_attributes.items() if stringBoolToInt(pdc[socket_attr])==1 ])
-        socket_mask = Socket(socket_mask)
-        power = float(pdc['puissance_nominale'])
-        if power >= 1000:
-            log.error(station_id=raw_station_id,
-                pdc_id=pdc["id_pdc_itinerance"],
-                source=station['attributes']['source_grouped'],
-                msg="puissance nominale déclarée suspecte (possible erreur W/kW)",
-                detail="puissance: {}, prises: {}".format(pdc['puissance_nominale'], socket_mask.name))
-            # Convert from W to kW (>2MW should not exist)
-            # FIXME: Probably not usefull anymore. Data looks fine.
-            if power >= 2000:
-                power /= 1000
-
-        err_socket = report_socket_power_out_of_specs(power, socket_mask)
-        if err_socket is not None:
-            log.warning(station_id=raw_station_id,
-                pdc_id=pdc["id_pdc_itinerance"],
-                source=station['attributes']['source_grouped'],
-                msg="puissance nominale déclarée pour prise {} supérieure à la norme ({})".format(err_socket.name, MAX_POWER_KW[err_socket]),
-                detail="puissance: {}, prises: {}".format(pdc['puissance_nominale'], socket_mask.name))
-
-        max_socket = get_most_powerful_socket(socket_mask)
-        power_ef = max(power_ef, power if Socket.EF == max_socket and err_socket != max_socket else 0)
-        power_t2 = max(power_t2, power if Socket.T2 == max_socket and err_socket != max_socket else 0)
-        power_chademo = max(power_chademo, power if Socket.CHADEMO == max_socket and err_socket != max_socket else 0)
-        power_ccs = max(power_ccs, power if Socket.CCS == max_socket else 0)
-
-    return (power_ef, power_t2, power_chademo, power_ccs)
-
-def get_most_powerful_socket(socket_mask):
-    """ EF < T2 < CHADEMO < CCS
-    """
-    if Socket.CCS in socket_mask:
-        return Socket.CCS
-    if Socket.CHADEMO in socket_mask and Socket.CCS in ~socket_mask:
-        return Socket.CHADEMO
-    elif Socket.T2 in socket_mask and Socket.CCS | Socket.CHADEMO in ~socket_mask:
-        return Socket.T2
-    elif Socket.EF in socket_mask and Socket.CCS | Socket.CHADEMO | Socket.T2 in ~socket_mask:
-        return Socket.EF
-    return None
-
-def report_socket_power_out_of_specs(power, socket_mask):
-    """
-    This check can only be done on the most powerful socket of the PDC.
-    Allow rounding errors (max +1 kw). No limits known for CCS.
-    """
-    s = get_most_powerful_socket(socket_mask)
-    if s is None: return
-    err_socket = None
-    if s == Socket.CHADEMO:
-        if power > MAX_POWER_KW[Socket.CHADEMO] + 1:
-            err_socket = Socket.CHADEMO
-    elif s == Socket.T2:
-        if power > MAX_POWER_KW[Socket.T2] + 1:
-            err_socket = Socket.T2
-    elif s == Socket.EF:
-        if power > MAX_POWER_KW[Socket.EF] + 1:
-            err_socket = Socket.EF
-    return err_socket
-
-def stringBoolToInt(strbool):
-    return 1 if strbool.lower() == 'true' else 0
-
-def transformRef(refIti, refLoc):
-    rgx = r"^[A-Z]{2}\*[A-Za-z0-9]{3}\*P[A-Za-z0-9]+\*[A-Za-z0-9]+"
-    areRefNoSepEqual = refIti.replace("*", "") == refLoc.replace("*", "")
-
-    if re.match(rgx, refIti):
-        return refIti
-    elif areRefNoSepEqual and re.match(rgx, refLoc):
-        return refLoc
-    elif re.match("^[A-Z]{2}[A-Za-z0-9]{3}P[A-Za-z0-9]+", refIti):
-        return refIti[:2]+"*"+refIti[2:5]+"*P"+refIti[6:]
-    else:
-        return None
+parser.add_argument('--geojson', required=False, default=False, action='store_true',
+                    help='Also write the stations as points to output/opendata_stations.geojson')
+parser.add_argument('--tiles', required=False, default=False, action='store_true',
+                    help='Write map tiles of the stations (GeoJSON, clustered below zoom %d) to output/tiles/<z>/<x>/<y>.geojson. Only the tiles whose stations changed are written again' % tiles.MAX_ZOOM)
+parser.add_argument('--diff', required=False, default=None, metavar='PREVIOUS_DIR',
+                    help='Compare the stations and errors with those of a previous run (opendata_stations.csv and opendata_errors.csv of PREVIOUS_DIR): changes are written to output/opendata_station_changes.csv and output/opendata_error_changes.csv, and summed up in the report')
+parser.add_argument('--engine', required=False, default='row', choices=['row', 'columnar'],
+                    help='Grouping engine: "row" streams the CSV row by row, "columnar" processes whole columns with pandas (faster, same outputs). Default is row')
+parser.add_argument('-j', '--jobs', required=False, default=1, type=int,
+                    help='Number of processes used by the row engine, stations being sharded by id. Every process reads the whole input. Default is 1')
+parser.add_argument('--incremental', required=False, default=False, action='store_true',
+                    help='Only group again the stations whose rows changed since the previous incremental run (state kept in output/grouping_state.pickle)')
+parser.add_argument('--approx-distinct', required=False, default=False, action='store_true',
+                    help='Estimate the distinct station/PDC id counts of the report with HyperLogLog sketches (fixed memory, ~1%% error) instead of exact sets')
+parser.add_argument('--input-cache', required=False, default=False, action='store_true',
+                    help='Keep a columnar binary snapshot of the parsed input (in cache/snapshots, keyed by its content) and read the input from it: reruns on the same file skip the CSV parsing')
+parser.add_argument('--duplicate-distance', required=False, default=duplicates.DISTANCE, type=float,
+                    help='Stations of the same operator closer than this distance (in meters), with a similar name or address and a common socket type, are logged as likely duplicates. 0 disables the check. Default is %(default)s')
+parser.add_argument('--communes', required=False, default=None, metavar='GEOJSON',
+                    help='Check that the coordinates of every station fall within its commune (code_insee_commune), given a GeoJSON file of the commune boundaries. Parsed boundaries are cached in cache/communes')
+
+parser.add_argument('--profile', required=False, default=False, action='store_true',
+                    help='Record the wall time, CPU time, throughput and peak memory of the process at the end of every stage, in output/history.csv and in the HTML report')
+parser.add_argument('--trace-memory', required=False, default=False, action='store_true',
+                    help='With --profile, also measure the own peak memory of every stage with tracemalloc (slower)')
+parser.add_argument('--cprofile', required=False, default=None, choices=list(STAGES),
+                    help='Run the given stage under cProfile and dump its statistics to output/profile_<stage>.prof')
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.jobs > 1 and args.engine != 'row':
+        parser.error("--jobs is only supported by the row engine")
+    if args.incremental and (args.engine != 'row' or args.jobs > 1):
+        parser.error("--incremental is only supported by the single process row engine")
+
+    load_wrong_ortho()
+    input_stats = InputStats(approximate=args.approx_distinct)
+    input_snapshot = None
+    if args.input_cache:
+        from modules import snapshot
+        input_snapshot = snapshot.load(args.input)
+
+    profiler = Profiler(args.cprofile, f"output/profile_{args.cprofile}.prof", trace_memory=args.trace_memory)
+
+    # Issues are streamed to the errors file while grouping
+    with log.streaming("output/opendata_errors.csv"):
+        with profiler.stage("group") as stage:
+            if args.engine == 'columnar':
+                from modules import columnar
+                power_stats = columnar.group_csv(args.input, station_list, input_stats=input_stats, snapshot=input_snapshot)
+            elif args.incremental:
+                from modules import incremental
+                power_stats = incremental.group_csv(args.input, station_list, input_stats=input_stats)
+            elif args.jobs > 1:
+                from modules import parallel
+                power_stats = parallel.group_csv(args.input, station_list, args.jobs, input_stats=input_stats)
+            elif input_snapshot is not None:
+                group_rows(input_stats.count_rows(input_snapshot.rows()), station_list)
+            else:
+                with open_input(args.input) as csvfile:
+                    reader = csv.DictReader(csvfile, delimiter=',')
+                    group_rows(input_stats.count_rows(reader), station_list)
+            stage.rows = input_stats.line_count
+
+        # The other engines aggregate the stations while grouping
+        if args.engine == 'row' and not args.incremental and args.jobs == 1:
+            with profiler.stage("aggregate") as stage:
+                power_stats = finalize_stations(station_list)
+                stage.rows = len(station_list)
+
+        if args.duplicate_distance > 0:
+            with profiler.stage("duplicates") as stage:
+                duplicates.report_duplicates(station_list, args.duplicate_distance)
+                stage.rows = len(station_list)
+
+        if args.communes is not None:
+            from modules import communes
+            with profiler.stage("communes") as stage:
+                communes.check_stations(station_list, communes.load(args.communes))
+                stage.rows = len(station_list)
+
+    with profiler.stage("write_csv") as stage:
+        writers.write_outputs(station_list, geojson=args.geojson)
+        stage.rows = len(station_list)
+
+    with profiler.stage("names") as stage:
+        name_matching.write_suggestions(name_matching.suggest_fixes(station_list, wrong_ortho))
+        stage.rows = len(station_list)
+
+    if args.tiles:
+        with profiler.stage("tiles") as stage:
+            tiles.build_tiles(station_list, tiles.read_levels("output/opendata_errors.csv"))
+            stage.rows = len(station_list)
+
+    changes = None
+    if args.diff is not None:
+        from modules import run_diff
+        with profiler.stage("diff") as stage:
+            changes = run_diff.compare_runs(args.diff)
+            if changes is not None:
+                changes.write()
+            stage.rows = len(station_list)
 
-    with open('fixes_networks.csv', 'r') as csv_file:
-        csv_reader = csv.DictReader(csv_file, delimiter=',')
-        for row in csv_reader:
-            wrong_ortho[row["opendata_name"]] = row["better_name"]
-
-    with open(args.input) as csvfile:
-        reader = csv.DictReader(csvfile, delimiter=',')
-        for row in reader:
-            if not row['id_station_itinerance']:
-                log.blocking(station_id=None,
-                    source=row['datagouv_organization_or_owner'],
-                    msg="pas d'identifiant ref:EU:EVSE (id_station_itinerance). Ce point de charge est ignoré et sa station ne sera pas présente dans l'analyse Osmose",
-                    detail=None)
-                continue
-            if row['id_station_itinerance']=="Non concerné":
-                # Station non concernée par l'identifiant ref:EU:EVSE (id_station_itinerance). Ce point de charge est ignoré et sa station ne sera pas présente dans l'analyse Osmose
-                continue
-
-            cleanRef = transformRef(row['id_station_itinerance'], row['id_station_local'])
-            station_id = row['id_station_itinerance'] # usefull to join logs with source data
-            cleanRef = transformRef(station_id, row['id_station_local'])
-
-            # Overkill given that this data should have passed through this code:
-            # https://github.com/datagouv/datagouvfr_data_pipelines/blob/75db0b1db3fd79407a1526b0950133114fefaa0f/schema/utils/geo.py#L33
-            if not validate_coord(row["consolidated_longitude"]) or not validate_coord(row["consolidated_latitude"]):
-                log.blocking(station_id= station_id,
-                    source=row['datagouv_organization_or_owner'],
-                    msg="coordonnées non valides. Ce point de charge est ignoré et sa station ne sera pas présente dans l'analyse Osmose",
-                    detail="consolidated_longitude: {}, consolidated_latitude: {}".format(row['consolidated_longitude'], row["consolidated_latitude"]))
-                continue
-
-            if not is_correct_id(cleanRef):
-                log.blocking(station_id=station_id,
-                    source=row['datagouv_organization_or_owner'],
-                    msg="le format de l'identifiant ref:EU:EVSE (id_station_itinerance) n'est pas valide. Ce point de charge est ignoré et sa station ne sera pas présente dans l'analyse Osmose",
-                    detail="iti: %s, local: %s" % (row['id_station_itinerance'], row['id_station_local']))
-                continue
-
-            if not station_id in station_list:
-                station_prop = {}
-                for key in station_attributes :
-                    station_prop[key] = row[key]
-                    if row[key] == "null":
-                        station_prop[key] = ""
-                    elif row[key] in wrong_ortho.keys():
-                        station_prop[key] = wrong_ortho[row[key]]
-
-                station_prop['Xlongitude'] = float(row['consolidated_longitude'])
-                station_prop['Ylatitude'] = float(row['consolidated_latitude'])
-                phone = cleanPhoneNumber(row['telephone_operateur'])
-                station_list[station_id] = {'attributes' : station_prop, 'pdc_list': []}
-                station_list[station_id]['attributes']['id_station_itinerance'] = cleanRef
-
-                # Non-blocking issues
-                if phone is None and row['telephone_operateur']!= "":
-                    station_prop['telephone_operateur'] = None
-                    log.warning(station_id=station_id,
-                        source=row['datagouv_organization_or_owner'],
-                        msg="le numéro de téléphone de l'opérateur (telephone_operateur) est dans un format invalide",
-                        detail=row['telephone_operateur'])
-                elif phone is not None:
-                    station_prop['telephone_operateur'] = phone
-                else:
-                    station_prop['telephone_operateur'] = None
-
-                if row['station_deux_roues'].lower() not in ['true', 'false', '']:
-                    station_prop['station_deux_roues'] = None
-                    log.warning(station_id=station_id,
-                        source=row['datagouv_organization_or_owner'],
-                        msg="le champ station_deux_roues n'est pas valide",
-                        detail=row['station_deux_roues'])
-                else:
-                    station_prop['station_deux_roues'] = row['station_deux_roues'].lower()
-
-            pdc_prop = {key: row[key] for key in pdc_attributes}
-            station_list[station_id]['pdc_list'].append(pdc_prop)
-
-    # ~ all_prises_types = set()
-
-    for station_id, station in station_list.items() :
-        sources = set([elem['datagouv_organization_or_owner'] for elem in station['pdc_list']])
-        if len(sources) !=1 :
-            log.error(station_id=station_id,
-                      source="multiples",
-                      msg="plusieurs sources pour un même id",
-                      detail=sources)
-        station['attributes']['source_grouped'] = list(sources)[0]
-
-        horaires = set([elem['horaires'].strip() for elem in station['pdc_list']])
-        if len(horaires) !=1 :
-            station['attributes']['horaires_grouped'] = None
-            log.warning(station_id=station_id,
-                        source=station['attributes']['source_grouped'],
-                        msg="plusieurs horaires pour une même station",
-                        detail=horaires)
-        else :
-            station['attributes']['horaires_grouped'] = list(horaires)[0]
-
-        gratuit = set([elem['gratuit'].strip().lower() for elem in station['pdc_list']])
-        if len(gratuit) !=1 :
-            station['attributes']['gratuit_grouped'] = None
-            log.warning(station_id=station_id,
-                        source=station['attributes']['source_grouped'],
-                        msg="plusieurs infos de gratuité (gratuit) pour une même station",
-                        detail=gratuit)
-        else :
-            station['attributes']['gratuit_grouped'] = list(gratuit)[0]
-
-        paiement_acte = set([elem['paiement_acte'].strip().lower() for elem in station['pdc_list']])
-        if len(paiement_acte) !=1 :
-            station['attributes']['paiement_acte_grouped'] = None
-            log.warning(station_id=station_id,
-                        source=station['attributes']['source_grouped'],
-                        msg="plusieurs infos de paiement (paiement_acte) pour une même station",
-                        detail=paiement_acte)
-        else :
-            station['attributes']['paiement_acte_grouped'] = list(paiement_acte)[0]
-
-        paiement_cb = set([elem['paiement_cb'].strip().lower() for elem in station['pdc_list']])
-        if len(paiement_cb) !=1 :
-            station['attributes']['paiement_cb_grouped'] = None
-            log.warning(station_id=station_id,
-                        source=station['attributes']['source_grouped'],
-                        msg="plusieurs infos de paiement (paiement_cb) pour une même station",
-                        detail=paiement_cb)
-        else :
-            station['attributes']['paiement_cb_grouped'] = list(paiement_cb)[0]
-
-        reservation = set([elem['reservation'].strip().lower() for elem in station['pdc_list']])
-        if len(reservation) !=1 :
-            station['attributes']['reservation_grouped'] = None
-            log.warning(station_id=station_id,
-                        source=station['attributes']['source_grouped'],
-                        msg="plusieurs infos de réservation pour une même station",
-                        detail=reservation)
-        else :
-            station['attributes']['reservation_grouped'] = list(reservation)[0]
-
-        accessibilite_pmr = set([elem['accessibilite_pmr'].strip() for elem in station['pdc_list']])
-        if len(accessibilite_pmr) !=1 :
-            station['attributes']['accessibilite_pmr_grouped'] = None
-            log.warning(station_id=station_id,
-                        source=station['attributes']['source_grouped'],
-                        msg="plusieurs infos d'accessibilité PMR (accessibilite_pmr) pour une même station",
-                        detail=accessibilite_pmr)
-        else :
-            station['attributes']['accessibilite_pmr_grouped'] = list(accessibilite_pmr)[0]
-
-        accessibilite_pmr = set([elem['accessibilite_pmr'].strip() for elem in station['pdc_list']])
-        if len(accessibilite_pmr) !=1 :
-            station['attributes']['accessibilite_pmr_grouped'] = None
-            log.warning(station_id=station_id,
-                        source=station['attributes']['source_grouped'],
-                        msg="plusieurs infos d'accessibilité PMR (accessibilite_pmr) pour une même station",
-                        detail=accessibilite_pmr)
-        else :
-            station['attributes']['accessibilite_pmr_grouped'] = list(accessibilite_pmr)[0]
-
-        if len(station['pdc_list']) != int(station['attributes']['nbre_pdc']):
-            log.error(station_id=station_id,
-                source=station['attributes']['source_grouped'],
-                msg="le nombre de point de charge de la station n'est pas cohérent avec la liste des points de charge fournie",
-                detail="{} points de charge indiqués pour la station (nbre_pdc) mais {} points de charge listés".format(station['attributes']['nbre_pdc'], len(station['pdc_list'])))
-            station['attributes']['nbre_pdc'] = min(len(station['pdc_list']), int(station['attributes']['nbre_pdc']))
-
-        station['attributes']['nb_prises_grouped'] = len(station['pdc_list'])
-
-        EF_count = sum([ stringBoolToInt(elem['prise_type_ef']) for elem in station['pdc_list'] ])
-        station['attributes']['nb_EF_grouped'] = EF_count
-
-        T2_count = sum([ stringBoolToInt(elem['prise_type_2']) for elem in station['pdc_list'] ])
-        station['attributes']['nb_T2_grouped'] = T2_count
-
-        combo_count = sum([ stringBoolToInt(elem['prise_type_combo_ccs']) for elem in station['pdc_list'] ])
-        station['attributes']['nb_combo_ccs_grouped'] = combo_count
-
-        chademo_count = sum([ stringBoolToInt(elem['prise_type_chademo']) for elem in station['pdc_list'] ])
-        station['attributes']['nb_chademo_grouped'] = chademo_count
-
-        autre_count = sum([ stringBoolToInt(elem['prise_type_autre']) for elem in station['pdc_list'] ])
-        station['attributes']['nb_autre_grouped'] = autre_count
-
-        if (EF_count + T2_count + combo_count + chademo_count + autre_count) == 0:
-            log.error(station_id=station_id,
-                    source=station['attributes']['source_grouped'],
-                    msg="aucun type de prise précisé sur l'ensemble des points de charge",
-                    detail="nb pdc: %s" % (len(station['pdc_list'])))
-
-        power_grouped_values = compute_max_power_per_socket_type(station, station_id)
-        power_stats.append(power_grouped_values)
-        power_props = ['power_ef_grouped', 'power_t2_grouped', 'power_chademo_grouped', 'power_ccs_grouped']
-        station['attributes'].update(zip(power_props, power_grouped_values))
-
-
-    logs = log._import_logged_data
-
-    with open("output/opendata_errors.csv", 'w') as ofile:
-        tt = csv.DictWriter(ofile, fieldnames=logs[0].keys())
-        tt.writeheader()
-        for elem in logs:
-            tt.writerow(elem)
-
-    with open("output/opendata_stations.csv", 'w') as ofile:
-        tt = csv.DictWriter(ofile, fieldnames=station_list[list(station_list)[0]]["attributes"].keys())
-        tt.writeheader()
-        for station_id, station in station_list.items():
-            tt.writerow(station['attributes'])
-
-    r = Report(args.input, logs, station_list, power_stats)
-    r.generate_report()
+    if args.create_sqlite:
+        from modules import sqlite_export
+        with profiler.stage("sqlite") as stage:
+            sqlite_export.create_sqlite(args.input, page_size=args.sqlite_page_size, snapshot=input_snapshot)
+            stage.rows = log.stats.count
+
+    r = Report(args.input, log.stats, input_stats, station_list, power_stats, profile=profiler if args.profile else None, changes=changes)
+    with profiler.stage("report"):
+        r.generate_report()
     r.render_stdout()
     if args.html_report:
-        r.render_html()
-    if args.create_sqlite:
-        utils.create_sqlite(args.input)
+        with profiler.stage("html"):
+            r.render_html()
+    r.store_history()
+    if args.profile:
+        print("\n" + profiler.markdown())
 
 ###########################################################################
+import io
 import unittest
+from contextlib import contextmanager, redirect_stdout
 
 class Test(unittest.TestCase):
     import tests.power_test_data as data
+    input_file = "tests/irve_test_data.csv"
+
+    def setUp(self):
+        load_wrong_ortho()
+
+    def _group_input(self):
+        """ Stations, power stats and logged records of the single process row engine on input_file """
+        station_list = {}
+        with log.capture() as records:
+            with open(self.input_file) as csvfile:
+                group_rows(csv.DictReader(csvfile, delimiter=','), station_list)
+            power_stats = finalize_stations(station_list)
+        return station_list, power_stats, records
 
     def test_get_most_powerfull_socket(self):
         self.assertEqual(Socket.CCS, get_most_powerful_socket(Socket.CCS))
@@ -398,8 +181,674 @@ class Test(unittest.TestCase):
         self.assertEqual(Socket.T2, get_most_powerful_socket(Socket.EF|Socket.T2))
         self.assertEqual(Socket.EF, get_most_powerful_socket(Socket.EF))
 
+    def test_cleanPhoneNumber(self):
+        self.assertEqual("+33123456789", cleanPhoneNumber("+33123456789"))
+        self.assertEqual("+33123456789", cleanPhoneNumber("+33 1 23 45 67 89"))
+        self.assertEqual("+33123456789", cleanPhoneNumber("33123456789"))
+        self.assertEqual("+33123456789", cleanPhoneNumber("0123456789"))
+        self.assertEqual("+33123456789", cleanPhoneNumber("123456789"))
+        self.assertEqual("+33123456789", cleanPhoneNumber("01.23.45.67.89"))
+        self.assertEqual("+33123456789", cleanPhoneNumber("01 23-45.67 89"))
+        self.assertEqual("+33800123456", cleanPhoneNumber("0 800 123 456"))
+        self.assertIsNone(cleanPhoneNumber("+33 1 23 45 67"))
+        self.assertIsNone(cleanPhoneNumber(""))
+
+    def test_transformRef(self):
+        self.assertEqual("FR*ABC*P123*1", transformRef("FR*ABC*P123*1", "whatever"))
+        self.assertEqual("FR*ABC*P123*1", transformRef("FRABCP1231", "FR*ABC*P123*1"))
+        self.assertEqual("FR*ABC*P1231", transformRef("FRABCP1231", "local"))
+        self.assertIsNone(transformRef("bad id", "FR*ABC*P123*1"))
+
     def test_compute_max_power_per_socket_type(self):
         for test in self.data.stations:
             log._import_logged_data = []
             self.assertEqual(test["result"], compute_max_power_per_socket_type(test["station"], "station_id"))
-            self.assertEqual(test["errors"], log._import_logged_data)
\ No newline at end of file
+            self.assertEqual(test["errors"], log._import_logged_data)
+
+    def test_columnar_engine(self):
+        from modules import columnar
+
+        row_stations, row_power_stats, row_logs = self._group_input()
+        log._import_logged_data = []
+        columnar_stations = {}
+        columnar_power_stats = columnar.group_csv(self.input_file, columnar_stations)
+
+        self.assertEqual(row_stations, columnar_stations)
+        self.assertEqual(row_power_stats, columnar_power_stats)
+        self.assertEqual(row_logs, log._import_logged_data)
+
+    def test_sharded_grouping(self):
+        from modules import grouping, parallel
+
+        row_stations, row_power_stats, row_logs = self._group_input()
+        log._import_logged_data = []
+        sharded_stations = {}
+        sharded_power_stats = parallel.group_csv(self.input_file, sharded_stations, jobs=3)
+
+        self.assertEqual(list(row_stations.items()), list(sharded_stations.items()))
+        self.assertEqual(row_power_stats, sharded_power_stats)
+        self.assertEqual(row_logs, log._import_logged_data)
+        # Details of the stations of several sources are the same text as with a single process
+        multiple_sources = [record for record in log._import_logged_data if record['msg'] == grouping.MSG_MULTIPLE_SOURCES]
+        self.assertEqual(2, len(multiple_sources))
+        self.assertTrue(all(isinstance(record['detail'], str) for record in multiple_sources))
+
+    def test_incremental_grouping(self):
+        import tempfile
+        from modules import incremental
+
+        row_stations, row_power_stats, row_logs = self._group_input()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            state_file = tmp_dir + "/state.pickle"
+            for run in ["full", "cached"]:
+                log._import_logged_data = []
+                incremental_stations = {}
+                with utils.Capturing():
+                    incremental_power_stats = incremental.group_csv(self.input_file, incremental_stations, state_file)
+
+                self.assertEqual(list(row_stations.items()), list(incremental_stations.items()), run)
+                self.assertEqual(row_power_stats, incremental_power_stats, run)
+                self.assertEqual(row_logs, log._import_logged_data, run)
+
+    def test_streaming_logs(self):
+        import tempfile
+        from collections import Counter
+
+        _, _, row_logs = self._group_input()
+        log._import_logged_data = []
+        log.stats = log.LogStats()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with log.streaming(tmp_dir + "/errors.csv"):
+                streamed_stations = {}
+                with open(self.input_file) as csvfile:
+                    group_rows(csv.DictReader(csvfile, delimiter=','), streamed_stations)
+                finalize_stations(streamed_stations)
+            with open(tmp_dir + "/errors.csv") as csvfile:
+                streamed_logs = list(csv.DictReader(csvfile, delimiter=','))
+
+        self.assertEqual([], log._import_logged_data)
+        self.assertEqual([{key: "" if value is None else str(value) for key, value in record.items()} for record in row_logs], streamed_logs)
+        self.assertEqual(len(row_logs), log.stats.count)
+        self.assertEqual(Counter((record['source'], record['level'], record['msg']) for record in row_logs), log.stats.by_source_level_msg)
+
+    def test_input_stats(self):
+        from modules import columnar, parallel
+        from modules.input_stats import HyperLogLog
+
+        with open(self.input_file) as csvfile:
+            rows = list(csv.DictReader(csvfile, delimiter=','))
+        expected = (len(rows), len({row['id_station_itinerance'] for row in rows}), len({row['id_pdc_itinerance'] for row in rows}))
+
+        row_stats = InputStats()
+        group_rows(row_stats.count_rows(rows), {})
+        columnar_stats = InputStats()
+        columnar.group_csv(self.input_file, {}, input_stats=columnar_stats)
+        sharded_stats = InputStats()
+        parallel.group_csv(self.input_file, {}, jobs=3, input_stats=sharded_stats)
+        for stats in [row_stats, columnar_stats, sharded_stats]:
+            self.assertEqual(expected, (stats.line_count, stats.distinct_station_id_count, stats.distinct_pdc_id_count))
+
+        sketch, other = HyperLogLog(), HyperLogLog()
+        for i in range(50000):
+            (sketch if i % 2 else other).add("FR*ABC*P%d*1" % (i % 40000))
+        sketch.update(other)
+        self.assertAlmostEqual(40000, len(sketch), delta=40000 * 0.03)
+
+        approx_stats = InputStats(approximate=True)
+        approx_stats.add_columns(["S1", "S1", "S2"], ["P1", "P2", "P2"])
+        self.assertEqual((3, 2, 2), (approx_stats.line_count, approx_stats.distinct_station_id_count, approx_stats.distinct_pdc_id_count))
+
+        # An estimate above the line count does not give a negative number of duplicates
+        from modules.import_logger import LogStats
+        approx_stats.line_count = 1
+        output = io.StringIO()
+        with redirect_stdout(output):
+            Report(self.input_file, LogStats(), approx_stats, {}, []).render_stdout()
+        self.assertIn("1 lignes (PDCs) en entrée | 0 PDCs en double (estimation)\n", output.getvalue())
+
+    def test_compressed_input(self):
+        import bz2, gc, gzip, lzma, tempfile, warnings
+        from modules import columnar
+        from modules.input_stats import read_input_stats
+
+        with open(self.input_file, 'rb') as f:
+            data = f.read()
+        with open(self.input_file) as f:
+            text = f.read()
+        log._import_logged_data = []
+        expected_stations = {}
+        expected_power_stats = columnar.group_csv(self.input_file, expected_stations)
+        expected_logs = log._import_logged_data
+        expected_stats = read_input_stats(self.input_file)
+        formats = [("gz", gzip.compress), ("bz2", bz2.compress), ("xz", lzma.compress)]
+        try:
+            from compression import zstd
+            formats.append(("zst", zstd.compress))
+        except ImportError:
+            try:
+                import zstandard
+                formats.append(("zst", zstandard.ZstdCompressor().compress))
+            except ImportError:
+                pass
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for extension, compress in formats:
+                file_name = "%s/irve.csv.%s" % (tmp_dir, extension)
+                with open(file_name, 'wb') as f:
+                    f.write(compress(data))
+                # The compressed file is closed with the reader
+                with warnings.catch_warnings(record=True) as caught:
+                    warnings.simplefilter("always", ResourceWarning)
+                    with open_input(file_name) as f:
+                        self.assertEqual(text, f.read())
+                    gc.collect()
+                self.assertEqual([], [w for w in caught if issubclass(w.category, ResourceWarning)])
+
+                log._import_logged_data = []
+                stations = {}
+                self.assertEqual(expected_power_stats, columnar.group_csv(file_name, stations))
+                self.assertEqual(expected_stations, stations)
+                self.assertEqual(expected_logs, log._import_logged_data)
+                stats = read_input_stats(file_name)
+                self.assertEqual((expected_stats.line_count, expected_stats.station_ids), (stats.line_count, stats.station_ids))
+
+    def test_input_snapshot(self):
+        import os
+        import tempfile
+        from modules import columnar, snapshot
+        from modules.input_stats import read_input_stats
+
+        with open(self.input_file) as csvfile:
+            rows = list(csv.DictReader(csvfile, delimiter=','))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # find() does not store the snapshot
+            self.assertIsNone(snapshot.find(self.input_file, tmp_dir))
+            self.assertEqual([], os.listdir(tmp_dir))
+            input_snapshot = snapshot.load(self.input_file, tmp_dir)
+            self.assertEqual(rows, list(input_snapshot.rows()))
+            self.assertEqual(input_snapshot.directory, snapshot.load(self.input_file, tmp_dir).directory)
+            self.assertEqual(input_snapshot.directory, snapshot.find(self.input_file, tmp_dir).directory)
+
+            log._import_logged_data = []
+            expected_stations = {}
+            expected_power_stats = columnar.group_csv(self.input_file, expected_stations)
+            expected_logs = log._import_logged_data
+            log._import_logged_data = []
+            stations = {}
+            self.assertEqual(expected_power_stats, columnar.group_csv(self.input_file, stations, snapshot=input_snapshot))
+            self.assertEqual(expected_stations, stations)
+            self.assertEqual(expected_logs, log._import_logged_data)
+
+            expected_stats = read_input_stats(self.input_file)
+            stats = read_input_stats(self.input_file, snapshot=input_snapshot)
+            self.assertEqual((expected_stats.line_count, expected_stats.station_ids, expected_stats.pdc_ids),
+                             (stats.line_count, stats.station_ids, stats.pdc_ids))
+
+            # Short and long rows, written and read by chunks (one of short rows only)
+            malformed_file = tmp_dir + "/malformed.csv"
+            with open(malformed_file, "w") as f:
+                f.write("a,b,c\n1,2,3\n6,7,8,9,10\n4,5\n\n9\n11,12,13\n")
+            with open(malformed_file) as csvfile:
+                malformed_rows = list(csv.DictReader(csvfile, delimiter=','))
+            chunk_rows, snapshot.CHUNK_ROWS = snapshot.CHUNK_ROWS, 2
+            try:
+                malformed_snapshot = snapshot.load(malformed_file, tmp_dir)
+                self.assertEqual(malformed_rows, list(malformed_snapshot.rows()))
+                self.assertEqual([["1", "2", "3"], ["6", "7", "8"], ["4", "5", ""], ["9", "", ""], ["11", "12", "13"]],
+                                 list(malformed_snapshot.value_rows(missing='')))
+            finally:
+                snapshot.CHUNK_ROWS = chunk_rows
+
+    def test_profile_history(self):
+        import tempfile
+        import tracemalloc
+        from modules import report
+        from modules.import_logger import LogStats
+
+        profiler = Profiler(trace_memory=True)
+        with profiler.stage("group") as stage:
+            stage.rows = 10
+            blob = bytearray(8 * 1024 * 1024)
+        del blob
+        with profiler.stage("aggregate"):
+            pass
+        # Own peak of every stage, unlike the peak of the process
+        self.assertGreaterEqual(profiler.stages["group"].peak_traced_mb, 8)
+        self.assertLess(profiler.stages["aggregate"].peak_traced_mb, 8)
+        tracemalloc.stop()
+        r = Report(self.input_file, LogStats(), InputStats(), {}, [], profile=profiler)
+        r.are_packages_installed = True
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            history_file, report.HISTORY_FILE = report.HISTORY_FILE, tmp_dir + "/history.csv"
+            try:
+                with open(report.HISTORY_FILE, "w") as f:
+                    f.write("date,in_line_count\n2024-01-01,5\n")
+                with utils.Capturing():
+                    # No profile columns without --profile
+                    Report(self.input_file, LogStats(), InputStats(), {}, []).store_history()
+                    with open(report.HISTORY_FILE) as f:
+                        unprofiled_header = next(csv.reader(f))
+                    r.store_history()
+                    Report(self.input_file, LogStats(), InputStats(), {}, []).store_history()
+                with open(report.HISTORY_FILE) as f:
+                    rows = list(csv.DictReader(f))
+            finally:
+                report.HISTORY_FILE = history_file
+        self.assertEqual(["date", "in_line_count", "in_distinct_pdc_id_count", "in_distinct_station_id_count", "out_station_count",
+                          "logs_count", "blocking_count", "error_count", "warning_count"], unprofiled_header)
+        rows.pop(1)
+        self.assertEqual(["date", "in_line_count", "in_distinct_pdc_id_count"], list(rows[0])[:3])
+        self.assertEqual(("5", ""), (rows[0]["in_line_count"], rows[0]["group_wall_s"]))
+        self.assertEqual("0", rows[1]["in_line_count"])
+        self.assertNotEqual("", rows[1]["group_wall_s"])
+        self.assertEqual("", rows[1]["html_wall_s"])
+        self.assertNotEqual("", rows[1]["group_peak_traced_mb"])
+        self.assertEqual("", rows[2]["group_wall_s"])
+
+        transformRef("FR*ABC*P123*1", "")
+        transformRef("FR*ABC*P123*1", "")
+        self.assertRegex(profiler.markdown(), r"\| transformRef \| [\d,]+ \| [\d,]+ \| \d+% \|")
+
+    def test_report_tables(self):
+        from modules.import_logger import LogStats
+
+        log_stats = LogStats()
+        for level, source, msg in [("error", "org-b", "m1"), ("error", "org-b", "m1"), ("warning", "org-b", "m2"),
+                                   ("error", "org-a", "m1"), ("error", "org-a", "<m3>")]:
+            log_stats.add(level, source, msg)
+        r = Report(self.input_file, log_stats, InputStats(), {}, [])
+        r.generate_report()
+
+        self.assertEqual([("error", 4), ("warning", 1)], r.severity_stats)
+        self.assertEqual("Sévérité     error warning  TOTAL\n"
+                         "Organisation                     \n"
+                         "TOTAL            4       1      5\n"
+                         "org-b            2       1      3\n"
+                         "org-a            2       -      2", r.severity_by_source.to_string())
+        html = r.msg_by_source.to_html()
+        self.assertIn('<th rowspan="2" valign="top">org-a</th>', html)
+        self.assertIn('<th>&lt;m3&gt;</th>', html)
+
+    def test_near_duplicates(self):
+        station_list, _, _ = self._group_input()
+        self.assertEqual([], list(duplicates.find_duplicates(station_list)))
+
+        station_id, station = next(iter(station_list.items()))
+        attributes = station['attributes']
+        # 11 m north, the same station under another id
+        station_list["FRXXXP0000001"] = {'attributes': dict(attributes, Ylatitude=attributes['Ylatitude'] + 0.0001)}
+        # ... and a second charging point of the operator, at the same place
+        station_list["FRXXXP0000002"] = {'attributes': dict(attributes, nom_station=attributes['nom_station'] + " 2", adresse_station="")}
+        found = list(duplicates.find_duplicates(station_list))
+        self.assertEqual([("FRXXXP0000001", station_id)], [(duplicate, other) for duplicate, other, _ in found])
+        self.assertAlmostEqual(11.1, found[0][2], places=1)
+
+        # Non finite coordinates are accepted by validate_coord, and left out of the grid
+        station_list["FRXXXP0000003"] = {'attributes': dict(attributes, Xlongitude=float("nan"))}
+        station_list["FRXXXP0000004"] = {'attributes': dict(attributes, Ylatitude=float("inf"))}
+        self.assertEqual(found, list(duplicates.find_duplicates(station_list)))
+
+    def test_commune_check(self):
+        import json
+        import tempfile
+        from modules import communes
+
+        square = [[0, 46], [1, 46], [1, 47], [0, 47], [0, 46]]
+        hole = [[0.4, 46.4], [0.6, 46.4], [0.6, 46.6], [0.4, 46.6], [0.4, 46.4]]
+        geojson = {"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": {"code": "75056"},
+             "geometry": {"type": "MultiPolygon", "coordinates": [[square, hole], [[[c[0] + 2, c[1]] for c in square]]]}},
+            {"type": "Feature", "properties": {"code": "01001"}, "geometry": {"type": "Polygon", "coordinates": [hole]}},
+        ]}
+        def station(code, lon, lat):
+            return {'attributes': {'code_insee_commune': code, 'Xlongitude': lon, 'Ylatitude': lat, 'source_grouped': "org"}}
+        station_list = {
+            "inside": station("75056", 0.2, 46.2),
+            "second_polygon": station("75056", 2.5, 46.5),
+            "arrondissement": station("75101", 0.9, 46.9),
+            "short_code": station("1001", 0.5, 46.5),
+            "in_hole": station("75056", 0.5, 46.5),
+            "swapped": station("75056", 46.2, 0.2),
+            "unknown_code": station("99999", 0.5, 46.5),
+            "not_finite": station("75056", float("nan"), float("inf")),
+        }
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(tmp_dir + "/communes.geojson", "w") as f:
+                json.dump(geojson, f)
+            index = communes.load(tmp_dir + "/communes.geojson", tmp_dir)
+            self.assertEqual(index.codes, communes.load(tmp_dir + "/communes.geojson", tmp_dir).codes)
+
+        with log.capture() as records:
+            self.assertEqual(3, communes.check_stations(station_list, index))
+        self.assertEqual([("in_hole", communes.MSG_OUTSIDE_COMMUNE), ("swapped", communes.MSG_SWAPPED_COORD),
+                          ("not_finite", communes.MSG_OUTSIDE_COMMUNE)],
+                         [(record['station_id'], record['msg']) for record in records])
+        self.assertIn("dans la commune: 01001", records[0]['detail'])
+
+    def test_name_suggestions(self):
+        fixes = {"TOTAL ENERGIES": "TotalEnergies", "Izivia": "IZIVIA", "Freshmile SAS": "Freshmile"}
+        index = name_matching.NameIndex(fixes)
+        self.assertEqual(("TotalEnergies", 1.0), index.suggest("Total-Énergies"))
+        self.assertEqual("IZIVIA", index.suggest("IZIVIA by EDF")[0])
+        self.assertIsNone(index.suggest("Ionity"))
+
+        station_list = {station_id: {'attributes': dict.fromkeys(name_matching.NAME_ATTRIBUTES, name)}
+                        for station_id, name in [(1, "Total Energies"), (2, "Total Energies"), (3, "Freshmile"), (4, "Ionity")]}
+        self.assertEqual([("Total Energies", "TotalEnergies", 1.0, 2)], name_matching.suggest_fixes(station_list, fixes))
+
+    def test_write_outputs(self):
+        import json
+        import tempfile
+        station_list, _, _ = self._group_input()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            counts = writers.write_outputs(station_list, tmp_dir, geojson=True)
+            with open(tmp_dir + "/opendata_stations.csv") as f:
+                stations = list(csv.DictReader(f))
+            with open(tmp_dir + "/opendata_networks.csv") as f:
+                networks = list(csv.DictReader(f))
+            with open(tmp_dir + "/opendata_stations.geojson") as f:
+                features = json.load(f)["features"]
+        self.assertEqual(len(station_list), len(stations))
+        self.assertEqual(counts["opendata_networks.csv"], len(networks))
+        self.assertEqual(sorted(set((s['nom_operateur'], s['nom_enseigne']) for s in stations)),
+                         [(n['nom_operateur'], n['nom_enseigne']) for n in networks])
+        self.assertEqual(len(station_list), sum(int(n['station_count']) for n in networks))
+        self.assertEqual([stations[0]['Xlongitude'], stations[0]['Ylatitude']], [str(c) for c in features[0]["geometry"]["coordinates"]])
+        self.assertEqual(len(station_list), counts["opendata_stations.geojson"])
+
+        # Non-finite coordinates are skipped, the GeoJSON staying valid JSON
+        first_id = next(iter(station_list))
+        station_list[first_id]['attributes']['Xlongitude'] = float("nan")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.assertEqual(len(station_list) - 1, writers.write_geojson(station_list, tmp_dir + "/stations.geojson"))
+            with open(tmp_dir + "/stations.geojson") as f:
+                features = json.load(f, parse_constant=lambda constant: self.fail(constant))["features"]
+        self.assertNotIn(first_id, [feature["properties"]["id_station_itinerance"] for feature in features])
+
+    def test_tiles(self):
+        import json
+        import tempfile
+        station_list, _, _ = self._group_input()
+        levels = {station_id: 'error' for station_id in list(station_list)[:3]}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            written, removed = tiles.build_tiles(station_list, levels, tmp_dir)
+            self.assertGreater(written, tiles.MAX_ZOOM)
+            with open(tmp_dir + "/0/0/0.geojson") as f:
+                features = json.load(f)["features"]
+            self.assertEqual(len(station_list), sum(feature["properties"].get("count", 1) for feature in features))
+            self.assertEqual(3, sum(feature["properties"].get("error", feature["properties"].get("level") == 'error') for feature in features))
+            self.assertEqual((0, 0), tiles.build_tiles(station_list, levels, tmp_dir))
+
+            # Only the tiles holding the station are written again
+            station_id = next(iter(station_list))
+            station_list[station_id]['attributes']['nom_station'] += " bis"
+            self.assertEqual((tiles.MAX_ZOOM + 1, 0), tiles.build_tiles(station_list, levels, tmp_dir))
+            del station_list[station_id]
+            written, removed = tiles.build_tiles(station_list, levels, tmp_dir)
+            self.assertLessEqual(written + removed, tiles.MAX_ZOOM + 1)
+
+            # Stations without finite coordinates are left out
+            station_list["FRXXXP0000001"] = {'attributes': dict(station_list[next(iter(station_list))]['attributes'], Xlongitude=float("nan"))}
+            self.assertEqual((0, 0), tiles.build_tiles(station_list, levels, tmp_dir))
+
+    def test_run_diff(self):
+        import os
+        import tempfile
+        from modules import run_diff
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.makedirs(tmp_dir + "/previous")
+            os.makedirs(tmp_dir + "/output")
+            def write(file_name, rows):
+                with open(tmp_dir + "/" + file_name, "w") as f:
+                    csv.writer(f).writerows(rows)
+            write("previous/opendata_stations.csv", [["id_station_itinerance", "nom_station", "source_grouped"],
+                                                     ["FR*A", "A", "org-a"], ["FR*B", "B", "org-a"], ["FR*C", "C", "org-b"]])
+            write("output/opendata_stations.csv", [["id_station_itinerance", "source_grouped", "nom_station"],
+                                                   ["FR*A", "org-a", "A"], ["FR*C", "org-b", "C bis"], ["FR*D", "org-b", "D"]])
+            write("previous/opendata_errors.csv", [["level", "station_id", "source", "msg"],
+                                                   ["error", "FR*A", "org-a", "x"], ["error", "FR*A", "org-a", "x"], ["warning", "FR*B", "org-a", "y"]])
+            write("output/opendata_errors.csv", [["level", "station_id", "source", "msg"],
+                                                 ["error", "FR*A", "org-a", "x"], ["warning", "FR*D", "org-b", "z"]])
+            changes = run_diff.compare_runs(tmp_dir + "/previous", tmp_dir + "/output")
+
+        self.assertEqual([("added", "FR*D", "org-b", "", "", ""), ("modified", "FR*C", "org-b", "nom_station", "C", "C bis"),
+                          ("removed", "FR*B", "org-a", "", "", "")], sorted(changes.station_changes))
+        self.assertEqual([("new", "warning", "FR*D", "org-b", "z"), ("resolved", "error", "FR*A", "org-a", "x"),
+                          ("resolved", "warning", "FR*B", "org-a", "y")], sorted(changes.error_changes))
+        self.assertEqual({"added": 1, "modified": 1, "new": 1}, changes.by_source["org-b"])
+        self.assertEqual({"removed": 1, "resolved": 2}, changes.by_source["org-a"])
+        self.assertEqual((("TOTAL",), [1, 1, 1, 1, 2, 6]), changes.table().rows[-1])
+
+    def test_run_diff_same_input(self):
+        import os
+        import shutil
+        import subprocess
+        import sys
+        import tempfile
+        from modules import run_diff
+        # Two runs of the same input, under different hash seeds, have no changes
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for seed in ("1", "2"):
+                run_dir = os.path.join(tmp_dir, "run" + seed)
+                os.makedirs(os.path.join(run_dir, "output"))
+                shutil.copy("fixes_networks.csv", run_dir)
+                subprocess.run([sys.executable, os.path.abspath(__file__), "-i", os.path.abspath(self.input_file)], cwd=run_dir,
+                               env={**os.environ, "PYTHONHASHSEED": seed}, check=True, stdout=subprocess.DEVNULL)
+            changes = run_diff.compare_runs(os.path.join(tmp_dir, "run1", "output"), os.path.join(tmp_dir, "run2", "output"))
+        self.assertEqual([], changes.station_changes)
+        self.assertEqual([], changes.error_changes)
+
+    def test_osm_stats(self):
+        import json
+        import tempfile
+        from unittest import mock
+        from modules import osm_stats
+        elements = [
+            {"type": "node", "id": 1, "tags": {"amenity": "charging_station", "ref:EU:EVSE": "FR*A", "capacity": "4", "addr:postcode": "20167", "fee": "no"}},
+            {"type": "node", "id": 2, "tags": {"amenity": "charging_station", "capacity": "deux", "bicycle": "yes", "FIXME": "?"}},
+            {"type": "way", "id": 3, "tags": {"amenity": "parking"}},
+            {"type": "node", "id": 4},
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(tmp_dir + "/extract.json", "w") as f:
+                json.dump({"version": 0.6, "osm3s": {"copyright": "ODbL"}, "elements": elements}, f, indent=1)
+            with open(tmp_dir + "/extract.osm", "w") as f:
+                f.write('<?xml version="1.0"?>\n<osm version="0.6">\n')
+                for element in elements:
+                    f.write('<{0} id="{1}">{2}</{0}>\n'.format(element["type"], element["id"], "".join(
+                        '<tag k="{}" v="{}"/>'.format(k, v) for k, v in element.get("tags", {}).items())))
+                f.write('</osm>\n')
+            # Elements cut by the end of every chunk
+            with mock.patch.object(osm_stats, "CHUNK_SIZE", 7):
+                from_json = osm_stats.OsmStats().add_all(osm_stats.read_elements(tmp_dir + "/extract.json"))
+            from_xml = osm_stats.OsmStats().add_all(osm_stats.read_elements(tmp_dir + "/extract.osm"))
+
+            osm_stats.append_history(tmp_dir + "/osm_stats.csv", [osm_stats.OsmStats.row(from_json.totals)])
+            osm_stats.append_history(tmp_dir + "/osm_stats.csv", [osm_stats.OsmStats.row(from_xml.totals)])
+            with open(tmp_dir + "/osm_stats.csv") as f:
+                history = list(csv.DictReader(f))
+
+        self.assertEqual(from_json.totals, from_xml.totals)
+        self.assertEqual({"total_number": "2", "total_number_motorcar": "0", "total_number_bicycle": "1", "total_with_open_data_ref": "1",
+                          "total_with_fixme": "1", "percentage_free": "50.0", "total_number_of_parking_spaces": "5"}, history[1])
+        self.assertEqual(["2A", "inconnu"], sorted(from_json.by_group))
+        self.assertEqual([("deux", "node/2")], from_xml.invalid_capacities)
+
+    def test_create_sqlite(self):
+        import sqlite3
+        import tempfile
+        from modules import sqlite_export
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with log.streaming(tmp_dir + "/errors.csv"):
+                station_list = {}
+                with open(self.input_file) as csvfile:
+                    group_rows(csv.DictReader(csvfile, delimiter=','), station_list)
+                finalize_stations(station_list)
+            sqlite_export.create_sqlite(self.input_file, tmp_dir + "/errors.csv", tmp_dir + "/irve.db")
+
+            with open(self.input_file) as csvfile:
+                rows = list({tuple(row.values()): row for row in csv.DictReader(csvfile, delimiter=',')}.values())
+            with open(tmp_dir + "/errors.csv") as csvfile:
+                logs = {}
+                for log_id, record in enumerate(csv.DictReader(csvfile, delimiter=',')):
+                    logs.setdefault(tuple(record.items()), log_id)
+            expected = []
+            for record, log_id in logs.items():
+                record = dict(record)
+                joined = [row['id_pdc_itinerance'] for row in rows if record['station_id'] != '' and row['id_station_itinerance'] == record['station_id']
+                          and record['pdc_id'] in ('', row['id_pdc_itinerance'])]
+                expected += [(log_id, record['msg'], pdc_id) for pdc_id in joined or [None]]
+
+            conn = sqlite3.connect(tmp_dir + "/irve.db")
+            self.assertEqual(sorted(expected), sorted(conn.execute("SELECT log_id, msg, id_pdc_itinerance FROM logs").fetchall()))
+            types = {name: declared for _, name, declared, *_ in conn.execute("PRAGMA table_info(logs)")}
+            self.assertEqual(("INT", "REAL", "INT", "TEXT"), (types['nbre_pdc'], types['puissance_nominale'], types['prise_type_2'], types['station_id']))
+            indexes = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            self.assertEqual({"logs_" + "_".join(columns) for columns in sqlite_export.LOGS_INDEXES}, indexes)
+            for table, query in sqlite_export.SUMMARY_TABLES.items():
+                self.assertEqual(conn.execute(query).fetchall(), conn.execute(f"SELECT * FROM {table}").fetchall(), table)
+            self.assertEqual(conn.execute("""SELECT l.datagouv_organization_or_owner, problemes, level, count(1) as occurrences, msg FROM logs l
+                LEFT JOIN (SELECT datagouv_organization_or_owner, count(1) as problemes FROM logs GROUP BY datagouv_organization_or_owner) AS b
+                ON b.datagouv_organization_or_owner = l.datagouv_organization_or_owner
+                GROUP BY l.datagouv_organization_or_owner, level, msg ORDER BY problemes DESC, level""").fetchall(),
+                conn.execute("SELECT * FROM summary_organisation_msg").fetchall())
+            conn.close()
+
+            # Types of the whole input, not only of the exported rows, and reals as parsed by float()
+            with open(tmp_dir + "/errors_s1.csv", "w") as f:
+                f.write("level,source,station_id,pdc_id,msg,detail\nerror,org,S1,,m,\n")
+            with open(tmp_dir + "/irve_s1.csv", "w") as f:
+                f.write("id_station_itinerance,id_pdc_itinerance,datagouv_organization_or_owner,puissance_nominale,code\n"
+                        "S1,P1,org,6.857599,12\nS2,P2,org,22,A1\n")
+            from modules import snapshot
+            for input_snapshot in (None, snapshot.load(tmp_dir + "/irve_s1.csv", tmp_dir + "/snapshots")):
+                sqlite_export.create_sqlite(tmp_dir + "/irve_s1.csv", tmp_dir + "/errors_s1.csv", tmp_dir + "/s1.db", snapshot=input_snapshot)
+                conn = sqlite3.connect(tmp_dir + "/s1.db")
+                self.assertEqual([(6.857599, "12")], conn.execute("SELECT puissance_nominale, code FROM logs").fetchall())
+                conn.close()
+
+    @staticmethod
+    def _load_local_server():
+        import importlib.util
+        spec = importlib.util.spec_from_file_location("start_local_server", "frontend/start_local_server.py")
+        server = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(server)
+        return server
+
+    @staticmethod
+    @contextmanager
+    def _serving(server, directory):
+        """ Base URL of the RequestHandler of start_local_server.py, serving directory from a thread """
+        import functools
+        import http.server
+        import threading
+        class QuietHandler(server.RequestHandler):
+            def log_message(self, *args):
+                pass
+        httpd = http.server.ThreadingHTTPServer(("localhost", 0), functools.partial(QuietHandler, directory=directory))
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield "http://localhost:%d" % httpd.server_address[1]
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+    def test_local_server_query(self):
+        import json
+        import os
+        import sqlite3
+        import tempfile
+        import urllib.error
+        import urllib.parse
+        import urllib.request
+        server = self._load_local_server()
+
+        def query(base_url, sql=None, **params):
+            if sql is not None:
+                params["sql"] = sql
+            try:
+                with urllib.request.urlopen(base_url + "/api/query?" + urllib.parse.urlencode(params)) as response:
+                    return response.status, json.load(response)
+            except urllib.error.HTTPError as e:
+                return e.code, json.load(e)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_file = os.path.join(tmp_dir, "irve.db")
+            conn = sqlite3.connect(db_file)
+            conn.execute("CREATE TABLE t (x INTEGER)")
+            conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(30)])
+            conn.commit()
+            conn.close()
+            server.DB_FILE = db_file
+            server.pool = server.ConnectionPool(db_file, 2)
+
+            with self._serving(server, tmp_dir) as base_url:
+                status, page = query(base_url, "SELECT x FROM t ORDER BY x", limit=10)
+                self.assertEqual((200, ["x"], [[i] for i in range(10)], True), (status, page["columns"], page["values"], page["has_more"]))
+                status, page = query(base_url, "SELECT x FROM t ORDER BY x", offset=25, limit=10)
+                self.assertEqual(([[i] for i in range(25, 30)], False), (page["values"], page["has_more"]))
+
+                # Queries differing by comments and whitespaces share their cached pages
+                hits = server.run_query.cache_info().hits
+                status, page = query(base_url, "SELECT x  FROM t -- first page\n ORDER BY x;", limit=10)
+                self.assertEqual((200, [[i] for i in range(10)]), (status, page["values"]))
+                self.assertEqual(hits + 1, server.run_query.cache_info().hits)
+
+                for params in ({"sql": "SELECT 1; SELECT 2"}, {"sql": "DELETE FROM t"}, {"sql": "SELECT * FROM missing"}, {}):
+                    status, page = query(base_url, **params)
+                    self.assertEqual(400, status, params)
+                    self.assertIn("error", page)
+                self.assertEqual(30, len(query(base_url, "SELECT x FROM t", limit=100)[1]["values"]))
+
+            # Connections are reused, and reopened once the database has changed
+            with server.pool.connection(1) as first:
+                pass
+            with server.pool.connection(1) as second:
+                self.assertIs(first, second)
+            with server.pool.connection(2) as third:
+                self.assertIsNot(first, third)
+            self.assertEqual(2, server.pool.connections.qsize())
+
+    def test_local_server_ranges(self):
+        import os
+        import tempfile
+        import urllib.error
+        import urllib.request
+        server = self._load_local_server()
+        data = bytes(range(100))
+
+        def get(base_url, **headers):
+            request = urllib.request.Request(base_url + "/data.bin", headers=headers)
+            try:
+                with urllib.request.urlopen(request) as response:
+                    return response.status, response.headers, response.read()
+            except urllib.error.HTTPError as e:
+                return e.code, e.headers, e.read()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, "data.bin"), "wb") as f:
+                f.write(data)
+            with self._serving(server, tmp_dir) as base_url:
+                status, headers, body = get(base_url)
+                self.assertEqual((200, data, "bytes"), (status, body, headers["Accept-Ranges"]))
+                etag = headers["ETag"]
+
+                for range_header, start, end in [("bytes=-10", 90, 99), ("bytes=-200", 0, 99), ("bytes=90-", 90, 99),
+                                                 ("bytes=10-19", 10, 19), ("bytes=95-200", 95, 99)]:
+                    status, headers, body = get(base_url, Range=range_header)
+                    self.assertEqual((206, data[start:end + 1], "bytes %d-%d/100" % (start, end)),
+                                     (status, body, headers["Content-Range"]), range_header)
+
+                # Unsatisfiable ranges
+                for range_header in ("bytes=100-", "bytes=150-160"):
+                    status, headers, body = get(base_url, Range=range_header)
+                    self.assertEqual((416, b"", "bytes */100"), (status, body, headers["Content-Range"]), range_header)
+
+                # Reversed, multiple or outdated (If-Range) ranges get the whole file
+                for headers in ({"Range": "bytes=20-10"}, {"Range": "bytes=0-1,5-6"}, {"Range": "bytes=0-9", "If-Range": '"outdated"'}):
+                    self.assertEqual((200, data), get(base_url, **headers)[::2], headers)
+                self.assertEqual(206, get(base_url, Range="bytes=0-9", **{"If-Range": etag})[0])
+                self.assertEqual(304, get(base_url, **{"If-None-Match": etag})[0])
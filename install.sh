@@ -1,7 +0,0 @@
-#!/bin/bash
-
-set -ev
-
-# install xsv
-wget https://github.com/BurntSushi/xsv/releases/download/0.13.0/xsv-0.13.0-x86_64-unknown-linux-musl.tar.gz
-tar -zxvf xsv-0.13.0-x86_64-unknown-linux-musl.tar.gz
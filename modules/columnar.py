@@ -0,0 +1,213 @@
+"""
+Columnar engine for the validate-and-group pipeline.
+
+The input is loaded once into pandas columns and every step of modules.grouping
+(validation, id and phone cleaning, name fixes, per-station aggregations, power
+computation) is done on whole columns. Per-value Python functions are only called
+once per distinct value. Logs are sorted back in the order the row engine emits
+them, so both engines write byte-identical outputs.
+"""
+import numpy as np
+import pandas as pd
+
+from . import import_logger as log
+from .compressed import open_input
+from .normalize import REF_RGX
+from .power import compute_max_power_per_station, power_issue_logs
+from .grouping import (station_attributes, pdc_attributes, wrong_ortho, grouped_attributes, socket_counts, power_attributes,
+                       validate_coord, is_correct_id, format_values, transformRef, cleanPhoneNumber, fix_name, stringBoolToInt,
+                       MSG_NO_ID, MSG_INVALID_COORD, MSG_INVALID_ID, MSG_INVALID_PHONE, MSG_INVALID_DEUX_ROUES,
+                       MSG_MULTIPLE_SOURCES, MSG_NBRE_PDC, MSG_NO_SOCKET)
+
+# Position of the station checks in the logs of a station, after the grouped_attributes ones
+CHECK_NBRE_PDC = len(grouped_attributes) + 1
+CHECK_NO_SOCKET = CHECK_NBRE_PDC + 1
+CHECK_POWER = CHECK_NO_SOCKET + 1
+
+def map_unique(values, func):
+    """ Applies func once per distinct value of the given array.
+    """
+    codes, uniques = pd.factorize(values)
+    mapped = np.empty(len(uniques), dtype=object)
+    for i, value in enumerate(uniques):
+        mapped[i] = func(value)
+    return mapped[codes]
+
+def transform_refs(raw_ids, local_ids):
+    """ Column version of grouping.transformRef.
+    Well-formed ids are kept as is, the others go through transformRef one by one.
+    """
+    well_formed = map_unique(raw_ids, lambda v: REF_RGX.match(v) is not None).astype(bool)
+    refs = raw_ids.copy()
+    malformed = np.flatnonzero(~well_formed)
+    refs[malformed] = [transformRef(iti, loc) for iti, loc in zip(raw_ids[malformed].tolist(), local_ids[malformed].tolist())]
+    return refs, well_formed
+
+def are_correct_ids(refs, well_formed):
+    """ Column version of grouping.is_correct_id, knowing that well-formed ids are correct
+    """
+    correct = well_formed.copy()
+    others = np.flatnonzero(~well_formed)
+    correct[others] = [is_correct_id(ref) for ref in refs[others].tolist()]
+    return correct
+
+def value_sets(codes, values, selected):
+    """ Distinct values of the selected groups, as sets filled in row order.
+    """
+    sets = {code: set() for code in selected.tolist()}
+    rows = np.isin(codes, selected)
+    for code, value in zip(codes[rows].tolist(), values[rows].tolist()):
+        sets[code].add(value)
+    return sets
+
+def distinct_count(codes, values, group_count):
+    value_codes, uniques = pd.factorize(values)
+    pairs = np.unique(codes.astype(np.int64) * len(uniques) + value_codes)
+    return np.bincount(pairs // len(uniques), minlength=group_count)
+
+def group_csv(input_file, station_list, input_stats=None, snapshot=None):
+    """
+    Columnar equivalent of grouping.group_rows followed by grouping.finalize_stations.
+    Fills station_list with `{'attributes': ...}` entries, logs every issue and
+    returns the max power per socket type of every station.
+    Every row of the input is counted in input_stats, if given.
+    Columns are loaded from snapshot (a modules.snapshot.Snapshot of input_file), if given.
+    """
+    columns = list(dict.fromkeys(station_attributes + pdc_attributes + ['consolidated_longitude', 'consolidated_latitude']))
+    if snapshot is not None:
+        data = {column: snapshot.column(column, missing='') for column in columns}
+    else:
+        with open_input(input_file) as csvfile:
+            df = pd.read_csv(csvfile, dtype=str, usecols=columns, keep_default_na=False, na_filter=False)
+        data = {column: df[column].to_numpy() for column in columns}
+    pending = [] # (sort key, log function, log arguments)
+
+    raw_ids = data['id_station_itinerance']
+    if input_stats is not None:
+        input_stats.add_columns(raw_ids, data['id_pdc_itinerance'])
+    sources = data['datagouv_organization_or_owner']
+    longitudes = data['consolidated_longitude']
+    latitudes = data['consolidated_latitude']
+
+    # Row validation
+    no_id = raw_ids == ''
+    for i in np.flatnonzero(no_id).tolist():
+        pending.append(((0, i, 0), log.blocking, dict(station_id=None, source=sources[i], msg=MSG_NO_ID, detail=None)))
+    candidates = ~no_id & (raw_ids != "Non concerné")
+
+    local_ids = data['id_station_local']
+    clean_refs, well_formed = transform_refs(raw_ids, local_ids)
+    valid_coords = map_unique(longitudes, validate_coord).astype(bool) & map_unique(latitudes, validate_coord).astype(bool)
+    invalid_coords = candidates & ~valid_coords
+    for i in np.flatnonzero(invalid_coords).tolist():
+        pending.append(((0, i, 0), log.blocking, dict(station_id=raw_ids[i], source=sources[i], msg=MSG_INVALID_COORD,
+            detail="consolidated_longitude: {}, consolidated_latitude: {}".format(longitudes[i], latitudes[i]))))
+    candidates &= valid_coords
+
+    correct_ids = are_correct_ids(clean_refs, well_formed)
+    for i in np.flatnonzero(candidates & ~correct_ids).tolist():
+        pending.append(((0, i, 0), log.blocking, dict(station_id=raw_ids[i], source=sources[i], msg=MSG_INVALID_ID,
+            detail="iti: %s, local: %s" % (raw_ids[i], local_ids[i]))))
+    rows = np.flatnonzero(candidates & correct_ids)
+
+    if len(rows) == 0:
+        _emit(pending)
+        return []
+
+    # Stations, in order of their first valid row
+    codes, station_ids = pd.factorize(raw_ids[rows])
+    station_count = len(station_ids)
+    _, first_positions = np.unique(codes, return_index=True)
+    first_rows = rows[first_positions]
+
+    attributes = {}
+    for key in station_attributes:
+        attributes[key] = map_unique(data[key][first_rows], lambda v: fix_name(v, wrong_ortho))
+    attributes['id_station_itinerance'] = clean_refs[first_rows]
+
+    raw_phones = data['telephone_operateur'][first_rows]
+    phones = map_unique(raw_phones, cleanPhoneNumber)
+    for c in np.flatnonzero(np.equal(phones, None) & (raw_phones != "")).tolist():
+        pending.append(((0, int(first_rows[c]), 0), log.warning, dict(station_id=station_ids[c], source=sources[first_rows[c]],
+            msg=MSG_INVALID_PHONE, detail=raw_phones[c])))
+    attributes['telephone_operateur'] = phones
+
+    raw_deux_roues = data['station_deux_roues'][first_rows]
+    deux_roues = map_unique(raw_deux_roues, str.lower)
+    invalid_deux_roues = ~np.isin(deux_roues, ['true', 'false', ''])
+    for c in np.flatnonzero(invalid_deux_roues).tolist():
+        pending.append(((0, int(first_rows[c]), 1), log.warning, dict(station_id=station_ids[c], source=sources[first_rows[c]],
+            msg=MSG_INVALID_DEUX_ROUES, detail=raw_deux_roues[c])))
+    deux_roues[invalid_deux_roues] = None
+    attributes['station_deux_roues'] = deux_roues
+
+    attributes['Xlongitude'] = map_unique(longitudes[first_rows], float)
+    attributes['Ylatitude'] = map_unique(latitudes[first_rows], float)
+
+    # Per-station aggregations
+    station_sources = sources[rows]
+    source_grouped = station_sources[first_positions]
+    multiple_sources = distinct_count(codes, station_sources, station_count) != 1
+    source_sets = value_sets(codes, station_sources, np.flatnonzero(multiple_sources))
+    for c, values in source_sets.items():
+        pending.append(((1, c, 0), log.error, dict(station_id=station_ids[c], source="multiples", msg=MSG_MULTIPLE_SOURCES, detail=format_values(values))))
+        source_grouped[c] = min(values, key=str)
+    attributes['source_grouped'] = source_grouped
+
+    for check, (column, normalize, name, msg) in enumerate(grouped_attributes, start=1):
+        values = map_unique(data[column][rows], normalize)
+        grouped = values[first_positions]
+        inconsistent = distinct_count(codes, values, station_count) != 1
+        for c, distinct_values in value_sets(codes, values, np.flatnonzero(inconsistent)).items():
+            pending.append(((1, c, check), log.warning, dict(station_id=station_ids[c], source=source_grouped[c], msg=msg, detail=format_values(distinct_values))))
+        grouped[inconsistent] = None
+        attributes[name] = grouped
+
+    pdc_counts = np.bincount(codes, minlength=station_count)
+    declared = attributes['nbre_pdc']
+    declared_counts = map_unique(declared, int)
+    wrong_counts = np.flatnonzero(declared_counts != pdc_counts)
+    nbre_pdc = declared.copy()
+    for c in wrong_counts.tolist():
+        pending.append(((1, c, CHECK_NBRE_PDC), log.error, dict(station_id=station_ids[c], source=source_grouped[c], msg=MSG_NBRE_PDC,
+            detail="{} points de charge indiqués pour la station (nbre_pdc) mais {} points de charge listés".format(declared[c], pdc_counts[c]))))
+        nbre_pdc[c] = min(int(pdc_counts[c]), declared_counts[c])
+    attributes['nbre_pdc'] = nbre_pdc
+    attributes['nb_prises_grouped'] = pdc_counts
+
+    masks = np.zeros(len(rows), dtype=np.int64)
+    total_sockets = np.zeros(station_count, dtype=np.int64)
+    for column, name, flag in socket_counts:
+        socket_flags = map_unique(data[column][rows], stringBoolToInt).astype(np.int64)
+        attributes[name] = np.bincount(codes, weights=socket_flags, minlength=station_count).astype(np.int64)
+        total_sockets += attributes[name]
+        masks |= socket_flags * flag.value
+    for c in np.flatnonzero(total_sockets == 0).tolist():
+        pending.append(((1, c, CHECK_NO_SOCKET), log.error, dict(station_id=station_ids[c], source=source_grouped[c], msg=MSG_NO_SOCKET,
+            detail="nb pdc: %s" % (pdc_counts[c]))))
+
+    # Max power per socket type
+    power_texts = data['puissance_nominale'][rows]
+    powers = map_unique(power_texts, float).astype(np.float64)
+    power_stats, issues = compute_max_power_per_station(codes, station_count, powers, masks)
+    pdc_ids = data['id_pdc_itinerance'][rows]
+    for p, suspicious, err_socket in issues:
+        c = int(codes[p])
+        for k, (log_function, record) in enumerate(power_issue_logs(station_ids[c], pdc_ids[p], source_grouped[c],
+                                                                    power_texts[p], masks[p], suspicious, err_socket)):
+            pending.append(((1, c, CHECK_POWER, p, k), log_function, record))
+    for name, values in zip(power_attributes, zip(*power_stats)):
+        attributes[name] = list(values)
+
+    _emit(pending)
+
+    keys = list(attributes)
+    columns = [attributes[key].tolist() if isinstance(attributes[key], np.ndarray) else attributes[key] for key in keys]
+    for station_id, values in zip(station_ids.tolist(), zip(*columns)):
+        station_list[station_id] = {'attributes': dict(zip(keys, values))}
+    return power_stats
+
+def _emit(pending):
+    pending.sort(key=lambda item: item[0])
+    for _, log_function, record in pending:
+        log_function(**record)
@@ -0,0 +1,186 @@
+"""
+Check that the coordinates of the stations fall within their commune (code_insee_commune).
+
+Commune boundaries are read from a local GeoJSON file, e.g. the communes of
+https://github.com/gregoiredavid/france-geojson or of geo.api.gouv.fr. They are turned
+once into flat arrays of polygon edges, cached in cache/communes (keyed by the content
+of the file), so that later runs do not parse the GeoJSON again.
+
+Stations are checked commune by commune: the points of a commune are tested against
+all its edges at once with numpy (even-odd ray casting, which handles holes and
+multipolygons). The few stations outside their commune are then looked for in a grid
+index of the commune bounding boxes, to tell swapped latitude/longitude from a wrong
+commune code.
+"""
+import json
+import math
+import os
+
+import numpy as np
+
+from . import import_logger as log
+from .snapshot import content_hash
+
+CACHE_DIR = "cache/communes"
+# Bump whenever the layout of the cached arrays changes
+INDEX_VERSION = 1
+# Properties holding the INSEE code of a commune, in the usual GeoJSON files
+CODE_PROPERTIES = ['code', 'insee', 'code_insee', 'INSEE_COM']
+# Grid cells of the bounding box index, in degrees
+CELL_SIZE = 0.1
+# Points x edges tested at once, bounding the memory of the batches
+BATCH_SIZE = 1 << 20
+
+# Arrondissements of Paris, Lyon and Marseille, used as commune codes by some stations
+ARRONDISSEMENTS = {'75056': range(75101, 75121), '69123': range(69381, 69390), '13055': range(13201, 13217)}
+COMMUNE_OF_ARRONDISSEMENT = {str(code): commune for commune, codes in ARRONDISSEMENTS.items() for code in codes}
+
+MSG_OUTSIDE_COMMUNE = "les coordonnées de la station ne sont pas dans sa commune (code_insee_commune)"
+MSG_SWAPPED_COORD = "la latitude et la longitude de la station semblent inversées"
+
+def _rings(geometry):
+    if geometry is None:
+        return []
+    if geometry['type'] == 'Polygon':
+        return geometry['coordinates']
+    if geometry['type'] == 'MultiPolygon':
+        return [ring for polygon in geometry['coordinates'] for ring in polygon]
+    return []
+
+def _code(properties):
+    for name in CODE_PROPERTIES:
+        if properties.get(name):
+            return str(properties[name])
+    return None
+
+def _read_geojson(file_name):
+    """ INSEE codes, edge offsets (by commune), edges (x1, y1, x2, y2) and bounding boxes of the communes """
+    with open(file_name, 'rb') as f:
+        features = json.load(f)['features']
+    codes, offsets, edges = [], [0], []
+    for feature in features:
+        code = _code(feature.get('properties') or {})
+        rings = [np.asarray(ring, dtype=np.float64)[:, :2] for ring in _rings(feature.get('geometry'))]
+        rings = [ring for ring in rings if len(ring) > 1]
+        if code is None or not rings:
+            continue
+        codes.append(code)
+        for ring in rings:
+            edges.append(np.hstack([ring[:-1], ring[1:]]))
+        offsets.append(offsets[-1] + sum(len(ring) - 1 for ring in rings))
+    edges = np.vstack(edges) if edges else np.zeros((0, 4))
+    offsets = np.array(offsets, dtype=np.int64)
+    bboxes = np.array([(edges[start:end, 0].min(), edges[start:end, 1].min(), edges[start:end, 0].max(), edges[start:end, 1].max())
+                       for start, end in zip(offsets, offsets[1:])], dtype=np.float64).reshape(-1, 4)
+    return np.array(codes, dtype=str), offsets, edges, bboxes
+
+def contains(edges, lons, lats):
+    """ Whether each point is inside the polygon(s) of the edges, by the even-odd rule """
+    inside = np.zeros(len(lons), dtype=bool)
+    x1, y1, x2, y2 = (edges[:, i] for i in range(4))
+    step = max(1, BATCH_SIZE // max(1, len(edges)))
+    for start in range(0, len(lons), step):
+        px, py = lons[start:start + step, None], lats[start:start + step, None]
+        straddles = (y1 > py) != (y2 > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_x = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        crossings = np.count_nonzero(straddles & (px < crossing_x), axis=1)
+        inside[start:start + step] = crossings % 2 == 1
+    return inside
+
+class CommuneIndex:
+    """ Boundaries of the communes, by INSEE code """
+    def __init__(self, codes, offsets, edges, bboxes):
+        self.codes = codes.tolist()
+        self.offsets = offsets
+        self.edges = edges
+        self.bboxes = bboxes
+        self.positions = {code: i for i, code in enumerate(self.codes)}
+        # Communes whose bounding box overlaps each grid cell
+        self.grid = {}
+        for i, (min_lon, min_lat, max_lon, max_lat) in enumerate(bboxes.tolist()):
+            for cx in range(math.floor(min_lon / CELL_SIZE), math.floor(max_lon / CELL_SIZE) + 1):
+                for cy in range(math.floor(min_lat / CELL_SIZE), math.floor(max_lat / CELL_SIZE) + 1):
+                    self.grid.setdefault((cx, cy), []).append(i)
+
+    def position(self, code):
+        """ Position of the commune of an INSEE code (or of an arrondissement), None if unknown """
+        code = code.strip()
+        if code.isdigit():
+            code = code.zfill(5)
+        position = self.positions.get(code)
+        if position is None and code in COMMUNE_OF_ARRONDISSEMENT:
+            position = self.positions.get(COMMUNE_OF_ARRONDISSEMENT[code])
+        return position
+
+    def contains(self, position, lons, lats):
+        lons, lats = np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64)
+        min_lon, min_lat, max_lon, max_lat = self.bboxes[position]
+        in_bbox = (lons >= min_lon) & (lons <= max_lon) & (lats >= min_lat) & (lats <= max_lat)
+        inside = np.zeros(len(lons), dtype=bool)
+        if in_bbox.any():
+            edges = self.edges[self.offsets[position]:self.offsets[position + 1]]
+            inside[in_bbox] = contains(edges, lons[in_bbox], lats[in_bbox])
+        return inside
+
+    def commune_at(self, lon, lat):
+        """ INSEE code of the commune containing a point, None if none does """
+        if not (math.isfinite(lon) and math.isfinite(lat)):
+            return None
+        for position in self.grid.get((math.floor(lon / CELL_SIZE), math.floor(lat / CELL_SIZE)), ()):
+            if self.contains(position, [lon], [lat])[0]:
+                return self.codes[position]
+        return None
+
+def load(file_name, cache_dir=CACHE_DIR):
+    """ CommuneIndex of a GeoJSON file, read from the cache when it was already parsed """
+    cache_file = os.path.join(cache_dir, "%s-v%d.npz" % (content_hash(file_name), INDEX_VERSION))
+    if os.path.isfile(cache_file):
+        with np.load(cache_file) as arrays:
+            return CommuneIndex(arrays['codes'], arrays['offsets'], arrays['edges'], arrays['bboxes'])
+    codes, offsets, edges, bboxes = _read_geojson(file_name)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = cache_file + ".%d.tmp.npz" % os.getpid()
+    np.savez(tmp_file, codes=codes, offsets=offsets, edges=edges, bboxes=bboxes)
+    os.replace(tmp_file, cache_file)
+    return CommuneIndex(codes, offsets, edges, bboxes)
+
+def check_stations(station_list, index):
+    """ Logs the stations of station_list lying outside their commune. Returns their count """
+    # Stations of every known commune, so that each commune is tested once for all its stations
+    by_commune = {}
+    for station_id, station in station_list.items():
+        position = index.position(station['attributes']['code_insee_commune'] or "")
+        if position is not None:
+            by_commune.setdefault(position, []).append(station_id)
+
+    # Whether the swapped coordinates of the stations outside their commune are within it
+    outside = {}
+    for position, station_ids in by_commune.items():
+        lons = [station_list[station_id]['attributes']['Xlongitude'] for station_id in station_ids]
+        lats = [station_list[station_id]['attributes']['Ylatitude'] for station_id in station_ids]
+        inside = index.contains(position, lons, lats)
+        swapped = index.contains(position, lats, lons)
+        for station_id, is_inside, is_swapped in zip(station_ids, inside.tolist(), swapped.tolist()):
+            if not is_inside:
+                outside[station_id] = is_swapped
+
+    # Logged in station order
+    for station_id, station in station_list.items():
+        if station_id not in outside:
+            continue
+        attributes = station['attributes']
+        if outside[station_id]:
+            log.warning(station_id=station_id,
+                        source=attributes['source_grouped'],
+                        msg=MSG_SWAPPED_COORD,
+                        detail="Xlongitude: {}, Ylatitude: {}, code_insee_commune: {}".format(
+                            attributes['Xlongitude'], attributes['Ylatitude'], attributes['code_insee_commune']))
+        else:
+            commune = index.commune_at(attributes['Xlongitude'], attributes['Ylatitude'])
+            log.warning(station_id=station_id,
+                        source=attributes['source_grouped'],
+                        msg=MSG_OUTSIDE_COMMUNE,
+                        detail="code_insee_commune: {}, coordonnées dans la commune: {}".format(
+                            attributes['code_insee_commune'], commune or "aucune"))
+    return len(outside)
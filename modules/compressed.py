@@ -0,0 +1,61 @@
+"""
+Transparent reading of compressed inputs.
+
+Daily snapshots of the IRVE file are archived compressed: open_input() recognises
+gzip, bzip2, xz and zstandard files by their magic number and decompresses them
+while they are read, so that they never need to be inflated to disk. Zstandard
+needs the `zstandard` package (or Python 3.14's compression.zstd).
+"""
+import bz2
+import gzip
+import io
+import lzma
+
+# Large reads: the csv module and pandas ask for small chunks
+BUFFER_SIZE = 1 << 20
+
+MAGIC_NUMBERS = {
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\xfd7zXZ\x00": "xz",
+    b"\x28\xb5\x2f\xfd": "zstd",
+}
+
+def _zstd_file(file_name):
+    try:
+        from compression import zstd
+        return zstd.ZstdFile(file_name)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError as e:
+        e.add_note("reading a zstandard compressed input needs: `python3 -m pip install zstandard`")
+        raise e
+    # The file is closed with the reader. Archives made of several frames (pzstd) are read to their end
+    return zstandard.ZstdDecompressor().stream_reader(open(file_name, 'rb'), read_size=BUFFER_SIZE,
+                                                      read_across_frames=True, closefd=True)
+
+def compression_of(file_name):
+    """ Compression format of a file, from its first bytes (None when not compressed) """
+    with open(file_name, 'rb') as f:
+        head = f.read(max(map(len, MAGIC_NUMBERS)))
+    for magic, compression in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+def open_input(file_name):
+    """ Opens a text file for reading, decompressing it on the fly if it is compressed """
+    compression = compression_of(file_name)
+    if compression is None:
+        return open(file_name, buffering=BUFFER_SIZE)
+    if compression == "gzip":
+        stream = gzip.GzipFile(file_name)
+    elif compression == "bz2":
+        stream = bz2.BZ2File(file_name)
+    elif compression == "xz":
+        stream = lzma.LZMAFile(file_name)
+    else:
+        stream = _zstd_file(file_name)
+    return io.TextIOWrapper(io.BufferedReader(stream, buffer_size=BUFFER_SIZE))
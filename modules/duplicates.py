@@ -0,0 +1,89 @@
+"""
+Detection of the stations listed twice under different ids.
+
+Identical ids are merged by the grouping, but the same physical station is also
+published with two different ids (by two organisations, or twice by the same one).
+Stations are bucketed in a grid of cells the size of the search distance, so that
+the stations close to a given one are only looked for in its cell and the 8 around
+it, instead of comparing every pair of stations. Nearby stations are likely duplicates
+when they share their operator, have a similar name or address and share a socket type.
+"""
+import math
+import re
+from difflib import SequenceMatcher
+
+from . import import_logger as log
+
+# Default search distance, in meters
+DISTANCE = 30
+EARTH_RADIUS = 6371008.8
+# Name and address similarity, from 0 (nothing in common) to 1 (same text)
+MIN_SIMILARITY = 0.8
+SOCKET_COUNTS = ['nb_EF_grouped', 'nb_T2_grouped', 'nb_combo_ccs_grouped', 'nb_chademo_grouped', 'nb_autre_grouped']
+
+MSG_NEAR_DUPLICATE = "station probablement en double : une station proche du même opérateur a un autre identifiant"
+
+def _normalize(text):
+    return " ".join((text or "").casefold().split())
+
+def distance(lon1, lat1, lon2, lat2):
+    """ Great-circle distance in meters """
+    lon1, lat1, lon2, lat2 = map(math.radians, (lon1, lat1, lon2, lat2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1, math.sqrt(a)))
+
+def similar(text1, text2):
+    """ Whether two normalized texts are alike. Numbers must be the same: "borne 1" and "borne 2" are two stations """
+    if not text1 or not text2 or re.findall(r"\d+", text1) != re.findall(r"\d+", text2):
+        return False
+    return text1 == text2 or SequenceMatcher(None, text1, text2).ratio() >= MIN_SIMILARITY
+
+def _features(attributes):
+    """ What two nearby stations must share to be duplicates """
+    return (_normalize(attributes['nom_operateur']), _normalize(attributes['nom_station']), _normalize(attributes['adresse_station']),
+            {name for name in SOCKET_COUNTS if attributes.get(name)})
+
+def is_duplicate(features, other_features):
+    operator, name, address, sockets = features
+    other_operator, other_name, other_address, other_sockets = other_features
+    return operator == other_operator and bool(sockets & other_sockets) \
+        and (similar(name, other_name) or similar(address, other_address))
+
+def find_duplicates(station_list, max_distance=DISTANCE):
+    """ Yields (station_id, duplicated station_id, distance in meters) for the likely duplicates of station_list,
+        every station being paired with the stations before it in station_list
+    """
+    # (station_id, lon, lat) of the stations of every cell of an equirectangular projection in meters
+    grid = {}
+    features = {}
+    def features_of(station_id):
+        if station_id not in features:
+            features[station_id] = _features(station_list[station_id]['attributes'])
+        return features[station_id]
+
+    scale = EARTH_RADIUS / max_distance
+    for station_id, station in station_list.items():
+        lon, lat = station['attributes']['Xlongitude'], station['attributes']['Ylatitude']
+        # "nan" and "inf" are valid coordinates for validate_coord, but have no place in the grid
+        if not (math.isfinite(lon) and math.isfinite(lat)):
+            continue
+        cx = math.floor(math.radians(lon) * math.cos(math.radians(lat)) * scale)
+        cy = math.floor(math.radians(lat) * scale)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for other_id, other_lon, other_lat in grid.get((cx + dx, cy + dy), ()):
+                    meters = distance(other_lon, other_lat, lon, lat)
+                    if meters <= max_distance and is_duplicate(features_of(station_id), features_of(other_id)):
+                        yield station_id, other_id, meters
+        grid.setdefault((cx, cy), []).append((station_id, lon, lat))
+
+def report_duplicates(station_list, max_distance=DISTANCE):
+    """ Logs the likely duplicates of station_list. Returns their count """
+    count = 0
+    for station_id, other_id, meters in find_duplicates(station_list, max_distance):
+        log.warning(station_id=station_id,
+                    source=station_list[station_id]['attributes']['source_grouped'],
+                    msg=MSG_NEAR_DUPLICATE,
+                    detail="%s à %.0f m" % (other_id, meters))
+        count += 1
+    return count
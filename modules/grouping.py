@@ -0,0 +1,340 @@
+import csv
+
+from typing import Callable, NamedTuple
+from . import import_logger as log
+from .compressed import open_input
+from .normalize import cleanPhoneNumber, transformRef, fix_name
+from .power import Socket, PowerAggregate, compute_max_power_per_station, power_issue_logs
+
+station_attributes = [ 'nom_amenageur', 'siren_amenageur', 'contact_amenageur', 'nom_operateur', 'contact_operateur', 'telephone_operateur', 'nom_enseigne', 'id_station_itinerance', 'id_station_local', 'nom_station', 'implantation_station', 'code_insee_commune', 'nbre_pdc', 'station_deux_roues', 'raccordement', 'num_pdl', 'date_mise_en_service', 'observations', 'adresse_station' ]
+pdc_attributes = [ 'id_pdc_itinerance', 'id_pdc_local', 'puissance_nominale', 'prise_type_ef', 'prise_type_2', 'prise_type_combo_ccs', 'prise_type_chademo', 'prise_type_autre', 'gratuit', 'paiement_acte', 'paiement_cb', 'paiement_autre', 'tarification', 'condition_acces', 'reservation', 'accessibilite_pmr', 'restriction_gabarit', 'observations', 'date_maj', 'cable_t2_attache', 'datagouv_organization_or_owner', 'horaires' ]
+socket_attributes = { 'prise_type_ef': Socket.EF, 'prise_type_2': Socket.T2, 'prise_type_chademo': Socket.CHADEMO, 'prise_type_combo_ccs': Socket.CCS }
+
+wrong_ortho = {}
+
+# Log messages, shared by every grouping engine so their outputs stay identical
+MSG_NO_ID = "pas d'identifiant ref:EU:EVSE (id_station_itinerance). Ce point de charge est ignoré et sa station ne sera pas présente dans l'analyse Osmose"
+MSG_INVALID_COORD = "coordonnées non valides. Ce point de charge est ignoré et sa station ne sera pas présente dans l'analyse Osmose"
+MSG_INVALID_ID = "le format de l'identifiant ref:EU:EVSE (id_station_itinerance) n'est pas valide. Ce point de charge est ignoré et sa station ne sera pas présente dans l'analyse Osmose"
+MSG_INVALID_PHONE = "le numéro de téléphone de l'opérateur (telephone_operateur) est dans un format invalide"
+MSG_INVALID_DEUX_ROUES = "le champ station_deux_roues n'est pas valide"
+MSG_MULTIPLE_SOURCES = "plusieurs sources pour un même id"
+MSG_NBRE_PDC = "le nombre de point de charge de la station n'est pas cohérent avec la liste des points de charge fournie"
+MSG_NO_SOCKET = "aucun type de prise précisé sur l'ensemble des points de charge"
+
+def strip(value):
+    return value.strip()
+
+def format_values(values):
+    """ Detail of a set of distinct values, sorted so that it does not depend on the hash seed """
+    return "{%s}" % ", ".join(sorted(map(repr, values)))
+
+def strip_lower(value):
+    return value.strip().lower()
+
+class GroupedAttribute(NamedTuple):
+    """ A PDC attribute expected to be the same on every PDC of a station """
+    column: str
+    normalize: Callable[[str], str]
+    name: str
+    msg: str
+
+# Adding a consistency check between the PDCs of a station is adding an entry here
+grouped_attributes = [
+    GroupedAttribute('horaires', strip, 'horaires_grouped', "plusieurs horaires pour une même station"),
+    GroupedAttribute('gratuit', strip_lower, 'gratuit_grouped', "plusieurs infos de gratuité (gratuit) pour une même station"),
+    GroupedAttribute('paiement_acte', strip_lower, 'paiement_acte_grouped', "plusieurs infos de paiement (paiement_acte) pour une même station"),
+    GroupedAttribute('paiement_cb', strip_lower, 'paiement_cb_grouped', "plusieurs infos de paiement (paiement_cb) pour une même station"),
+    GroupedAttribute('reservation', strip_lower, 'reservation_grouped', "plusieurs infos de réservation pour une même station"),
+    GroupedAttribute('accessibilite_pmr', strip, 'accessibilite_pmr_grouped', "plusieurs infos d'accessibilité PMR (accessibilite_pmr) pour une même station"),
+]
+
+# Socket columns counted per station: (column, grouped attribute, flag in the PDC socket mask)
+socket_counts = [
+    ('prise_type_ef', 'nb_EF_grouped', Socket.EF),
+    ('prise_type_2', 'nb_T2_grouped', Socket.T2),
+    ('prise_type_combo_ccs', 'nb_combo_ccs_grouped', Socket.CCS),
+    ('prise_type_chademo', 'nb_chademo_grouped', Socket.CHADEMO),
+    ('prise_type_autre', 'nb_autre_grouped', Socket(0)),
+]
+socket_count_flags = [(column, flag.value) for column, _, flag in socket_counts]
+
+# Grouped attributes of the max power per socket type, in power.POWER_SOCKETS order
+power_attributes = ['power_ef_grouped', 'power_t2_grouped', 'power_chademo_grouped', 'power_ccs_grouped']
+
+# Attributes of a finalized station, in the order they are filled
+station_fieldnames = station_attributes + ['Xlongitude', 'Ylatitude', 'source_grouped'] + [rule.name for rule in grouped_attributes] \
+    + ['nb_prises_grouped'] + [name for _, name, _ in socket_counts] + power_attributes
+
+def load_wrong_ortho(filename='fixes_networks.csv'):
+    with open(filename, 'r') as csv_file:
+        csv_reader = csv.DictReader(csv_file, delimiter=',')
+        for row in csv_reader:
+            wrong_ortho[row["opendata_name"]] = row["better_name"]
+
+def validate_coord(lat_or_lon_text):
+    try:
+        float(lat_or_lon_text)
+    except ValueError:
+        return False
+    return True
+
+def is_correct_id(station_id):
+    if station_id is None:
+        return False
+
+    station_id_parts = station_id.split('*')
+    station_id = "".join(station_id_parts)
+    station_id_parts = station_id.split(' ')
+    station_id = "".join(station_id_parts)
+
+    if not station_id.startswith('P', 5):
+        return False
+    return True
+
+def stringBoolToInt(strbool):
+    return 1 if strbool.lower() == 'true' else 0
+
+def get_socket_mask(pdc):
+    return sum([ flag.value for socket_attr, flag in socket_attributes.items() if stringBoolToInt(pdc[socket_attr])==1 ])
+
+def compute_max_power_per_socket_type(station, raw_station_id):
+    """
+    Computes the aggregated max power per socket type accross all PDCs (PDLs) associated with the given station.
+    Only consider the most powerful socket per PDC.
+    """
+    pdc_list = station['pdc_list']
+    socket_masks = [get_socket_mask(pdc) for pdc in pdc_list]
+    values, issues = compute_max_power_per_station([0] * len(pdc_list), 1, [float(pdc['puissance_nominale']) for pdc in pdc_list], socket_masks)
+    for p, suspicious, err_socket in issues:
+        pdc = pdc_list[p]
+        for log_function, record in power_issue_logs(raw_station_id, pdc["id_pdc_itinerance"], station['attributes']['source_grouped'],
+                                                     pdc['puissance_nominale'], socket_masks[p], suspicious, err_socket):
+            log_function(**record)
+    return values[0]
+
+class StationAggregate:
+    """
+    Compact running aggregates of the PDCs of a station, updated as rows arrive.
+    Nothing is kept per PDC, so memory scales with the number of stations.
+    Each PDC is walked once, filling the distinct values of every grouped_attributes
+    entry and the counters of every socket_counts entry.
+    """
+    __slots__ = ('attributes', 'nb_pdc', 'sources', 'values', 'socket_counts', 'power')
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+        self.nb_pdc = 0
+        self.sources = set()
+        self.values = [set() for _ in grouped_attributes]
+        self.socket_counts = [0] * len(socket_counts)
+        self.power = PowerAggregate()
+
+    def add(self, pdc):
+        self.nb_pdc += 1
+        self.sources.add(pdc['datagouv_organization_or_owner'])
+        for values, rule in zip(self.values, grouped_attributes):
+            values.add(rule.normalize(pdc[rule.column]))
+
+        socket_mask = 0
+        for i, (column, flag) in enumerate(socket_count_flags):
+            if stringBoolToInt(pdc[column]) == 1:
+                self.socket_counts[i] += 1
+                socket_mask |= flag
+
+        self.power.add(pdc["id_pdc_itinerance"], pdc['puissance_nominale'], socket_mask)
+
+    def finalize(self, station_id):
+        """
+        Fills the `*_grouped` attributes and logs inconsistencies between the PDCs of the station.
+        Returns the max power per socket type.
+        """
+        attributes = self.attributes
+        if len(self.sources) !=1 :
+            log.error(station_id=station_id,
+                      source="multiples",
+                      msg=MSG_MULTIPLE_SOURCES,
+                      detail=format_values(self.sources))
+        attributes['source_grouped'] = min(self.sources, key=str)
+
+        for values, rule in zip(self.values, grouped_attributes):
+            if len(values) !=1 :
+                attributes[rule.name] = None
+                log.warning(station_id=station_id,
+                            source=attributes['source_grouped'],
+                            msg=rule.msg,
+                            detail=format_values(values))
+            else :
+                attributes[rule.name] = next(iter(values))
+
+        if self.nb_pdc != int(attributes['nbre_pdc']):
+            log.error(station_id=station_id,
+                source=attributes['source_grouped'],
+                msg=MSG_NBRE_PDC,
+                detail="{} points de charge indiqués pour la station (nbre_pdc) mais {} points de charge listés".format(attributes['nbre_pdc'], self.nb_pdc))
+            attributes['nbre_pdc'] = min(self.nb_pdc, int(attributes['nbre_pdc']))
+
+        attributes['nb_prises_grouped'] = self.nb_pdc
+        for (_, name, _), count in zip(socket_counts, self.socket_counts):
+            attributes[name] = count
+
+        if sum(self.socket_counts) == 0:
+            log.error(station_id=station_id,
+                    source=attributes['source_grouped'],
+                    msg=MSG_NO_SOCKET,
+                    detail="nb pdc: %s" % (self.nb_pdc))
+
+        self.power.report(station_id, attributes['source_grouped'])
+        power_grouped_values = self.power.values()
+        attributes.update(zip(power_attributes, power_grouped_values))
+        return power_grouped_values
+
+def add_row(station_list, row):
+    """
+    Validates one PDC row and adds it to the aggregates of its station.
+    """
+    if not row['id_station_itinerance']:
+        log.blocking(station_id=None,
+            source=row['datagouv_organization_or_owner'],
+            msg=MSG_NO_ID,
+            detail=None)
+        return
+    if row['id_station_itinerance']=="Non concerné":
+        # Station non concernée par l'identifiant ref:EU:EVSE (id_station_itinerance). Ce point de charge est ignoré et sa station ne sera pas présente dans l'analyse Osmose
+        return
+
+    station_id = row['id_station_itinerance'] # usefull to join logs with source data
+    cleanRef = transformRef(station_id, row['id_station_local'])
+
+    # Overkill given that this data should have passed through this code:
+    # https://github.com/datagouv/datagouvfr_data_pipelines/blob/75db0b1db3fd79407a1526b0950133114fefaa0f/schema/utils/geo.py#L33
+    if not validate_coord(row["consolidated_longitude"]) or not validate_coord(row["consolidated_latitude"]):
+        log.blocking(station_id= station_id,
+            source=row['datagouv_organization_or_owner'],
+            msg=MSG_INVALID_COORD,
+            detail="consolidated_longitude: {}, consolidated_latitude: {}".format(row['consolidated_longitude'], row["consolidated_latitude"]))
+        return
+
+    if not is_correct_id(cleanRef):
+        log.blocking(station_id=station_id,
+            source=row['datagouv_organization_or_owner'],
+            msg=MSG_INVALID_ID,
+            detail="iti: %s, local: %s" % (row['id_station_itinerance'], row['id_station_local']))
+        return
+
+    if not station_id in station_list:
+        station_prop = {key: fix_name(row[key], wrong_ortho) for key in station_attributes}
+
+        station_prop['Xlongitude'] = float(row['consolidated_longitude'])
+        station_prop['Ylatitude'] = float(row['consolidated_latitude'])
+        phone = cleanPhoneNumber(row['telephone_operateur'])
+        station_list[station_id] = StationAggregate(station_prop)
+        station_prop['id_station_itinerance'] = cleanRef
+
+        # Non-blocking issues
+        if phone is None and row['telephone_operateur']!= "":
+            station_prop['telephone_operateur'] = None
+            log.warning(station_id=station_id,
+                source=row['datagouv_organization_or_owner'],
+                msg=MSG_INVALID_PHONE,
+                detail=row['telephone_operateur'])
+        elif phone is not None:
+            station_prop['telephone_operateur'] = phone
+        else:
+            station_prop['telephone_operateur'] = None
+
+        if row['station_deux_roues'].lower() not in ['true', 'false', '']:
+            station_prop['station_deux_roues'] = None
+            log.warning(station_id=station_id,
+                source=row['datagouv_organization_or_owner'],
+                msg=MSG_INVALID_DEUX_ROUES,
+                detail=row['station_deux_roues'])
+        else:
+            station_prop['station_deux_roues'] = row['station_deux_roues'].lower()
+
+    station_list[station_id].add(row)
+
+def group_rows(rows, station_list):
+    for row in rows:
+        add_row(station_list, row)
+    return station_list
+
+def finalize_stations(station_list):
+    """
+    Turns every StationAggregate of station_list into its final `{'attributes': ...}` form.
+    Returns the max power per socket type of every station.
+    """
+    power_stats = []
+    for station_id, station in station_list.items():
+        power_stats.append(station.finalize(station_id))
+        station_list[station_id] = {'attributes': station.attributes}
+    return power_stats
+
+def read_indexed_rows(input_file, keep, input_stats=None):
+    """ Yields (row index, row) for every row whose id_station_itinerance satisfies keep().
+    Rows are only turned into dicts once they are known to be kept.
+    The kept rows are counted in input_stats, if given.
+    """
+    with open_input(input_file) as csvfile:
+        reader = csv.reader(csvfile, delimiter=',')
+        header = next(reader)
+        id_column = header.index('id_station_itinerance')
+        pdc_id_column = header.index('id_pdc_itinerance')
+        for index, values in enumerate(reader):
+            if not values:
+                continue
+            station_id = values[id_column] if id_column < len(values) else ''
+            if not keep(station_id):
+                continue
+            if input_stats is not None:
+                input_stats.add(station_id, values[pdc_id_column] if pdc_id_column < len(values) else '')
+            row = dict(zip(header, values))
+            if len(values) < len(header):
+                row.update(dict.fromkeys(header[len(values):]))
+            yield index, row
+
+def group_indexed_rows(indexed_rows):
+    """
+    Same as group_rows followed by finalize_stations, for (row index, row) pairs,
+    but logs are returned instead of being logged.
+    Returns the stations as (first row index, station_id, attributes, power) and the
+    logs as (sort key, record). Sorting both gives the single pass output order:
+    row checks are keyed by their row, station checks by the first row of their station.
+    """
+    logs = []
+    with log.capture() as records:
+        def collect(key):
+            for i, record in enumerate(records):
+                logs.append(((*key, i), record))
+            records.clear()
+
+        station_list = {}
+        first_rows = {}
+        for index, row in indexed_rows:
+            station_count = len(station_list)
+            add_row(station_list, row)
+            if len(station_list) != station_count:
+                first_rows[row['id_station_itinerance']] = index
+            if records:
+                collect((0, index))
+
+        stations = []
+        for station_id, station in station_list.items():
+            power = station.finalize(station_id)
+            collect((1, first_rows[station_id]))
+            stations.append((first_rows[station_id], station_id, station.attributes, power))
+    return stations, logs
+
+def merge_grouped(stations, logs, station_list):
+    """
+    Logs and adds to station_list the output of one or several group_indexed_rows calls,
+    in input order. Returns the max power per socket type of every station.
+    """
+    for _, record in sorted(logs, key=lambda item: item[0]):
+        log._log(**record)
+
+    power_stats = []
+    for _, station_id, attributes, power in sorted(stations, key=lambda station: station[0]):
+        station_list[station_id] = {'attributes': attributes}
+        power_stats.append(power)
+    return power_stats
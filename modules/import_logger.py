@@ -1,7 +1,74 @@
+"""
+Sink of the issues found while importing the data.
+
+Inside streaming(), records are written to the errors CSV file as soon as they are
+logged and only online counters (stats) are kept in memory. Otherwise records are
+kept in _import_logged_data. Repeated level, source and message strings are interned.
+"""
+import csv
+import sys
+from collections import Counter
+from contextlib import contextmanager
+
+FIELDNAMES = ['level', 'station_id', 'source', 'msg', 'detail', 'pdc_id']
+
+class LogStats:
+    """ Online counters of the logged records, by level, message and source """
+    def __init__(self):
+        self.count = 0
+        self.by_level = Counter()
+        self.by_level_msg = Counter()
+        self.by_source_level = Counter()
+        self.by_source_level_msg = Counter()
+
+    def add(self, level, source, msg):
+        self.count += 1
+        self.by_level[level] += 1
+        self.by_level_msg[(level, msg)] += 1
+        self.by_source_level[(source, level)] += 1
+        self.by_source_level_msg[(source, level, msg)] += 1
+
 _import_logged_data = []
+stats = LogStats()
+_writer = None
+_captured = None
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
 
 def _log(**record):
-    _import_logged_data.append(record)
+    if _captured is not None:
+        _captured.append(record)
+        return
+    for key in ('level', 'source', 'msg'):
+        record[key] = _intern(record[key])
+    stats.add(record['level'], record['source'], record['msg'])
+    if _writer is not None:
+        _writer.writerow(record)
+    else:
+        _import_logged_data.append(record)
+
+@contextmanager
+def streaming(file_name):
+    """ Writes the records logged in the block to file_name instead of keeping them """
+    global _writer
+    with open(file_name, 'w') as ofile:
+        _writer = csv.DictWriter(ofile, fieldnames=FIELDNAMES)
+        _writer.writeheader()
+        try:
+            yield
+        finally:
+            _writer = None
+
+@contextmanager
+def capture():
+    """ Records logged in the block are only appended to the yielded list: neither written nor counted """
+    global _captured
+    saved, _captured = _captured, []
+    try:
+        yield _captured
+    finally:
+        _captured = saved
 
 def warning(station_id, source, msg, detail, pdc_id=None):
     _log(level="warning", **locals())
@@ -10,4 +77,4 @@ def error(station_id, source, msg, detail, pdc_id=None):
     _log(level="error", **locals())
 
 def blocking(station_id, source, msg, detail, pdc_id=None):
-    _log(level="blocking", **locals())
\ No newline at end of file
+    _log(level="blocking", **locals())
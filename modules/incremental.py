@@ -0,0 +1,128 @@
+"""
+Incremental version of the row engine of modules.grouping.
+
+A first cheap pass over the input computes a fingerprint of the rows of every station.
+Stations whose fingerprint did not change since the previous run reuse the attributes,
+power and logs stored in the state file. Only new or modified stations are validated
+and grouped again. Outputs are the same as with a full run.
+"""
+import csv
+import hashlib
+import itertools
+import os
+import pickle
+from array import array
+
+from . import grouping
+from .compressed import open_input
+
+STATE_FILE = "output/grouping_state.pickle"
+# Bump whenever a change to the grouping would alter the outputs of unchanged rows
+STATE_VERSION = 3
+
+def fingerprint_stations(input_file, input_stats=None):
+    """
+    Hashes the columns used by the grouping, for every row of every station.
+    Returns the fingerprint of every station, the indexes of its rows, and the
+    (row index, row) of the rows without station id, which are always checked again.
+    Every row is counted in input_stats, if given.
+    """
+    used_columns = list(dict.fromkeys(grouping.station_attributes + grouping.pdc_attributes + ['consolidated_longitude', 'consolidated_latitude']))
+    hashes = {}
+    station_rows = {}
+    rows_without_id = []
+    with open_input(input_file) as csvfile:
+        reader = csv.reader(csvfile, delimiter=',')
+        header = next(reader)
+        columns = [header.index(column) for column in used_columns]
+        id_column = header.index('id_station_itinerance')
+        pdc_id_column = header.index('id_pdc_itinerance')
+        for index, values in enumerate(reader):
+            if not values:
+                continue
+            if len(values) < len(header):
+                values += [''] * (len(header) - len(values))
+            station_id = values[id_column]
+            if input_stats is not None:
+                input_stats.add(station_id, values[pdc_id_column])
+            if station_id == '':
+                rows_without_id.append((index, dict(zip(header, values))))
+                continue
+            if station_id == "Non concerné":
+                continue
+            if station_id not in hashes:
+                hashes[station_id] = hashlib.blake2b(digest_size=16)
+                station_rows[station_id] = array('q')
+            hashes[station_id].update("\x1f".join([values[c] for c in columns]).encode() + b"\x1e")
+            station_rows[station_id].append(index)
+    return {station_id: h.digest() for station_id, h in hashes.items()}, station_rows, rows_without_id
+
+def _state_key():
+    """ The state is only valid for the same code and the same network name fixes """
+    return (STATE_VERSION, hashlib.blake2b(repr(sorted(grouping.wrong_ortho.items())).encode()).hexdigest())
+
+def load_state(state_file):
+    try:
+        with open(state_file, 'rb') as f:
+            state = pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    if state.get('key') != _state_key():
+        print("WARNING! Incremental state is outdated, every station will be grouped again")
+        return {}
+    return state['stations']
+
+def save_state(state_file, stations):
+    tmp_file = state_file + ".tmp"
+    with open(tmp_file, 'wb') as f:
+        pickle.dump({'key': _state_key(), 'stations': stations}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, state_file)
+
+def group_csv(input_file, station_list, state_file=STATE_FILE, input_stats=None):
+    """
+    Incremental equivalent of grouping.group_rows followed by grouping.finalize_stations.
+    Fills station_list with `{'attributes': ...}` entries, logs every issue and
+    returns the max power per socket type of every station.
+    Every row of the input is counted in input_stats, if given.
+    """
+    fingerprints, station_rows, rows_without_id = fingerprint_stations(input_file, input_stats)
+    previous = load_state(state_file)
+    changed = {station_id for station_id, fingerprint in fingerprints.items()
+               if station_id not in previous or previous[station_id]['fingerprint'] != fingerprint}
+
+    rows = rows_without_id
+    if changed:
+        rows = itertools.chain(rows, grouping.read_indexed_rows(input_file, lambda station_id: station_id in changed))
+    stations, logs = grouping.group_indexed_rows(rows)
+
+    # Store the results of the grouped stations relatively to their own rows
+    row_owner = {}
+    for station_id in changed:
+        for position, index in enumerate(station_rows[station_id]):
+            row_owner[index] = (station_id, position)
+    state = {station_id: {'fingerprint': fingerprints[station_id], 'first': None, 'attributes': None, 'power': None, 'logs': []}
+             for station_id in changed}
+    for first_row, station_id, attributes, power in stations:
+        state[station_id].update(first=row_owner[first_row][1], attributes=attributes, power=power)
+    for key, record in logs:
+        if key[1] not in row_owner:
+            continue
+        station_id, position = row_owner[key[1]]
+        relative_key = (0, position, key[2]) if key[0] == 0 else (1, key[2])
+        state[station_id]['logs'].append((relative_key, record))
+
+    # ... and put the unchanged ones back at their current position
+    for station_id in fingerprints.keys() - changed:
+        state[station_id] = cached = previous[station_id]
+        indexes = station_rows[station_id]
+        for relative_key, record in cached['logs']:
+            key = (0, indexes[relative_key[1]], relative_key[2]) if relative_key[0] == 0 else (1, indexes[cached['first']], relative_key[1])
+            logs.append((key, record))
+        if cached['attributes'] is not None:
+            stations.append((indexes[cached['first']], station_id, cached['attributes'], cached['power']))
+
+    removed = len(previous.keys() - fingerprints.keys())
+    print(f"Groupement incrémental : {len(changed)} station_id nouveaux ou modifiés, {len(fingerprints) - len(changed)} inchangés, {removed} supprimés")
+    if changed or removed:
+        save_state(state_file, state)
+    return grouping.merge_grouped(stations, logs, station_list)
@@ -0,0 +1,96 @@
+"""
+Statistics of the input file (line count, distinct station and PDC ids), collected
+by the grouping engines while they read the input, so that the report does not need
+to parse it again.
+
+Distinct ids are counted exactly with sets, or approximately with HyperLogLog
+sketches of fixed size for very large inputs.
+"""
+import csv
+import hashlib
+import math
+
+from .compressed import open_input
+
+class HyperLogLog:
+    """ Approximate distinct count in 2**precision bytes, with a standard error of 1.04/sqrt(2**precision) """
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+        rest_bits = 64 - self.precision
+        index = x >> rest_bits
+        rank = rest_bits - (x & ((1 << rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def __len__(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # Linear counting is more accurate for small cardinalities
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+class InputStats:
+    """ Line count and distinct station/PDC id counts of the input """
+    def __init__(self, approximate=False):
+        self.approximate = approximate
+        self.line_count = 0
+        self.station_ids = HyperLogLog() if approximate else set()
+        self.pdc_ids = HyperLogLog() if approximate else set()
+
+    def add(self, station_id, pdc_id):
+        self.line_count += 1
+        self.station_ids.add(station_id or '')
+        self.pdc_ids.add(pdc_id or '')
+
+    def add_columns(self, station_ids, pdc_ids):
+        self.line_count += len(station_ids)
+        for ids, values in ((self.station_ids, station_ids), (self.pdc_ids, pdc_ids)):
+            if self.approximate:
+                # Straight into the sketch, a set of the values would defeat its fixed size
+                for value in values:
+                    ids.add(value)
+            else:
+                ids.update(values)
+
+    def update(self, other):
+        """ Merges the stats of another part of the input """
+        self.line_count += other.line_count
+        self.station_ids.update(other.station_ids)
+        self.pdc_ids.update(other.pdc_ids)
+
+    def count_rows(self, rows):
+        """ Counts the rows (dicts) of the input while passing them through """
+        for row in rows:
+            self.add(row['id_station_itinerance'], row['id_pdc_itinerance'])
+            yield row
+
+    @property
+    def distinct_station_id_count(self):
+        return len(self.station_ids)
+
+    @property
+    def distinct_pdc_id_count(self):
+        return len(self.pdc_ids)
+
+def read_input_stats(input_file, approximate=False, snapshot=None):
+    """
+    Standalone pass over the input, when no grouping engine collected the stats.
+    Only the id columns are read from snapshot (a modules.snapshot.Snapshot of input_file), if given.
+    """
+    stats = InputStats(approximate)
+    if snapshot is not None:
+        stats.add_columns(snapshot.column('id_station_itinerance', missing=''), snapshot.column('id_pdc_itinerance', missing=''))
+        return stats
+    with open_input(input_file) as csvfile:
+        for _ in stats.count_rows(csv.DictReader(csvfile, delimiter=',')):
+            pass
+    return stats
@@ -0,0 +1,97 @@
+"""
+Suggestions of fixes for the operator and network names missing from fixes_networks.csv.
+
+The fixes are exact matches: every new spelling of a name needs its own line. Names are
+folded (case, accents, punctuation and spaces) and looked for among the folded names of
+the fixes, then among the closest ones by trigram similarity. A trigram index maps every
+trigram to the fixes containing it, so a lookup only scores the fixes sharing a trigram
+with the name instead of scanning the whole list. Lookups are memoized: the same names
+come back on thousands of stations.
+"""
+import csv
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+from .normalize import CACHE_SIZE
+
+# Attributes whose values are fixed by fixes_networks.csv and checked for new spellings
+NAME_ATTRIBUTES = ['nom_amenageur', 'nom_operateur', 'nom_enseigne']
+# Dice coefficient of the trigrams under which no fix is suggested
+MIN_CONFIDENCE = 0.6
+SUGGESTIONS_FILE = "output/opendata_name_suggestions.csv"
+
+@lru_cache(maxsize=CACHE_SIZE)
+def fold(name):
+    """ Name without case, accents, punctuation nor repeated spaces """
+    decomposed = unicodedata.normalize('NFKD', name.casefold())
+    return " ".join("".join(c if c.isalnum() else " " for c in decomposed if not unicodedata.combining(c)).split())
+
+def trigrams(folded):
+    padded = "  %s " % folded
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class NameIndex:
+    """ Trigram index of the names of fixes_networks.csv (raw and fixed), each pointing to its fixed name """
+    def __init__(self, fixes):
+        better_names = {}
+        for opendata_name, better_name in fixes.items():
+            better_names.setdefault(fold(opendata_name), better_name)
+            better_names.setdefault(fold(better_name), better_name)
+        self.better_names = better_names
+        self.folded_names = list(better_names)
+        self.trigrams = [trigrams(folded) for folded in self.folded_names]
+        self.index = {}
+        for i, name_trigrams in enumerate(self.trigrams):
+            for trigram in name_trigrams:
+                self.index.setdefault(trigram, []).append(i)
+        self._suggestions = {}
+
+    def suggest(self, name):
+        """ (fixed name, confidence from 0 to 1) closest to a name, None if no fix is close enough """
+        if name not in self._suggestions:
+            self._suggestions[name] = self._closest(fold(name))
+        return self._suggestions[name]
+
+    def _closest(self, folded):
+        if not folded:
+            return None
+        if folded in self.better_names:
+            return self.better_names[folded], 1.0
+        name_trigrams = trigrams(folded)
+        shared = Counter(i for trigram in name_trigrams for i in self.index.get(trigram, ()))
+        if not shared:
+            return None
+        confidences = {i: 2 * count / (len(name_trigrams) + len(self.trigrams[i])) for i, count in shared.items()}
+        # Ties go to the first fix of the file
+        best = max(confidences, key=lambda i: (confidences[i], -i))
+        if confidences[best] < MIN_CONFIDENCE:
+            return None
+        return self.better_names[self.folded_names[best]], confidences[best]
+
+def suggest_fixes(station_list, fixes):
+    """ (name, suggested fixed name, confidence, station count) of the names of station_list missing from the fixes,
+        by decreasing confidence and station count
+    """
+    known = set(fixes) | set(fixes.values())
+    counts = Counter()
+    for station in station_list.values():
+        attributes = station['attributes']
+        for name in {attributes[attribute] for attribute in NAME_ATTRIBUTES}:
+            if name and name not in known:
+                counts[name] += 1
+    index = NameIndex(fixes)
+    suggestions = []
+    for name, count in counts.items():
+        suggestion = index.suggest(name)
+        if suggestion is not None and suggestion[0] != name:
+            suggestions.append((name, suggestion[0], suggestion[1], count))
+    suggestions.sort(key=lambda suggestion: (-suggestion[2], -suggestion[3], suggestion[0]))
+    return suggestions
+
+def write_suggestions(suggestions, file_name=SUGGESTIONS_FILE):
+    with open(file_name, 'w') as ofile:
+        writer = csv.writer(ofile)
+        writer.writerow(["opendata_name", "better_name", "confidence", "station_count"])
+        for name, better_name, confidence, count in suggestions:
+            writer.writerow([name, better_name, "%.2f" % confidence, count])
@@ -0,0 +1,85 @@
+"""
+Normalization of raw values repeated across the input (operator phone numbers,
+station ids, network names).
+
+Matchers are compiled once, phone numbers are matched in a single pass by one
+alternation, and results are memoized in bounded LRU caches keyed on the raw values
+(the station id alone for transformRef, as it repeats on every PDC of the station).
+"""
+import re
+from functools import lru_cache
+
+CACHE_SIZE = 1 << 16
+
+# Alternatives are tried in order, as the if/elif chain they replace
+PHONE_RGX = re.compile(
+    r"^(?:"
+    r"(?P<intl>\+33\d{9})"
+    r"|(?P<intl_spaced>\+33 \d(?: \d{2}){4})"
+    r"|(?P<intl_no_plus>33\d{9})"
+    r"|(?P<national>\d{10})"
+    r"|(?P<national_no_zero>\d{9})"
+    r"|(?P<national_separated>(?:\d{2}[. -]){4}\d{2})"
+    r"|(?P<special>\d(?: \d{3}){3})"
+    r")$")
+REF_RGX = re.compile(r"^[A-Z]{2}\*[A-Za-z0-9]{3}\*P[A-Za-z0-9]+\*[A-Za-z0-9]+")
+REF_NO_SEP_RGX = re.compile(r"^[A-Z]{2}[A-Za-z0-9]{3}P[A-Za-z0-9]+")
+
+@lru_cache(maxsize=CACHE_SIZE)
+def cleanPhoneNumber(phone):
+    match = PHONE_RGX.match(phone)
+    if match is None:
+        return None
+    kind = match.lastgroup
+    if kind == "intl":
+        return phone
+    elif kind == "intl_spaced":
+        return phone.replace(" ", "")
+    elif kind == "intl_no_plus":
+        return "+"+phone
+    elif kind == "national":
+        return "+33" + phone[1:]
+    elif kind == "national_no_zero":
+        return "+33" + phone
+    elif kind == "national_separated":
+        return "+33" + phone[1:].replace(".", "").replace(" ", "").replace("-", "")
+    else:
+        return "+33" + phone[1:].replace(" ", "")
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_ref(refIti):
+    """ Parts of transformRef that only depend on the station id, repeated on every PDC of the station:
+    the id when well-formed, the id without separators, and the id with its separators added back
+    """
+    if REF_RGX.match(refIti):
+        return refIti, None, None
+    fixed = refIti[:2]+"*"+refIti[2:5]+"*P"+refIti[6:] if REF_NO_SEP_RGX.match(refIti) else None
+    return None, refIti.replace("*", ""), fixed
+
+def transformRef(refIti, refLoc):
+    ref, stripped, fixed = _parse_ref(refIti)
+    if ref is not None:
+        return ref
+    elif stripped == refLoc.replace("*", "") and REF_RGX.match(refLoc):
+        return refLoc
+    else:
+        return fixed
+
+def fix_name(value, fixes):
+    """ Applies the fixes of fixes_networks.csv to a raw attribute value.
+    A single dict lookup, so not worth caching.
+    """
+    if value == "null":
+        return ""
+    return fixes.get(value, value)
+
+def cache_stats():
+    """ Hits/misses of every normalization cache """
+    return {
+        "cleanPhoneNumber": cleanPhoneNumber.cache_info(),
+        "transformRef": _parse_ref.cache_info(),
+    }
+
+def clear_caches():
+    cleanPhoneNumber.cache_clear()
+    _parse_ref.cache_clear()
@@ -0,0 +1,163 @@
+"""
+Statistics of the charging stations of OpenStreetMap, computed in a single pass.
+
+OSM extracts of a whole country (or several) are too large to be loaded as one
+document: elements are read one at a time from the Overpass JSON ("elements" array)
+or the OSM XML, and only the counters of the statistics are kept, in total and by
+group (department of the postcode, or operator).
+"""
+import csv
+import json
+import os
+import xml.etree.ElementTree as ET
+from collections import Counter
+
+from .compressed import open_input
+
+# Characters read at once from the JSON stream
+CHUNK_SIZE = 1 << 16
+# Columns of osm_stats.csv, as published on gh-pages
+COLUMNS = ['total_number', 'total_number_motorcar', 'total_number_bicycle', 'total_with_open_data_ref',
+           'total_with_fixme', 'percentage_free', 'total_number_of_parking_spaces']
+GROUPS = ['department', 'operator']
+UNKNOWN = "inconnu"
+
+def _json_elements(stream):
+    """ Objects of the "elements" array of an Overpass JSON stream, decoded one by one """
+    decoder = json.JSONDecoder()
+    buffer, position, eof = "", 0, False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = stream.read(CHUNK_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    # Up to the opening bracket of the array
+    while True:
+        start = buffer.find('"elements"', position)
+        if start >= 0:
+            bracket = buffer.find('[', start)
+            if bracket >= 0:
+                position = bracket + 1
+                break
+            position = start
+        else:
+            position = max(position, len(buffer) - len('"elements"'))
+        if eof:
+            raise ValueError('no "elements" array in the JSON input')
+        fill()
+
+    while True:
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            fill()
+        if position >= len(buffer) or buffer[position] == ']':
+            return
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # An element cut by the end of the chunk, unless the stream is over
+            if eof:
+                raise
+            fill()
+            continue
+        position = end
+        yield element
+
+def _xml_elements(stream):
+    """ Nodes, ways and relations of an OSM XML stream, as dicts with their tags """
+    context = ET.iterparse(stream, events=("start", "end"))
+    _, root = next(context)
+    for event, item in context:
+        if event != "end" or item.tag not in ('node', 'way', 'relation'):
+            continue
+        tags = {tag.get('k'): tag.get('v') for tag in item.iter('tag')}
+        element = {'type': item.tag, 'id': item.get('id')}
+        if tags:
+            element['tags'] = tags
+        yield element
+        # Elements already counted are dropped from the tree
+        root.clear()
+
+def read_elements(file_name):
+    """ Elements of a local OSM extract (Overpass JSON or OSM XML, possibly compressed) """
+    with open_input(file_name) as stream:
+        is_xml = stream.read(256).lstrip().startswith('<')
+    with open_input(file_name) as stream:
+        yield from (_xml_elements if is_xml else _json_elements)(stream)
+
+def department(tags):
+    """ Department of the postcode of a station, UNKNOWN without a French postcode """
+    postcode = (tags.get('addr:postcode') or "").strip()
+    if len(postcode) != 5 or not postcode.isdigit():
+        return UNKNOWN
+    if postcode.startswith('20'):
+        return '2A' if postcode < '20200' else '2B'
+    if postcode.startswith('97') or postcode.startswith('98'):
+        return postcode[:3]
+    return postcode[:2]
+
+class OsmStats:
+    """ Counters of the charging stations, in total and by group """
+    def __init__(self, group_by='department'):
+        self.group_by = group_by
+        self.totals = Counter()
+        self.by_group = {}
+        # (value, type/id) of the capacities that are not numbers
+        self.invalid_capacities = []
+
+    def add(self, element):
+        tags = element.get('tags')
+        if not tags or tags.get('amenity') != "charging_station":
+            return
+        counts = Counter(total_number=1)
+        counts['total_number_motorcar'] = tags.get('motorcar') == 'yes'
+        counts['total_number_bicycle'] = tags.get('bicycle') == 'yes'
+        counts['total_with_open_data_ref'] = 'ref:EU:EVSE' in tags
+        counts['total_with_fixme'] = 'fixme' in tags or 'FIXME' in tags
+        counts['total_free'] = tags.get('fee') == 'no'
+        # One parking space when it is not given
+        capacity = 1
+        if 'capacity' in tags:
+            try:
+                capacity = int(tags['capacity'])
+            except ValueError:
+                self.invalid_capacities.append((tags['capacity'], "{}/{}".format(element.get('type'), element.get('id'))))
+        counts['total_number_of_parking_spaces'] = capacity
+
+        group = department(tags) if self.group_by == 'department' else tags.get('operator') or UNKNOWN
+        self.totals.update(counts)
+        self.by_group.setdefault(group, Counter()).update(counts)
+
+    def add_all(self, elements):
+        for element in elements:
+            self.add(element)
+        return self
+
+    @staticmethod
+    def row(counts):
+        """ Values of the COLUMNS of counters """
+        row = {column: int(counts[column]) for column in COLUMNS if column != 'percentage_free'}
+        row['percentage_free'] = counts['total_free'] * 100.0 / counts['total_number'] if counts['total_number'] else 0.0
+        return {column: row[column] for column in COLUMNS}
+
+def append_history(file_name, rows):
+    """ Appends rows (dicts) to a CSV history file, under its header if it has one """
+    rows = list(rows)
+    if not rows:
+        return
+    fieldnames = list(rows[0])
+    is_new = not os.path.isfile(file_name) or os.path.getsize(file_name) == 0
+    if not is_new:
+        with open(file_name) as f:
+            fieldnames = next(csv.reader(f))
+    with open(file_name, 'a') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, restval="", extrasaction='ignore', lineterminator="\n")
+        if is_new:
+            writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,51 @@
+"""
+Sharded version of the row engine of modules.grouping.
+
+Rows are partitioned by a hash of their station id, so that every station is fully
+grouped by a single worker process. Each worker reads the input, keeps the rows of
+its shard, validates, aggregates and finalizes its stations. The stations, power stats
+and logs of every shard are then merged back in input order, so the outputs are the
+same as with a single process (details are formatted in the workers, see
+grouping.format_values, so that they do not depend on how sets are pickled back).
+
+Every worker still reads and decompresses the whole input to keep its shard: only the
+validation and grouping are spread, so the speedup is bounded by the reading of the
+input (a CSV cannot be split at arbitrary offsets, as its fields may hold newlines).
+"""
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from . import grouping
+from .input_stats import InputStats
+
+def shard_of(station_id, jobs):
+    """ Stable across processes, unlike hash() """
+    return zlib.crc32(station_id.encode()) % jobs
+
+def group_shard(input_file, shard, jobs, wrong_ortho, input_stats):
+    """ Groups the stations of one shard, see grouping.group_indexed_rows.
+    Also returns input_stats (an empty InputStats or None) filled with the rows of the shard.
+    """
+    grouping.wrong_ortho.clear()
+    grouping.wrong_ortho.update(wrong_ortho)
+    stations, logs = grouping.group_indexed_rows(grouping.read_indexed_rows(input_file, lambda station_id: shard_of(station_id, jobs) == shard, input_stats))
+    return stations, logs, input_stats
+
+def group_csv(input_file, station_list, jobs, input_stats=None):
+    """
+    Multi-process equivalent of grouping.group_rows followed by grouping.finalize_stations.
+    Fills station_list with `{'attributes': ...}` entries, logs every issue and
+    returns the max power per socket type of every station.
+    Every row of the input is counted in input_stats, if given.
+    """
+    empty_stats = None if input_stats is None else InputStats(input_stats.approximate)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        shards = [executor.submit(group_shard, input_file, shard, jobs, grouping.wrong_ortho, empty_stats) for shard in range(jobs)]
+        results = [shard.result() for shard in shards]
+
+    stations = [station for shard_stations, _, _ in results for station in shard_stations]
+    logs = [item for _, shard_logs, _ in results for item in shard_logs]
+    if input_stats is not None:
+        for _, _, stats in results:
+            input_stats.update(stats)
+    return grouping.merge_grouped(stations, logs, station_list)
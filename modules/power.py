@@ -0,0 +1,146 @@
+"""
+Max power per socket type.
+
+There are only 16 possible socket masks, so the most powerful socket of a PDC and
+its power limit are looked up in tables precomputed for every mask. Stations can be
+processed one PDC at a time (PowerAggregate, for the streaming row engine) or all at
+once over NumPy arrays (compute_max_power_per_station).
+"""
+import math
+from enum import IntFlag, auto
+
+from . import import_logger as log
+
+class Socket(IntFlag):
+    EF = auto()
+    T2 = auto()
+    CHADEMO = auto()
+    CCS = auto()
+
+MAX_POWER_KW = {
+    Socket.EF: 4,
+    Socket.T2: 43,
+    Socket.CHADEMO: 63
+}
+
+MSG_SUSPICIOUS_POWER = "puissance nominale déclarée suspecte (possible erreur W/kW)"
+MSG_POWER_OUT_OF_SPECS = "puissance nominale déclarée pour prise {} supérieure à la norme ({})"
+
+# Order of the max power values returned for every station
+POWER_SOCKETS = [Socket.EF, Socket.T2, Socket.CHADEMO, Socket.CCS]
+
+def get_most_powerful_socket(socket_mask):
+    """ EF < T2 < CHADEMO < CCS
+    """
+    if Socket.CCS in socket_mask:
+        return Socket.CCS
+    if Socket.CHADEMO in socket_mask and Socket.CCS in ~socket_mask:
+        return Socket.CHADEMO
+    elif Socket.T2 in socket_mask and Socket.CCS | Socket.CHADEMO in ~socket_mask:
+        return Socket.T2
+    elif Socket.EF in socket_mask and Socket.CCS | Socket.CHADEMO | Socket.T2 in ~socket_mask:
+        return Socket.EF
+    return None
+
+# Socket mask -> most powerful socket, its position in POWER_SOCKETS, its power limit and the mask name
+MASK_MOST_POWERFUL_SOCKET = [get_most_powerful_socket(Socket(mask)) for mask in range(16)]
+MASK_POWER_COLUMN = [POWER_SOCKETS.index(s) if s is not None else None for s in MASK_MOST_POWERFUL_SOCKET]
+# Allow rounding errors (max +1 kw). No limits known for CCS.
+MASK_POWER_LIMIT_KW = [MAX_POWER_KW[s] + 1 if s in MAX_POWER_KW else math.inf for s in MASK_MOST_POWERFUL_SOCKET]
+MASK_NAME = [Socket(mask).name for mask in range(16)]
+
+def report_socket_power_out_of_specs(power, socket_mask):
+    """
+    This check can only be done on the most powerful socket of the PDC.
+    Allow rounding errors (max +1 kw). No limits known for CCS.
+    """
+    if power > MASK_POWER_LIMIT_KW[socket_mask]:
+        return MASK_MOST_POWERFUL_SOCKET[socket_mask]
+    return None
+
+def power_issue_logs(station_id, pdc_id, source, power_text, socket_mask, suspicious, err_socket):
+    """ The (log function, log arguments) to report for a suspicious or out of specs PDC """
+    detail = "puissance: {}, prises: {}".format(power_text, MASK_NAME[socket_mask])
+    logs = []
+    if suspicious:
+        logs.append((log.error, dict(station_id=station_id, pdc_id=pdc_id, source=source,
+            msg=MSG_SUSPICIOUS_POWER, detail=detail)))
+    if err_socket is not None:
+        logs.append((log.warning, dict(station_id=station_id, pdc_id=pdc_id, source=source,
+            msg=MSG_POWER_OUT_OF_SPECS.format(err_socket.name, MAX_POWER_KW[err_socket]), detail=detail)))
+    return logs
+
+class PowerAggregate:
+    """
+    Running max power per socket type of a station, updated one PDC at a time.
+    Only consider the most powerful socket per PDC.
+    Suspicious PDCs are kept aside to be logged once the station source is known.
+    """
+    __slots__ = ('max_power', 'issues')
+
+    def __init__(self):
+        self.max_power = [0, 0, 0, 0]
+        self.issues = []
+
+    def add(self, pdc_id, power_text, socket_mask):
+        power = float(power_text)
+        suspicious = power >= 1000
+        # Convert from W to kW (>2MW should not exist)
+        # FIXME: Probably not usefull anymore. Data looks fine.
+        if power >= 2000:
+            power /= 1000
+
+        err_socket = report_socket_power_out_of_specs(power, socket_mask)
+        if suspicious or err_socket is not None:
+            self.issues.append((pdc_id, power_text, socket_mask, suspicious, err_socket))
+
+        column = MASK_POWER_COLUMN[socket_mask]
+        if column is not None and err_socket is None and power > self.max_power[column]:
+            self.max_power[column] = power
+
+    def report(self, raw_station_id, source):
+        for pdc_id, power_text, socket_mask, suspicious, err_socket in self.issues:
+            for log_function, record in power_issue_logs(raw_station_id, pdc_id, source, power_text, socket_mask, suspicious, err_socket):
+                log_function(**record)
+
+    def values(self):
+        return tuple(self.max_power)
+
+def compute_max_power_per_station(station_index, station_count, powers, socket_masks):
+    """
+    Max power per socket type of many stations at once.
+    station_index gives the station (0 to station_count - 1) of every PDC, powers and
+    socket_masks its declared power and socket mask.
+    Returns the (EF, T2, CHADEMO, CCS) max power of every station, and the PDCs to
+    report as (PDC position, suspicious, out of specs socket or None) in station then PDC order.
+    """
+    import numpy as np
+
+    station_index = np.asarray(station_index, dtype=np.int64)
+    powers = np.asarray(powers, dtype=np.float64)
+    socket_masks = np.asarray(socket_masks, dtype=np.int64)
+    if len(station_index) == 0:
+        return [(0, 0, 0, 0)] * station_count, []
+
+    suspicious = powers >= 1000
+    # Convert from W to kW (>2MW should not exist)
+    powers = np.where(powers >= 2000, powers / 1000, powers)
+    out_of_specs = powers > np.array(MASK_POWER_LIMIT_KW)[socket_masks]
+    columns = np.array([-1 if c is None else c for c in MASK_POWER_COLUMN])[socket_masks]
+    counted = ~out_of_specs & (powers > 0)
+
+    # Segment reductions over contiguous PDCs of the same station
+    order = np.argsort(station_index, kind='stable')
+    sorted_index = station_index[order]
+    starts = np.flatnonzero(np.r_[True, sorted_index[1:] != sorted_index[:-1]])
+    max_power = np.zeros((len(POWER_SOCKETS), station_count))
+    for column in range(len(POWER_SOCKETS)):
+        selected = np.where(counted & (columns == column), powers, 0.0)[order]
+        max_power[column, sorted_index[starts]] = np.maximum.reduceat(selected, starts)
+
+    # Stations without any power for a socket keep an integer 0
+    values = [tuple(power if power > 0 else 0 for power in station) for station in zip(*max_power.tolist())]
+
+    reported = order[(suspicious | out_of_specs)[order]]
+    issues = [(p, bool(suspicious[p]), MASK_MOST_POWERFUL_SOCKET[socket_masks[p]] if out_of_specs[p] else None) for p in reported.tolist()]
+    return values, issues
@@ -0,0 +1,125 @@
+"""
+Resource usage of the stages of a run (--profile).
+
+Every stage records its wall time, CPU time, throughput and the peak resident
+memory of the process at its end. That peak is the highest one since the start of
+the process, not the one of the stage: the own peak of every stage is measured
+with tracemalloc, when enabled (--trace-memory, which slows the run down), as the
+peak of the memory allocated by Python (numpy included) since the stage started.
+One stage can also be run under cProfile, its statistics being dumped to a file
+for `python -m pstats` or snakeviz.
+"""
+import cProfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from .normalize import cache_stats
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+# Stages of group_opendata_by_station.py, in run order
+STAGES = {
+    "group": "Lecture, validation et regroupement des PDCs",
+    "aggregate": "Agrégation par station (cohérence, puissances)",
+    "duplicates": "Recherche des doublons proches",
+    "communes": "Vérification des communes",
+    "write_csv": "Écriture des stations, réseaux (et GeoJSON)",
+    "names": "Suggestions de corrections des noms",
+    "tiles": "Tuiles de la carte",
+    "diff": "Comparaison avec le run précédent",
+    "sqlite": "Export SQLite",
+    "report": "Calcul des tableaux du rapport",
+    "html": "Rendu HTML",
+}
+METRICS = ["wall_s", "cpu_s", "rows_per_s", "peak_rss_mb", "peak_traced_mb"]
+
+def peak_rss_mb():
+    """ Peak resident memory of the process so far """
+    if resource is None:
+        return None
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class StageProfile:
+    __slots__ = ('wall_s', 'cpu_s', 'rows', 'peak_rss_mb', 'peak_traced_mb')
+
+    def __init__(self):
+        self.wall_s = self.cpu_s = 0.0
+        self.rows = None
+        self.peak_rss_mb = None
+        self.peak_traced_mb = None
+
+    @property
+    def rows_per_s(self):
+        if self.rows is None or self.wall_s == 0:
+            return None
+        return self.rows / self.wall_s
+
+class Profiler:
+    """ Collects the StageProfile of every stage run within stage() """
+    def __init__(self, cprofile_stage=None, cprofile_file=None, trace_memory=False):
+        self.stages = {}
+        self.cprofile_stage = cprofile_stage
+        self.cprofile_file = cprofile_file
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        """ Profiles the block, yielding its StageProfile so that its processed row count can be set """
+        profile = self.stages[name] = StageProfile()
+        profiler = cProfile.Profile() if name == self.cprofile_stage else None
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield profile
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            profile.wall_s = time.perf_counter() - wall
+            profile.cpu_s = time.process_time() - cpu
+            profile.peak_rss_mb = peak_rss_mb()
+            if self.trace_memory:
+                profile.peak_traced_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            if profiler is not None:
+                profiler.dump_stats(self.cprofile_file)
+
+    def history_columns(self):
+        """ `<stage>_<metric>` values of every stage, empty for the stages that did not run """
+        columns = {}
+        for name in STAGES:
+            profile = self.stages.get(name)
+            for metric in METRICS:
+                value = getattr(profile, metric) if profile is not None else None
+                columns[f"{name}_{metric}"] = "" if value is None else f"{value:.3f}" if isinstance(value, float) else value
+        return columns
+
+    def markdown(self):
+        """ Tables of the stages that ran, and of the hits of the normalization caches """
+        lines = ["| Étape | Temps (s) | CPU (s) | Lignes/s | Mémoire max du process (Mo) | Pic de l'étape (Mo) |",
+                 "|---|---:|---:|---:|---:|---:|"]
+        for name, label in STAGES.items():
+            profile = self.stages.get(name)
+            if profile is None:
+                continue
+            rows_per_s = "-" if profile.rows_per_s is None else f"{profile.rows_per_s:,.0f}"
+            peak = "-" if profile.peak_rss_mb is None else f"{profile.peak_rss_mb:,.0f}"
+            traced = "-" if profile.peak_traced_mb is None else f"{profile.peak_traced_mb:,.0f}"
+            lines.append(f"| {label} | {profile.wall_s:.2f} | {profile.cpu_s:.2f} | {rows_per_s} | {peak} | {traced} |")
+
+        # Memoized normalizations, as seen by this process (not by the workers of --jobs)
+        lines += ["", "| Cache | Appels | Succès | Taux de succès | Entrées |",
+                  "|---|---:|---:|---:|---:|"]
+        for name, info in cache_stats().items():
+            calls = info.hits + info.misses
+            rate = "-" if calls == 0 else f"{info.hits / calls:.0%}"
+            lines.append(f"| {name} | {calls:,} | {info.hits:,} | {rate} | {info.currsize:,} |")
+        return "\n".join(lines)
@@ -1,10 +1,12 @@
 from collections import Counter
+import csv
 from dataclasses import dataclass, field
 import datetime as dt
+import importlib.util
 import itertools
-from markdown import markdown
+import os
 
-from . import utils
+from . import tables, utils
 
 HISTORY_FILE = "output/history.csv"
 
@@ -30,81 +32,81 @@ class Report:
         "timestamp": dt.datetime.now().astimezone().strftime("%Y-%m-%d %H:%M:%S %Z"),
     }
 
-    def __init__(self, input_file, logs, station_list, power_stats):
+    def __init__(self, input_file, log_stats, input_stats, station_list, power_stats, profile=None, changes=None):
         self.are_packages_installed = False
         self.input_file = input_file
-        self.logs = logs
+        self.log_stats = log_stats
         self.station_list = station_list
         self.power_stats = power_stats
-        self.source_distinct_station_id_count = 0
-        self.source_distinct_pdc_id_count = 0
-        self.source_line_count = 0
+        # profiling.Profiler of the run (--profile), if any
+        self.profile = profile
+        # run_diff.RunDiff with the previous run (--diff), if any
+        self.changes = changes
+        # Collected by the grouping engine while reading the input
+        self.source_distinct_station_id_count = input_stats.distinct_station_id_count
+        self.source_distinct_pdc_id_count = input_stats.distinct_pdc_id_count
+        self.source_line_count = input_stats.line_count
+        # Distinct counts estimated with HyperLogLog (--approx-distinct)
+        self.source_counts_approximate = input_stats.approximate
         self.severity_by_source = None
         self.severity_stats = None
 
     def generate_report(self):
-        try:
-            self._build()
-            self._store_history()
-            self.are_packages_installed = True
-        except ImportError:
-            self.source_distinct_station_id_count = 'N/A'
-            self.source_distinct_pdc_id_count = 'N/A'
-            print("WARNING! Some stats are disabled!")
+        self._build()
+        # Only needed, and imported, by render_html
+        self.are_packages_installed = all(importlib.util.find_spec(name) is not None for name in ("jinja2", "markdown"))
+        if not self.are_packages_installed:
+            print("WARNING! The HTML report is disabled!")
             print("==> Please install missing Python libs with: `python3 -m pip install -r requirements.txt` <==")
 
     def _build(self):
-        import pandas as pd
-        dfinput = pd.read_csv(self.input_file, memory_map=True, usecols=['id_station_itinerance', 'id_pdc_itinerance'])
-        self.source_line_count = len(dfinput)
-        self.source_distinct_station_id_count = len(set(dfinput["id_station_itinerance"]))
-        self.source_distinct_pdc_id_count = len(set(dfinput["id_pdc_itinerance"]))
-
-        dflogs = pd.DataFrame(self.logs)
-        self.severity_stats = dflogs['level'].value_counts().rename_axis(['Severité'])
-
-        gr = dflogs.groupby(["source","level"],
-                            observed=True, group_keys=False, sort=False, as_index=False
-            ).size().rename(copy=False, columns={"level":"Sévérité"})
-
-        self.severity_by_source = pd.pivot_table(gr, values="size", index=["source"], columns=["Sévérité"],
-               observed=False, aggfunc="sum", margins=True, margins_name="TOTAL", fill_value="-"
-            ).reset_index().sort_values(['TOTAL'], ascending=False).set_index(['source']
-            ).rename_axis(['Organisation'])
-
-        gr2 = dflogs.groupby(["source","level","msg"],
-                             observed=True, as_index=False
-            ).size().rename(copy=False,
-                columns={"source": "Organisation", "level":"Sévérité", "size": "Occurences", "msg": "Problème"})
-
-        self.msg_by_source = gr2.groupby(["Organisation","Occurences","Sévérité","Problème"],
-                observed=True, group_keys=True, sort=True, as_index=True).count() \
+        # Built from the online counters of the logger, not from the records
+        self.severity_stats = tables.sort_counts(self.log_stats.by_level.items())
+
+        # Levels by organisation, with the totals of every organisation and of every level
+        levels = sorted(set(level for _, level in self.log_stats.by_source_level))
+        by_source = {}
+        for (source, level), size in sorted(self.log_stats.by_source_level.items()):
+            by_source.setdefault(source, dict.fromkeys(levels, "-"))[level] = size
+        by_source["TOTAL"] = {level: self.log_stats.by_level[level] for level in levels}
+        rows = [([source], [*sizes.values(), sum(size for size in sizes.values() if size != "-")]) for source, sizes in by_source.items()]
+        # As with pandas, levels are only numeric columns when no organisation misses one
+        complete = all(size != "-" for sizes in by_source.values() for size in sizes.values())
+        self.severity_by_source = tables.Table(["Organisation"], levels + ["TOTAL"], columns_name="Sévérité",
+                                               numeric=levels + ["TOTAL"] if complete else ["TOTAL"])
+        for labels, values in sorted(rows, key=lambda row: row[1][-1], reverse=True):
+            self.severity_by_source.append(labels, values)
+
+        self.msg_by_source = tables.Table(["Organisation", "Occurences", "Sévérité", "Problème"])
+        for labels in sorted((source, size, level, msg) for (source, level, msg), size in self.log_stats.by_source_level_msg.items()):
+            self.msg_by_source.append(labels)
 
     def render_stdout(self):
         if self.source_line_count > 0:
-            print(f"{self.source_line_count} lignes (PDCs) en entrée | {self.source_line_count - self.source_distinct_pdc_id_count} PDCs en double")
+            # The estimate of the distinct PDCs can exceed the line count
+            duplicate_count = max(0, self.source_line_count - self.source_distinct_pdc_id_count)
+            estimated = " (estimation)" if self.source_counts_approximate else ""
+            print(f"{self.source_line_count} lignes (PDCs) en entrée | {duplicate_count} PDCs en double{estimated}")
 
         print(f"{len(self.station_list)} stations reconnues sur {self.source_distinct_station_id_count} station_id distincts en entrée")
-        print(f"{len(self.logs)} problèmes trouvés pour {self.source_distinct_pdc_id_count} PDCs distincts en entrée (il peut exister plusieurs problèmes par PDC/station):")
-        for (level, msg), count in sorted(Counter([(elem['level'], elem['msg']) for elem in self.logs]).items()):
+        print(f"{self.log_stats.count} problèmes trouvés pour {self.source_distinct_pdc_id_count} PDCs distincts en entrée (il peut exister plusieurs problèmes par PDC/station):")
+        for (level, msg), count in sorted(self.log_stats.by_level_msg.items()):
             print(f" > {'['+level+']':>10s} {count:>5d} x {msg}")
+        if self.changes is not None:
+            print(self.changes.summary())
 
-        if self.are_packages_installed:
-            import pandas as pd
-            pd.options.display.max_colwidth = 50
-            pd.options.display.max_columns = 10
-            pd.options.display.width = 200
-            print("\n"+self.severity_stats.to_string())
+        if self.severity_by_source is not None:
+            print("\n"+tables.counts_to_string("Severité", self.severity_stats))
 
             print("\nTop 25 Organisations les plus problematiques:\n")
-            print(self.severity_by_source.head(26))
+            print(self.severity_by_source.to_string(max_rows=26))
 
     def render_html(self):
         if not self.are_packages_installed:
             return
 
-        import pandas as pd
         from jinja2 import Environment, FileSystemLoader
+        from markdown import markdown
         jinja = Environment(
             loader=FileSystemLoader("./templates")
         )
@@ -126,7 +128,11 @@ class Report:
             out="* [opendata_stations.csv](opendata_stations.csv) : Liste des stations\n"
                 "* [opendata_networks.csv](opendata_networks.csv) : Liste des couples opérateurs / réseau (à des fins de corrections de typo, ajout de tag wikidata, etc)\n"
                 "* [opendata_errors.csv](opendata_errors.csv) : Liste des erreurs rencontrées durant le traitement (avec détail au cas par cas)\n"
+                "* [opendata_name_suggestions.csv](opendata_name_suggestions.csv) : Noms d'opérateurs / réseaux absents de fixes_networks.csv, avec la correction la plus proche et son indice de confiance\n"
         ))
+        if self.changes is not None:
+            chunks[-1].out += ("* [opendata_station_changes.csv](opendata_station_changes.csv) : Stations ajoutées, supprimées ou modifiées (avec les champs modifiés) depuis le run précédent\n"
+                               "* [opendata_error_changes.csv](opendata_error_changes.csv) : Problèmes nouveaux ou résolus depuis le run précédent\n")
         with utils.Capturing() as output:
             self.render_stdout()
         chunks.append(Chunk(
@@ -135,15 +141,22 @@ class Report:
         ))
         chunks.append(Chunk(
             title="Sévérité par organisation",
-            out=pd.DataFrame(self.severity_by_source).to_html(border=0),
+            out=self.severity_by_source.to_html(),
             html=True,
         ))
         chunks.append(Chunk(
             title="Problèmes par organisation",
-            out=pd.DataFrame(self.msg_by_source).to_html(border=0),
+            out=self.msg_by_source.to_html(),
             html=True,
         ))
 
+        if self.changes is not None:
+            chunks.append(Chunk(
+                title="Évolutions depuis le run précédent",
+                out=self.changes.table().to_html(),
+                html=True,
+            ))
+
         if len(self.power_stats) > 0:
             with utils.Capturing() as output:
                 print(" EF  |   T2  | Chademo |  CCS  |")
@@ -154,41 +167,80 @@ class Report:
                 out="\n".join(output),
             ))
 
+        if self.profile is not None:
+            chunks.append(Chunk(
+                title="Profilage",
+                markdown=True,
+                out=self.profile.markdown(),
+            ))
+
         template = jinja.get_template(f"template.{self.template_data.get('format')}")
         report = template.render({**self.template_data, "chunks": chunks, })
         with open(self.template_data.get("file_name"), "w") as out:
             out.write(report)
 
-    def _store_history(self):
+    def store_history(self):
+        """ Appends the counts of the run, and the profile of its stages (--profile), to the history file """
         data = {
             "date": dt.date.today(),
             "in_line_count": self.source_line_count,
             "in_distinct_pdc_id_count": self.source_distinct_pdc_id_count,
             "in_distinct_station_id_count": self.source_distinct_station_id_count,
             "out_station_count": len(self.station_list),
-            "logs_count": len(self.logs),
-            "blocking_count": int(self.severity_stats.loc[["blocking"]].iloc[0]),
-            "error_count": int(self.severity_stats.loc[["error"]].iloc[0]),
-            "warning_count": int(self.severity_stats.loc[["warning"]].iloc[0]),
+            "logs_count": self.log_stats.count,
+            "blocking_count": self.log_stats.by_level["blocking"],
+            "error_count": self.log_stats.by_level["error"],
+            "warning_count": self.log_stats.by_level["warning"],
         }
-        with open(HISTORY_FILE, "+a") as f:
+        # Without --profile, the columns of the history are left as they are
+        if self.profile is not None:
+            data.update(self.profile.history_columns())
+        fieldnames = list(data)
+        if os.path.isfile(HISTORY_FILE):
+            fieldnames = self._upgrade_history(fieldnames)
+        else:
+            print("WARNING! Creating new history file")
+        with open(HISTORY_FILE, "a") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, lineterminator="\n")
             if f.tell() == 0:
-                print("WARNING! Creating new history file")
-                f.write(",".join(data.keys()) + "\n")
-            f.write(",".join(map(str, data.values())) + "\n")
+                writer.writeheader()
+            writer.writerow(data)
+
+    @staticmethod
+    def _upgrade_history(fieldnames):
+        """ Adds the missing columns to the history file, empty for the previous runs. Returns its columns """
+        with open(HISTORY_FILE) as f:
+            reader = csv.DictReader(f)
+            rows = list(reader)
+            header = reader.fieldnames or []
+        missing = [name for name in fieldnames if name not in header]
+        if not missing:
+            return header
+        print("WARNING! Adding new columns to the history file")
+        with open(HISTORY_FILE + ".tmp", "w") as f:
+            writer = csv.DictWriter(f, fieldnames=header + missing, lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(HISTORY_FILE + ".tmp", HISTORY_FILE)
+        return header + missing
 
 if __name__ == "__main__":
     """ This part is used for testing/development.
         Run it whith: `python -m modules.report`
     """
-    import csv
+    from .import_logger import LogStats
+    from .input_stats import read_input_stats
+    from . import snapshot
 
-    logs = []
+    log_stats = LogStats()
     with open("output/opendata_errors.csv") as csvfile:
         reader = csv.DictReader(csvfile, delimiter=',')
-        logs = [row for row in reader]
+        for row in reader:
+            log_stats.add(row['level'], row['source'], row['msg'])
 
-    r = Report("opendata_irve.csv", logs, station_list=[], power_stats=[])
+    # Only the id columns of the snapshot of the input are loaded, if a run cached one
+    input_stats = read_input_stats("opendata_irve.csv", snapshot=snapshot.find("opendata_irve.csv"))
+    r = Report("opendata_irve.csv", log_stats, input_stats, station_list=[], power_stats=[])
     r.generate_report()
     r.render_stdout()
     r.render_html()
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""
+Differences between the stations and errors of two runs.
+
+output/history.csv only keeps the counts of every run. This compares the stations
+and errors files of the current run with those of a previous run (e.g. the files
+published on gh-pages), to tell which stations were added, removed or modified (and
+which of their fields changed), and which errors are new or were resolved, by
+organisation.
+
+Both comparisons are hash joins in a single streamed pass over the current file: only
+the previous stations, indexed by station_id, and the previous errors, counted by their
+full line (the same error can be logged more than once), are held in memory. Lines are
+plain tuples of strings, and unchanged stations are told apart by comparing their tuples
+at once.
+"""
+import csv
+import os
+from collections import Counter
+
+from . import tables
+
+STATIONS_FILE = "opendata_stations.csv"
+ERRORS_FILE = "opendata_errors.csv"
+STATION_CHANGES_FILE = "output/opendata_station_changes.csv"
+ERROR_CHANGES_FILE = "output/opendata_error_changes.csv"
+
+ADDED, REMOVED, MODIFIED = "added", "removed", "modified"
+NEW, RESOLVED = "new", "resolved"
+COUNTS = [ADDED, REMOVED, MODIFIED, NEW, RESOLVED]
+COUNT_LABELS = ["Stations ajoutées", "Stations supprimées", "Stations modifiées", "Nouveaux problèmes", "Problèmes résolus"]
+
+def _read(file_name):
+    """ Header and rows (tuples) of a CSV file """
+    with open(file_name, newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, [])
+        return header, [tuple(row) for row in reader if row]
+
+def _stream(file_name):
+    """ Header and iterator over the rows (tuples) of a CSV file, read as they come """
+    csvfile = open(file_name, newline='')
+    reader = csv.reader(csvfile)
+    header = next(reader, [])
+    def rows():
+        with csvfile:
+            for row in reader:
+                if row:
+                    yield tuple(row)
+    return header, rows()
+
+class RunDiff:
+    """ Changes from the previous run, counted by organisation """
+    def __init__(self):
+        # (change, station_id, source, field, previous value, value)
+        self.station_changes = []
+        # (change, *error line)
+        self.error_changes = []
+        self.error_header = []
+        self.by_source = {}
+
+    def _count(self, source, change):
+        self.by_source.setdefault(source, Counter())[change] += 1
+
+    def totals(self):
+        totals = Counter()
+        for counts in self.by_source.values():
+            totals.update(counts)
+        return totals
+
+    def compare_stations(self, previous_file, current_file):
+        previous_header, previous_rows = _read(previous_file)
+        header, rows = _stream(current_file)
+        id_column, source_column = header.index('id_station_itinerance'), header.index('source_grouped')
+        previous_id_column = previous_header.index('id_station_itinerance')
+        previous_source_column = previous_header.index('source_grouped')
+        previous = {row[previous_id_column]: row for row in previous_rows}
+        # Fields of both files, compared by position in each file. The fast path compares whole rows
+        same_header = previous_header == header
+        fields = [(name, previous_header.index(name), i) for i, name in enumerate(header) if name in previous_header]
+
+        for row in rows:
+            station_id, source = row[id_column], row[source_column]
+            previous_row = previous.pop(station_id, None)
+            if previous_row is None:
+                self.station_changes.append((ADDED, station_id, source, "", "", ""))
+                self._count(source, ADDED)
+                continue
+            if same_header and previous_row == row:
+                continue
+            changed = [(name, previous_row[p] if p < len(previous_row) else "", row[c] if c < len(row) else "")
+                       for name, p, c in fields]
+            changed = [change for change in changed if change[1] != change[2]]
+            if changed:
+                self.station_changes += [(MODIFIED, station_id, source, *change) for change in changed]
+                self._count(source, MODIFIED)
+        for station_id, row in previous.items():
+            self.station_changes.append((REMOVED, station_id, row[previous_source_column], "", "", ""))
+            self._count(row[previous_source_column], REMOVED)
+
+    def compare_errors(self, previous_file, current_file):
+        previous_header, previous_rows = _read(previous_file)
+        header, rows = _stream(current_file)
+        self.error_header = header
+        # Lines of the previous file in the column order of the current one
+        if previous_header != header:
+            positions = [previous_header.index(name) if name in previous_header else None for name in header]
+            previous_rows = [tuple(row[p] if p is not None and p < len(row) else "" for p in positions) for row in previous_rows]
+        source_column = header.index('source')
+        previous = Counter(previous_rows)
+        for row in rows:
+            if previous[row] > 0:
+                previous[row] -= 1
+            else:
+                self.error_changes.append((NEW, *row))
+                self._count(row[source_column], NEW)
+        for row, count in previous.items():
+            for _ in range(count):
+                self.error_changes.append((RESOLVED, *row))
+                self._count(row[source_column], RESOLVED)
+
+    def write(self, station_changes_file=STATION_CHANGES_FILE, error_changes_file=ERROR_CHANGES_FILE):
+        with open(station_changes_file, 'w') as ofile:
+            writer = csv.writer(ofile)
+            writer.writerow(["change", "station_id", "source", "field", "previous_value", "value"])
+            writer.writerows(self.station_changes)
+        with open(error_changes_file, 'w') as ofile:
+            writer = csv.writer(ofile)
+            writer.writerow(["change"] + self.error_header)
+            writer.writerows(self.error_changes)
+
+    def table(self):
+        """ Counts of every change by organisation, organisations with the most changes first """
+        table = tables.Table(["Organisation"], COUNT_LABELS + ["TOTAL"], columns_name="Évolution")
+        rows = [([source], [counts[change] for change in COUNTS]) for source, counts in self.by_source.items()]
+        for labels, values in sorted(rows, key=lambda row: (-sum(row[1]), row[0])):
+            table.append(labels, values + [sum(values)])
+        totals = self.totals()
+        table.append(["TOTAL"], [totals[change] for change in COUNTS] + [sum(totals.values())])
+        return table
+
+    def summary(self):
+        totals = self.totals()
+        return ("{} stations ajoutées, {} supprimées, {} modifiées | {} nouveaux problèmes, {} résolus depuis le run précédent"
+                .format(*(totals[change] for change in COUNTS)))
+
+def compare_runs(previous_dir, current_dir="output"):
+    """ RunDiff of the stations and errors files of two output directories, None if the previous run has none """
+    previous = [os.path.join(previous_dir, name) for name in (STATIONS_FILE, ERRORS_FILE)]
+    if not all(os.path.isfile(file_name) for file_name in previous):
+        print(f"WARNING! No previous {STATIONS_FILE} and {ERRORS_FILE} in {previous_dir}, changes are not computed")
+        return None
+    diff = RunDiff()
+    diff.compare_stations(previous[0], os.path.join(current_dir, STATIONS_FILE))
+    diff.compare_errors(previous[1], os.path.join(current_dir, ERRORS_FILE))
+    return diff
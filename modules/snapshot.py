@@ -0,0 +1,185 @@
+"""
+Columnar binary snapshots of the parsed input, cached between runs.
+
+The first read of an input parses the CSV once and stores every column dictionary
+encoded: the distinct values of the column (a UTF-8 blob and its offsets) and the
+code of the value of every row (an int32 .npy file). Snapshots are keyed by the hash
+of the input content, so reruns on the same file, and the later stages of a run,
+load columns from memory-mapped codes instead of parsing the CSV text again.
+
+Missing fields of short rows are kept as missing (code -1), and the fields of long rows
+beyond the header are kept aside, so that rows are the csv.DictReader ones (those extra
+fields being a list under the None key).
+"""
+import csv
+import hashlib
+import itertools
+import json
+import os
+import shutil
+
+import numpy as np
+
+from .compressed import open_input
+
+CACHE_DIR = "cache/snapshots"
+# Least recently used snapshots are removed beyond this count
+MAX_SNAPSHOTS = 3
+# Bump whenever the layout of the snapshot files changes
+SNAPSHOT_VERSION = 2
+MISSING = -1
+# Rows encoded, and decoded by value_rows, at once, to bound the memory used by the snapshots
+CHUNK_ROWS = 1 << 14
+
+def content_hash(file_name):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_name, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class Snapshot:
+    """ Columns of a parsed CSV file, loaded on demand from a snapshot directory """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.header = meta["header"]
+        self.row_count = meta["row_count"]
+        # Fields beyond the header of the long rows, by row index
+        self.extra_fields = {int(index): fields for index, fields in meta["extra_fields"].items()}
+        self._uniques = {}
+
+    def _path(self, index, kind):
+        return os.path.join(self.directory, "%d.%s" % (index, kind))
+
+    def codes(self, name):
+        """ Memory-mapped code of the value of every row, MISSING for missing fields """
+        return np.load(self._path(self.header.index(name), "codes.npy"), mmap_mode='r')
+
+    def uniques(self, name):
+        """ Distinct values of a column, in order of first appearance """
+        if name not in self._uniques:
+            index = self.header.index(name)
+            offsets = np.load(self._path(index, "offsets.npy")).tolist()
+            with open(self._path(index, "strings"), 'rb') as f:
+                blob = f.read()
+            self._uniques[name] = [blob[start:end].decode() for start, end in zip(offsets, offsets[1:])]
+        return self._uniques[name]
+
+    def column(self, name, missing=None):
+        """ Values of a column as an object array, missing fields being `missing` """
+        # The code of missing fields (-1) picks the last value
+        uniques = np.array(self.uniques(name) + [missing], dtype=object)
+        return uniques[self.codes(name)]
+
+    def value_rows(self, missing=None):
+        """ Yields the values of the header columns of every row, as lists """
+        columns = [self.uniques(name) + [missing] for name in self.header]
+        codes = [self.codes(name) for name in self.header]
+        for start in range(0, self.row_count, CHUNK_ROWS):
+            for row_codes in zip(*(column_codes[start:start + CHUNK_ROWS].tolist() for column_codes in codes)):
+                yield list(map(list.__getitem__, columns, row_codes))
+
+    def rows(self):
+        """ Yields every row as a dict, as csv.DictReader would """
+        header = self.header
+        extra_fields = self.extra_fields
+        for index, values in enumerate(self.value_rows()):
+            row = dict(zip(header, values))
+            if index in extra_fields:
+                row[None] = list(extra_fields[index])
+            yield row
+
+class _ColumnWriter:
+    """ Dictionary encoding of a column, the codes of every chunk of rows being appended to a raw file """
+    def __init__(self, directory, index):
+        self.path = os.path.join(directory, "%d." % index)
+        self.positions = {}
+        self.count = 0
+        self.codes_file = open(self.path + "codes.raw", 'wb')
+
+    def add(self, values):
+        positions = self.positions
+        codes = np.array([MISSING if value is None else positions.setdefault(value, len(positions)) for value in values], dtype=np.int32)
+        codes.tofile(self.codes_file)
+        self.count += len(codes)
+
+    def close(self):
+        self.codes_file.close()
+        # The raw codes, behind the .npy header of their now known length
+        with open(self.path + "codes.npy", 'wb') as f:
+            np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(np.dtype(np.int32)),
+                                                     'fortran_order': False, 'shape': (self.count,)})
+            with open(self.path + "codes.raw", 'rb') as codes_file:
+                shutil.copyfileobj(codes_file, f)
+        os.remove(self.path + "codes.raw")
+        encoded = [value.encode() for value in self.positions]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        np.save(self.path + "offsets.npy", offsets)
+        with open(self.path + "strings", 'wb') as f:
+            f.write(b"".join(encoded))
+
+def _write_snapshot(input_file, directory):
+    """ Encodes the columns of input_file by chunks of CHUNK_ROWS rows, only their distinct values being kept in memory """
+    extra_fields = {}
+    row_count = 0
+    with open_input(input_file) as csvfile:
+        reader = csv.reader(csvfile, delimiter=',')
+        header = next(reader)
+        columns = []
+        try:
+            columns += [_ColumnWriter(directory, index) for index in range(len(header))]
+            rows = (values for values in reader if values)
+            while chunk := list(itertools.islice(rows, CHUNK_ROWS)):
+                for index, values in enumerate(chunk, row_count):
+                    if len(values) > len(header):
+                        extra_fields[index] = values[len(header):]
+                # Short rows are padded with None, up to the header length
+                chunk_columns = itertools.chain(itertools.zip_longest(*chunk), itertools.repeat([None] * len(chunk)))
+                for column, values in zip(columns, chunk_columns):
+                    column.add(values)
+                row_count += len(chunk)
+        finally:
+            for column in columns:
+                column.codes_file.close()
+    for column in columns:
+        column.close()
+    with open(os.path.join(directory, "meta.json"), 'w') as f:
+        json.dump({"version": SNAPSHOT_VERSION, "header": header, "row_count": row_count, "extra_fields": extra_fields}, f)
+
+def _evict(cache_dir, keep):
+    snapshots = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if not name.endswith(".tmp")]
+    snapshots.sort(key=os.path.getmtime, reverse=True)
+    for directory in snapshots[keep:]:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def _directory(input_file, cache_dir):
+    return os.path.join(cache_dir, "%s-v%d" % (content_hash(input_file), SNAPSHOT_VERSION))
+
+def find(input_file, cache_dir=CACHE_DIR):
+    """ Snapshot of input_file if it is in the cache, else None. Nothing is written to the cache """
+    directory = _directory(input_file, cache_dir)
+    return Snapshot(directory) if os.path.isdir(directory) else None
+
+def load(input_file, cache_dir=CACHE_DIR):
+    """ Snapshot of input_file, parsed and stored first if it is not in the cache yet """
+    directory = _directory(input_file, cache_dir)
+    if not os.path.isdir(directory):
+        tmp_dir = directory + ".%d.tmp" % os.getpid()
+        os.makedirs(tmp_dir)
+        try:
+            _write_snapshot(input_file, tmp_dir)
+            os.replace(tmp_dir, directory)
+        except OSError:
+            # Stored meanwhile by another run
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(directory):
+                raise
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+    os.utime(directory)
+    _evict(cache_dir, MAX_SNAPSHOTS)
+    return Snapshot(directory)
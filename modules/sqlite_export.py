@@ -0,0 +1,256 @@
+"""
+Export of the input rows and of the logged issues to the SQLite database browsed by
+the frontend (output/irve.db).
+
+Both CSV files are streamed into temporary tables with executemany, in a single
+transaction and without journal; only the input rows of stations having issues are
+kept. The `logs` table is then built in log order by an indexed join, indexed on the
+columns the frontend filters on, and summarised in small tables for its overview
+screens. Column types are inferred from every value of the input and errors files
+(not only the exported ones), with the rules of pandas.read_csv, which was used before.
+Reals are parsed by Python's float(), as pandas does: SQLite's CAST does not round-trip
+every decimal text.
+"""
+import csv
+import hashlib
+import itertools
+import os
+import re
+import sqlite3
+
+from .compressed import open_input
+
+DB_FILE = "output/irve.db"
+ERRORS_FILE = "output/opendata_errors.csv"
+# Smaller pages mean less data fetched per query by a page-wise (HTTP Range) reader
+PAGE_SIZE = 4096
+BATCH_SIZE = 10000
+# Shaped after the queries of the frontend (frontend/js/constants.js)
+LOGS_INDEXES = [('station_id',), ('pdc_id',), ('source', 'msg'), ('level', 'msg')]
+# Pre-aggregated tables for its overview screens, which would otherwise scan the whole logs table
+SUMMARY_TABLES = {
+    "summary_organisation": """
+        SELECT datagouv_organization_or_owner, count(1) AS problemes FROM logs
+        GROUP BY datagouv_organization_or_owner ORDER BY problemes DESC""",
+    "summary_level_msg": """
+        SELECT level, msg, count(1) AS occurrences FROM logs
+        GROUP BY level, msg""",
+    "summary_organisation_msg": """
+        SELECT l.datagouv_organization_or_owner, problemes, level, count(1) AS occurrences, msg FROM logs l
+        LEFT JOIN summary_organisation o ON o.datagouv_organization_or_owner = l.datagouv_organization_or_owner
+        GROUP BY l.datagouv_organization_or_owner, level, msg ORDER BY problemes DESC, level""",
+}
+
+# Strings read as missing values by pandas.read_csv
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+             '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+BOOL_VALUES = {'True', 'TRUE', 'true', 'False', 'FALSE', 'false'}
+INT_RGX = re.compile(r"^[+-]?\d+$")
+
+# Column kinds
+BOOL, INT, REAL, TEXT = range(4)
+
+def _is_real(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+def _widen(kind, value):
+    """ Narrowest kind holding both the values of the given kind and value """
+    if value in BOOL_VALUES:
+        return BOOL if kind in (None, BOOL) else TEXT
+    if kind == BOOL:
+        return TEXT
+    if kind in (None, INT) and INT_RGX.match(value):
+        return INT
+    return REAL if kind != TEXT and _is_real(value) else TEXT
+
+class ColumnKinds:
+    """ Kinds of the columns of CSV rows, widened by every row passed to add() """
+    def __init__(self, column_count):
+        self.kinds = [None] * column_count
+        self.missing = [False] * column_count
+        # Columns that are not TEXT yet
+        self._open = list(range(column_count))
+
+    def add(self, values):
+        kinds, missing = self.kinds, self.missing
+        closed = False
+        for column in self._open:
+            value = values[column]
+            if value in NA_VALUES:
+                missing[column] = True
+                continue
+            kind = kinds[column] = _widen(kinds[column], value)
+            closed = closed or kind == TEXT
+        if closed:
+            self._open = [column for column in self._open if kinds[column] != TEXT]
+
+def _snapshot_kinds(snapshot):
+    """ ColumnKinds of the columns of a snapshot, from their distinct values """
+    import numpy as np
+
+    kinds = ColumnKinds(len(snapshot.header))
+    for column, name in enumerate(snapshot.header):
+        column_kinds = ColumnKinds(1)
+        for value in snapshot.uniques(name):
+            column_kinds.add((value,))
+        # Missing fields are empty values, as in _csv_rows
+        if np.any(snapshot.codes(name) < 0):
+            column_kinds.add(('',))
+        kinds.kinds[column], kinds.missing[column] = column_kinds.kinds[0], column_kinds.missing[0]
+    return kinds
+
+def _to_real(value):
+    return None if value is None else float(value)
+
+def _select_expression(table, column, kind, missing):
+    """ SQL expression converting the texts of a column to the type pandas would infer """
+    if kind == TEXT:
+        return f"{table}.{column}"
+    if kind == BOOL:
+        return f"CAST(CASE lower({table}.{column}) WHEN 'true' THEN 1 WHEN 'false' THEN 0 END AS INTEGER)"
+    if kind == INT and not missing:
+        return f"CAST({table}.{column} AS INTEGER)"
+    # Empty columns, and integer ones with missing values, are floats for pandas.
+    # The CAST of the float leaves it unchanged, but declares the REAL column
+    return f"CAST(to_real({table}.{column}) AS REAL)"
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _header(file_name):
+    with open_input(file_name) as csvfile:
+        return next(csv.reader(csvfile, delimiter=','))
+
+def _csv_rows(file_name):
+    """ Yields the (row index, values) of a CSV file, padded or truncated to the length of its header """
+    with open_input(file_name) as csvfile:
+        reader = csv.reader(csvfile, delimiter=',')
+        column_count = len(next(reader))
+        for index, values in enumerate(reader):
+            if len(values) != column_count:
+                if not values:
+                    continue
+                values = values[:column_count] + [''] * (column_count - len(values))
+            yield index, values
+
+def _read_rows(indexed_rows, keep_column=None, keep=None, kinds=None):
+    """
+    Yields the given (row index, values), missing values as None. Skips the rows whose
+    keep_column value does not satisfy keep() and the rows already seen (as a `SELECT DISTINCT` would).
+    Every row, skipped or not, is added to kinds (a ColumnKinds), if given.
+    """
+    seen = set()
+    for index, values in indexed_rows:
+        if kinds is not None:
+            kinds.add(values)
+        if keep is not None and not keep(values[keep_column]):
+            continue
+        digest = hashlib.blake2b("\x1f".join(values).encode(), digest_size=16).digest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        yield index, [None if value in NA_VALUES else value for value in values]
+
+def _snapshot_rows(snapshot, keep_column, keep):
+    """
+    Same rows as _read_rows(enumerate(snapshot.value_rows(missing='')), keep_column, keep), working
+    on the codes of the values: keep() and the missing value mapping only see distinct values.
+    """
+    import numpy as np
+
+    codes = np.stack([snapshot.codes(name) for name in snapshot.header], axis=1)
+    for column, name in enumerate(snapshot.header):
+        # Missing fields are empty values, as in _csv_rows
+        uniques = snapshot.uniques(name)
+        if '' in uniques:
+            codes[codes[:, column] < 0, column] = uniques.index('')
+    keep_uniques = snapshot.uniques(snapshot.header[keep_column])
+    keep_codes = [code for code, value in enumerate(keep_uniques) if keep(value)]
+    if keep(''):
+        keep_codes.append(-1)
+    codes = codes[np.isin(codes[:, keep_column], keep_codes)]
+    _, first_rows = np.unique(codes, axis=0, return_index=True)
+    # Code -1 picks the last value
+    columns = [[None if value in NA_VALUES else value for value in snapshot.uniques(name)] + [None] for name in snapshot.header]
+    for row_codes in codes[np.sort(first_rows)].tolist():
+        yield list(map(list.__getitem__, columns, row_codes))
+
+def _create_table(conn, table, header, rows, log_id=False):
+    """ Temporary table of texts, filled by batches of rows """
+    columns = [_quote(name) + " TEXT" for name in header]
+    placeholders = ["?"] * len(header)
+    if log_id:
+        columns.insert(0, "log_id INTEGER PRIMARY KEY")
+        placeholders.append("?")
+    conn.execute(f"CREATE TEMP TABLE {table} ({', '.join(columns)})")
+    insert = f"INSERT INTO {table} VALUES ({', '.join(placeholders)})"
+    while True:
+        batch = list(itertools.islice(rows, BATCH_SIZE))
+        if not batch:
+            break
+        conn.executemany(insert, batch)
+
+def create_sqlite(input_file, errors_file=ERRORS_FILE, db_file=DB_FILE, page_size=PAGE_SIZE, snapshot=None):
+    """
+    Creates db_file with a `logs` table: every distinct logged issue (log_id being its
+    position in errors_file) joined to the input rows of its station, or of its PDC
+    when the issue is about a PDC. See SUMMARY_TABLES for the other tables.
+    The input rows are read from snapshot (a modules.snapshot.Snapshot of input_file), if given.
+    """
+    tmp_file = db_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    conn = sqlite3.connect(tmp_file, isolation_level=None)
+    conn.create_function("to_real", 1, _to_real, deterministic=True)
+    try:
+        conn.execute(f"PRAGMA page_size = {int(page_size)}")
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA cache_size = -65536")
+        conn.execute("BEGIN")
+
+        log_header = _header(errors_file)
+        station_column = log_header.index('station_id')
+        log_kinds = ColumnKinds(len(log_header))
+        station_ids = set()
+        def log_rows():
+            for index, values in _read_rows(_csv_rows(errors_file), kinds=log_kinds):
+                station_ids.add(values[station_column])
+                yield [index, *values]
+        _create_table(conn, "log", log_header, log_rows(), log_id=True)
+
+        # Only the input rows of stations having issues can be joined, but the types are those of the whole input
+        if snapshot is not None:
+            irve_header = snapshot.header
+            irve_kinds = _snapshot_kinds(snapshot)
+            irve_rows = _snapshot_rows(snapshot, irve_header.index('id_station_itinerance'), station_ids.__contains__)
+        else:
+            irve_header = _header(input_file)
+            irve_kinds = ColumnKinds(len(irve_header))
+            irve_rows = (values for _, values in _read_rows(_csv_rows(input_file), irve_header.index('id_station_itinerance'),
+                                                            station_ids.__contains__, irve_kinds))
+        _create_table(conn, "irve", irve_header, irve_rows)
+        conn.execute("CREATE INDEX temp.irve_station_pdc ON irve (id_station_itinerance, id_pdc_itinerance)")
+
+        selected = ["log.log_id AS log_id"]
+        for table, header, kinds in (("log", log_header, log_kinds), ("irve", irve_header, irve_kinds)):
+            selected += [_select_expression(table, _quote(name), kind, missing) + " AS " + _quote(name)
+                         for name, kind, missing in zip(header, kinds.kinds, kinds.missing)]
+        conn.execute(f"""
+        CREATE TABLE logs AS
+        SELECT {", ".join(selected)}
+        FROM log LEFT JOIN irve ON irve.id_station_itinerance = log.station_id AND (log.pdc_id IS NULL OR irve.id_pdc_itinerance = log.pdc_id)
+        ORDER BY log.log_id""")
+        for columns in LOGS_INDEXES:
+            conn.execute(f"CREATE INDEX logs_{'_'.join(columns)} ON logs ({', '.join(map(_quote, columns))})")
+        for table, query in SUMMARY_TABLES.items():
+            conn.execute(f"CREATE TABLE {table} AS {query}")
+        conn.execute("COMMIT")
+        conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+    os.replace(tmp_file, db_file)
@@ -0,0 +1,102 @@
+"""
+Count tables of the report, in pure Python.
+
+The tables of the report are small aggregates of the logger counters: building them
+does not need pandas, whose import alone costs more than the rest of the report. They
+are rendered as text and HTML the way pandas' to_string() and to_html() did, so that
+the report and its history stay comparable from run to run.
+"""
+from operator import itemgetter
+
+# Longest cell shown in text, as pandas' display.max_colwidth
+MAX_COLWIDTH = 50
+
+def _label(value):
+    return str(value).replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def _escape(value):
+    return _label(value).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").strip()
+
+def _truncate(value):
+    return value[:MAX_COLWIDTH - 3] + "..." if len(value) > MAX_COLWIDTH else value
+
+def sort_counts(items):
+    """ (key, count) items by decreasing count, ties keeping their order """
+    return sorted(items, key=itemgetter(1), reverse=True)
+
+def counts_to_string(name, counts):
+    """ Text of (label, count) items, under the name of their labels """
+    if not counts:
+        return name
+    labels = [_label(label) for label, _ in counts]
+    values = [" %d" % count for _, count in counts]
+    label_width, value_width = max(map(len, labels)), max(map(len, values))
+    return "\n".join([name] + [label.ljust(label_width) + "   " + value.rjust(value_width)
+                               for label, value in zip(labels, values)])
+
+class Table:
+    """ Rows of values (ints, or "-" when missing) under labelled columns, indexed by one or more levels """
+    def __init__(self, index_names, columns=(), columns_name="", numeric=None):
+        self.index_names = list(index_names)
+        self.columns = list(columns)
+        self.columns_name = columns_name
+        # Columns of numbers, right aligned one space further in text. Default is the columns without missing values
+        self.numeric = numeric
+        # (index labels, values) tuples
+        self.rows = []
+
+    def append(self, labels, values=()):
+        self.rows.append((tuple(labels), list(values)))
+
+    def _is_numeric(self, column):
+        if self.numeric is not None:
+            return self.columns[column] in self.numeric
+        return all(isinstance(values[column], int) for _, values in self.rows)
+
+    def to_string(self, max_rows=None):
+        """ Text of the table, limited to its max_rows first rows """
+        rows = self.rows[:max_rows]
+        # Index levels, then every column, headed by the column name and a blank line
+        strcols = [[_label(self.columns_name) if level == len(self.index_names) - 1 else "", _label(name)]
+                   + [_truncate(_label(labels[level])) for labels, _ in rows]
+                   for level, name in enumerate(self.index_names)]
+        for column, name in enumerate(self.columns):
+            header = (" " if self._is_numeric(column) else "") + _label(name)
+            values = [_truncate(" " + _label(values[column])) for _, values in rows]
+            width = max([len(header)] + [len(value) for value in values])
+            strcols.append([header.rjust(width), "".rjust(width)] + [value.rjust(width) for value in values])
+        widths = [max(map(len, strcol)) for strcol in strcols]
+        return "\n".join(" ".join(cell.ljust(width) for cell, width in zip(cells, widths)) for cells in zip(*strcols))
+
+    def to_html(self):
+        """ HTML table, repeated labels of the outer index levels spanning their rows """
+        html = ['<table class="dataframe">', '  <thead>', '    <tr style="text-align: right;">']
+        header = [""] * (len(self.index_names) - 1) + [self.columns_name or ""] + self.columns
+        html += ["      <th>%s</th>" % _escape(name) for name in header]
+        html += ['    </tr>', '    <tr>']
+        html += ["      <th>%s</th>" % _escape(name) for name in self.index_names + [""] * len(self.columns)]
+        html += ['    </tr>', '  </thead>', '  <tbody>']
+
+        # Rows spanned by the label of every level of every row, 0 for the labels already shown above
+        levels = len(self.index_names)
+        spans = [[1] * levels for _ in self.rows]
+        for level in range(levels - 1):
+            start = 0
+            for i in range(1, len(self.rows)):
+                if self.rows[i][0][:level + 1] == self.rows[start][0][:level + 1]:
+                    spans[start][level] += 1
+                    spans[i][level] = 0
+                else:
+                    start = i
+
+        for (labels, values), row_spans in zip(self.rows, spans):
+            html.append('    <tr>')
+            for label, span in zip(labels, row_spans):
+                if span > 1:
+                    html.append('      <th rowspan="%d" valign="top">%s</th>' % (span, _escape(label)))
+                elif span == 1:
+                    html.append("      <th>%s</th>" % _escape(label))
+            html += ["      <td>%s</td>" % _escape(value) for value in values]
+            html.append('    </tr>')
+        html += ['  </tbody>', '</table>']
+        return "\n".join(html)
@@ -0,0 +1,193 @@
+"""
+Map tiles of the stations, for viewing them on a map without loading a national GeoJSON.
+
+Stations are put in a quadtree of Web Mercator tiles (z/x/y, as slippy maps). Tiles of
+MAX_ZOOM hold the stations themselves; tiles of lower zooms hold clusters, one for every
+cell of a 2**CLUSTER_BITS x 2**CLUSTER_BITS grid over the tile, with the station count,
+socket counts, max power and issue levels of the stations of the cell. Every tile is
+written as a GeoJSON file in output/tiles/<z>/<x>/<y>.geojson.
+
+The hash of every tile is derived from the stations it holds, bottom-up (the hash of a
+tile is the hash of the hashes of its 4 children). Hashes are kept in a manifest next to
+the tiles, so that a rerun only builds and writes the tiles whose stations changed, and
+removes the tiles left empty.
+"""
+import csv
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from json.encoder import encode_basestring
+
+import numpy as np
+
+TILES_DIR = "output/tiles"
+MANIFEST = "manifest.json"
+# Bump whenever the content of the tiles changes
+TILES_VERSION = 2
+# Tiles of higher zooms are those of MAX_ZOOM, overzoomed by the map
+MAX_ZOOM = 10
+CLUSTER_BITS = 3
+MAX_LATITUDE = 85.0511287798
+# Tiles are small files: their creation, not their content, is the bottleneck
+WRITE_THREADS = 4
+LEVELS = ['blocking', 'error', 'warning']
+
+SOCKETS = ['nb_EF_grouped', 'nb_T2_grouped', 'nb_combo_ccs_grouped', 'nb_chademo_grouped', 'nb_autre_grouped']
+POWERS = ['power_ef_grouped', 'power_t2_grouped', 'power_chademo_grouped', 'power_ccs_grouped']
+
+def read_levels(errors_file):
+    """ Most severe level logged for every station_id of the errors file """
+    severity = {level: i for i, level in enumerate(LEVELS)}
+    levels = {}
+    with open(errors_file) as csvfile:
+        for record in csv.DictReader(csvfile, delimiter=','):
+            station_id, level = record['station_id'], record['level']
+            if not station_id or level not in severity:
+                continue
+            if station_id not in levels or severity[level] < severity[levels[station_id]]:
+                levels[station_id] = level
+    return levels
+
+def _hash(text):
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+def tile_xy(lon, lat, zoom):
+    """ Web Mercator tiles of points (arrays of finite coordinates) """
+    n = 1 << zoom
+    lat = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = np.floor((np.asarray(lon, dtype=np.float64) + 180) / 360 * n)
+    y = np.floor((1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+# GeoJSON feature of a station, formatted without going through json.dumps for every station
+STATION_FEATURE = ('{"type":"Feature","geometry":{"type":"Point","coordinates":[%r,%r]},'
+                   '"properties":{"id":%s,"nom_operateur":%s,"nom_station":%s,"level":%s,'
+                   + ",".join('"%s":%%d' % name for name in SOCKETS) + ","
+                   + ",".join('"%s":%%r' % name for name in POWERS) + "}}")
+
+def _string(value):
+    return "null" if value is None else encode_basestring(str(value))
+
+def _station_feature(station_id, attributes, level):
+    return STATION_FEATURE % (float(attributes['Xlongitude']), float(attributes['Ylatitude']), _string(station_id),
+                              _string(attributes['nom_operateur']), _string(attributes['nom_station']), _string(level),
+                              *(int(attributes[name] or 0) for name in SOCKETS), *(float(attributes[name] or 0) for name in POWERS))
+
+def _cluster_feature(count, lon, lat, sockets, max_power, levels):
+    properties = {"count": count}
+    properties.update(zip(SOCKETS, sockets))
+    properties["max_power"] = max_power
+    properties.update(zip(LEVELS, levels))
+    coordinates = [round(lon / count, 6), round(lat / count, 6)]
+    return _dumps({"type": "Feature", "geometry": {"type": "Point", "coordinates": coordinates}, "properties": properties})
+
+def _groups(keys):
+    """ Distinct keys (sorted), and the positions of every key, in order, as (order, starts, counts) """
+    order = np.argsort(keys, kind='stable')
+    distinct, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+    return distinct, order, starts, counts
+
+def _write_tiles(tiles_dir, tiles):
+    directories = set()
+    for path, features in tiles:
+        file_name = os.path.join(tiles_dir, path + ".geojson")
+        directory = os.path.dirname(file_name)
+        if directory not in directories:
+            os.makedirs(directory, exist_ok=True)
+            directories.add(directory)
+        with open(file_name, 'w') as f:
+            f.write('{"type":"FeatureCollection","features":[%s]}' % ",".join(features))
+
+def build_tiles(station_list, levels, tiles_dir=TILES_DIR):
+    """ Writes the tiles of station_list whose stations changed since the previous build, and removes the tiles
+        left empty. Stations without finite coordinates are left out. Returns the counts of written and removed tiles
+    """
+    manifest_file = os.path.join(tiles_dir, MANIFEST)
+    previous, previous_tiles = {}, {}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        previous_tiles = manifest.get("tiles", {})
+        if manifest.get("version") == TILES_VERSION and manifest.get("max_zoom") == MAX_ZOOM:
+            previous = previous_tiles
+
+    # Stations in id order, as GeoJSON features, with their cell at MAX_ZOOM + CLUSTER_BITS
+    station_ids, features = [], []
+    for station_id in sorted(station_list):
+        attributes = station_list[station_id]['attributes']
+        if math.isfinite(attributes['Xlongitude']) and math.isfinite(attributes['Ylatitude']):
+            station_ids.append(station_id)
+            features.append(_station_feature(station_id, attributes, levels.get(station_id)))
+    attributes = [station_list[station_id]['attributes'] for station_id in station_ids]
+    lons = np.array([a['Xlongitude'] for a in attributes], dtype=np.float64)
+    lats = np.array([a['Ylatitude'] for a in attributes], dtype=np.float64)
+    sockets = np.array([[a[name] or 0 for name in SOCKETS] for a in attributes], dtype=np.int64).reshape(-1, len(SOCKETS))
+    max_powers = np.array([max(a[name] or 0 for name in POWERS) for a in attributes], dtype=np.float64)
+    station_levels = np.array([[levels.get(station_id) == level for level in LEVELS] for station_id in station_ids],
+                              dtype=np.int64).reshape(-1, len(LEVELS))
+    cell_x, cell_y = tile_xy(lons, lats, MAX_ZOOM + CLUSTER_BITS)
+
+    # Tiles of MAX_ZOOM, hashed from their features
+    tiles = {}
+    keys, order, starts, counts = _groups((cell_x >> CLUSTER_BITS) << 32 | (cell_y >> CLUSTER_BITS))
+    for key, start, count in zip(keys.tolist(), starts.tolist(), counts.tolist()):
+        tiles["%d/%d/%d" % (MAX_ZOOM, key >> 32, key & 0xffffffff)] = [features[i] for i in order[start:start + count].tolist()]
+    hashes = {path: _hash("".join(tile_features)) for path, tile_features in tiles.items()}
+    writes = [(path, tile_features) for path, tile_features in tiles.items() if previous.get(path) != hashes[path]]
+
+    # Hashes from the leaves up: a tile changes when one of its children does
+    keys = [tuple(map(int, path.split("/")[1:])) for path in tiles]
+    for zoom in range(MAX_ZOOM - 1, -1, -1):
+        children = {}
+        for x, y in keys:
+            children.setdefault((x >> 1, y >> 1), []).append((x, y))
+        for (x, y), tile_children in children.items():
+            hashes["%d/%d/%d" % (zoom, x, y)] = _hash("".join(hashes["%d/%d/%d" % (zoom + 1, cx, cy)] for cx, cy in sorted(tile_children)))
+        keys = list(children)
+
+    # Clusters of the cells of every zoom, only for the tiles to write
+    for zoom in range(MAX_ZOOM - 1, -1, -1):
+        shift = MAX_ZOOM - zoom
+        cells, order, starts, counts = _groups((cell_x >> shift) << 32 | (cell_y >> shift))
+        tile_keys = (cells >> 32 >> CLUSTER_BITS) << 32 | ((cells & 0xffffffff) >> CLUSTER_BITS)
+        distinct, tile_order, tile_starts, tile_counts = _groups(tile_keys)
+        changed = []
+        for i, key in enumerate(distinct.tolist()):
+            path = "%d/%d/%d" % (zoom, key >> 32, key & 0xffffffff)
+            if previous.get(path) != hashes[path]:
+                changed.append((path, tile_order[tile_starts[i]:tile_starts[i] + tile_counts[i]]))
+        if not changed:
+            continue
+        sums_lon = np.add.reduceat(lons[order], starts).tolist()
+        sums_lat = np.add.reduceat(lats[order], starts).tolist()
+        sums_sockets = np.add.reduceat(sockets[order], starts).tolist()
+        maxs_power = np.maximum.reduceat(max_powers[order], starts).tolist()
+        sums_levels = np.add.reduceat(station_levels[order], starts).tolist()
+        firsts = order[starts].tolist()
+        counts = counts.tolist()
+        for path, tile_cells in changed:
+            # A cell of a single station shows the station itself
+            writes.append((path, [features[firsts[c]] if counts[c] == 1 else
+                                  _cluster_feature(counts[c], sums_lon[c], sums_lat[c], sums_sockets[c], maxs_power[c], sums_levels[c])
+                                  for c in tile_cells.tolist()]))
+
+    with ThreadPoolExecutor(max_workers=WRITE_THREADS) as executor:
+        list(executor.map(_write_tiles, [tiles_dir] * WRITE_THREADS, [writes[i::WRITE_THREADS] for i in range(WRITE_THREADS)]))
+
+    # Tiles of the previous build, even of an older version, that are now empty
+    removed = [path for path in previous_tiles if path not in hashes]
+    for path in removed:
+        try:
+            os.remove(os.path.join(tiles_dir, path + ".geojson"))
+        except FileNotFoundError:
+            pass
+
+    os.makedirs(tiles_dir, exist_ok=True)
+    with open(manifest_file, 'w') as f:
+        json.dump({"version": TILES_VERSION, "max_zoom": MAX_ZOOM, "cluster_bits": CLUSTER_BITS, "tiles": hashes}, f)
+    return len(writes), len(removed)
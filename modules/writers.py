@@ -0,0 +1,72 @@
+"""
+Output files of the grouped stations.
+
+The stations CSV, the operator/network list and the GeoJSON export are all derived
+from station_list: they are written by independent writers, run concurrently on a
+thread pool, instead of re-reading the stations CSV afterwards (the networks list used
+to be built with `xsv select | xsv sort | uniq`).
+"""
+import csv
+import json
+import math
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .grouping import station_fieldnames
+
+OUTPUT_DIR = "output"
+STATIONS_FILE = "opendata_stations.csv"
+NETWORKS_FILE = "opendata_networks.csv"
+GEOJSON_FILE = "opendata_stations.geojson"
+NETWORK_ATTRIBUTES = ['nom_operateur', 'nom_enseigne']
+
+def write_stations(station_list, file_name):
+    """ One line per station. Returns the station count """
+    with open(file_name, 'w') as ofile:
+        writer = csv.DictWriter(ofile, fieldnames=station_fieldnames)
+        writer.writeheader()
+        for station in station_list.values():
+            writer.writerow(station['attributes'])
+    return len(station_list)
+
+def write_networks(station_list, file_name):
+    """ Distinct operator/network pairs, sorted, with their station count. Returns the pair count """
+    counts = Counter(tuple(station['attributes'][name] or "" for name in NETWORK_ATTRIBUTES) for station in station_list.values())
+    with open(file_name, 'w') as ofile:
+        writer = csv.writer(ofile)
+        writer.writerow(NETWORK_ATTRIBUTES + ['station_count'])
+        for pair, count in sorted(counts.items()):
+            writer.writerow([*pair, count])
+    return len(counts)
+
+def write_geojson(station_list, file_name):
+    """
+    One point feature per station, with the attributes of the stations CSV. Stations with
+    non-finite coordinates ("nan", "inf") are skipped: JSON has no NaN. Returns the feature count
+    """
+    count = 0
+    with open(file_name, 'w') as ofile:
+        ofile.write('{"type": "FeatureCollection", "features": [')
+        for station in station_list.values():
+            attributes = station['attributes']
+            if not (math.isfinite(attributes['Xlongitude']) and math.isfinite(attributes['Ylatitude'])):
+                continue
+            feature = {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [attributes['Xlongitude'], attributes['Ylatitude']]},
+                "properties": {name: attributes.get(name) for name in station_fieldnames},
+            }
+            ofile.write(("," if count else "") + "\n" + json.dumps(feature, ensure_ascii=False, allow_nan=False))
+            count += 1
+        ofile.write("\n]}\n")
+    return count
+
+def write_outputs(station_list, output_dir=OUTPUT_DIR, geojson=False):
+    """ Writes the output files of station_list to output_dir concurrently. Returns the line (or feature) count of every file """
+    writers = {STATIONS_FILE: write_stations, NETWORKS_FILE: write_networks}
+    if geojson:
+        writers[GEOJSON_FILE] = write_geojson
+    with ThreadPoolExecutor(max_workers=len(writers)) as executor:
+        futures = {name: executor.submit(writer, station_list, os.path.join(output_dir, name)) for name, writer in writers.items()}
+        return {name: future.result() for name, future in futures.items()}